@@ -0,0 +1 @@
+"""Benchmarks for nutcalc, run with `python -m benchmarks`."""
@@ -0,0 +1,214 @@
+"""Generators for synthetic nutcalc projects and USDA data exports.
+
+A project consists of:
+- a pantry of base foods defined from nutrients, split across several modules;
+- `depth` levels of recipes, each recipe made of `fanout` foods of the level
+  below it (level 0 being the pantry);
+- a journal of consecutive days, each made of a few meals drawn from the
+  top level of recipes (or the pantry, when there are no recipes).
+
+The shape of the import graph between pantry modules is one of:
+- 'chain': each pantry module imports the previous one;
+- 'star': pantry modules are independent and only imported by the recipes;
+- 'tree': pantry modules form a binary tree, each importing its parent.
+"""
+
+from dataclasses import dataclass, asdict
+from datetime import date, timedelta
+import csv
+import os
+import os.path as ospath
+import random
+
+SHAPES = ('chain', 'star', 'tree')
+
+NUTRIENT_NAMES = [
+    ('protein', 'g'), ('fat', 'g'), ('carbs', 'g'), ('water', 'g'),
+    ('calcium', 'mg'), ('iron', 'mg'), ('potassium', 'mg'), ('sodium', 'mg'),
+    ('zinc', 'mg'), ('cholesterol', 'mg'),
+]
+
+UNITS = ['cup', 'tbsp', 'slice', 'piece', 'x']
+
+@dataclass
+class ProjectParams:
+    pantry: int = 200
+    recipes: int = 50 # per level
+    fanout: int = 5
+    depth: int = 3
+    journal: int = 365
+    meals: int = 3 # per journal day
+    pantry_modules: int = 4
+    shape: str = 'chain'
+    seed: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+@dataclass
+class Project:
+    """A generated project: its modules' source text, keyed by module name, in
+    an order in which they can be loaded."""
+    params: ProjectParams
+    modules: dict[str, str]
+    imports: dict[str, list[str]]
+    journal_days: list[str]
+    recipe_names: list[str]
+
+    def write(self, root):
+        """Writes the project's modules as .nut files under `root`. Returns
+        the path of the root module, which imports everything else."""
+        os.makedirs(root, exist_ok=True)
+        for name, contents in self.modules.items():
+            with open(ospath.join(root, name + '.nut'), 'w') as f:
+                f.write(contents)
+        return ospath.join(root, 'journal.nut')
+
+def _quote(name):
+    return f"'{name}'"
+
+def _pantry_food(rng, name):
+    unit = rng.choice(UNITS)
+    parts = [
+        f'{rng.randint(1, 40)} {u} {n}'
+        for n, u in rng.sample(NUTRIENT_NAMES, rng.randint(2, 6))
+    ]
+    return (
+        f'1 {unit} {_quote(name)} weighs {rng.randint(10, 250)} g:\n' +
+        ''.join(f'- {p}\n' for p in parts),
+        unit,
+    )
+
+def _import_lines(imports):
+    return ''.join(f'import {i}\n' for i in imports)
+
+def generate_project(params: ProjectParams) -> Project:
+    """Generates a synthetic project according to the given parameters."""
+    if params.shape not in SHAPES:
+        raise ValueError(f'unknown import graph shape {params.shape}')
+    rng = random.Random(params.seed)
+    modules = {}
+    imports = {}
+
+    # Pantry, split into modules
+    level = [] # (food name, unit) of the previous level
+    n_mod = max(1, params.pantry_modules)
+    chunks = [[] for _ in range(n_mod)]
+    for i in range(params.pantry):
+        name = f'pantry {i}'
+        text, unit = _pantry_food(rng, name)
+        chunks[i % n_mod].append(text)
+        level.append((name, unit))
+    for m in range(n_mod):
+        if params.shape == 'chain':
+            deps = [f'pantry{m-1}'] if m > 0 else []
+        elif params.shape == 'tree':
+            deps = [f'pantry{(m-1) // 2}'] if m > 0 else []
+        else:
+            deps = []
+        name = f'pantry{m}'
+        imports[name] = deps
+        modules[name] = _import_lines(deps) + '\n' + '\n'.join(chunks[m])
+    previous_modules = [f'pantry{m}' for m in range(n_mod)]
+
+    # Recipe levels
+    recipe_names = []
+    for d in range(1, params.depth + 1):
+        foods = []
+        texts = []
+        for r in range(params.recipes):
+            name = f'recipe {d}.{r}'
+            parts = [
+                f'{"buy " if d == 1 and rng.random() < 0.5 else ""}'
+                f'{rng.randint(1, 4)} {unit} {_quote(food)}'
+                for food, unit in rng.sample(level, min(params.fanout, len(level)))
+            ]
+            texts.append(
+                f'{rng.randint(2, 8)} portion {_quote(name)}:\n' +
+                ''.join(f'- {p}\n' for p in parts)
+            )
+            foods.append((name, 'portion'))
+        name = f'recipes{d}'
+        imports[name] = previous_modules
+        modules[name] = _import_lines(previous_modules) + '\n' + '\n'.join(texts)
+        previous_modules = [name]
+        level = foods
+        recipe_names.extend(f for f, _ in foods)
+
+    # Journal
+    candidates = level
+    start = date(2020, 1, 1)
+    days = []
+    texts = []
+    for i in range(params.journal):
+        day = (start + timedelta(days=i)).isoformat()
+        parts = [
+            f'{rng.randint(1, 3)} {unit} {_quote(food)}'
+            for food, unit in (rng.choice(candidates) for _ in range(params.meals))
+        ]
+        texts.append(
+            f'1 x {_quote(day)}:\n' + ''.join(f'- {p}\n' for p in parts)
+        )
+        days.append(day)
+    imports['journal'] = previous_modules
+    modules['journal'] = _import_lines(previous_modules) + '\n' + '\n'.join(texts)
+
+    return Project(params, modules, imports, days, recipe_names)
+
+def generate_deep(depth=2000, leaves=3, seed=0) -> str:
+    """Generates a module nesting recipes `depth` levels deep: each level is
+    made of the level below it and `leaves` pantry foods, half of them bought.
+    Returns the module's source; its outermost food is named 'level <depth>'."""
+    rng = random.Random(seed)
+    texts = []
+    pantry = []
+    for i in range(leaves):
+        name = f'pantry {i}'
+        text, unit = _pantry_food(rng, name)
+        texts.append(text)
+        pantry.append((name, unit))
+    texts.append(
+        "1 portion 'level 0':\n" +
+        ''.join(f'- 1 {unit} {_quote(food)}\n' for food, unit in pantry)
+    )
+    for d in range(1, depth + 1):
+        parts = [f"1 portion 'level {d-1}'"] + [
+            f'{"buy " if i % 2 else ""}{rng.randint(1, 4)} {unit} {_quote(food)}'
+            for i, (food, unit) in enumerate(pantry)
+        ]
+        texts.append(
+            f'{rng.randint(2, 8)} portion {_quote(f"level {d}")}:\n' +
+            ''.join(f'- {p}\n' for p in parts)
+        )
+    return '\n'.join(texts)
+
+def generate_usda(root, foods=2000, nutrients_per_food=20, seed=0):
+    """Writes synthetic USDA FoodData Central CSVs under `root`. Returns the
+    paths of the food, food nutrient and nutrient files."""
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    food_path = ospath.join(root, 'food.csv')
+    food_nutrient_path = ospath.join(root, 'food_nutrient.csv')
+    nutrient_path = ospath.join(root, 'nutrient.csv')
+    nutrient_ids = list(range(1000, 1000 + 3 * nutrients_per_food))
+
+    with open(nutrient_path, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['id', 'name', 'unit_name', 'nutrient_nbr', 'rank'])
+        for i in nutrient_ids:
+            w.writerow([i, f'Nutrient {i}', rng.choice(['G', 'MG', 'UG']), i, i])
+
+    with open(food_path, 'w', newline='') as f, \
+        open(food_nutrient_path, 'w', newline='') as fn:
+        w = csv.writer(f)
+        wn = csv.writer(fn)
+        w.writerow(['fdc_id', 'data_type', 'description', 'food_category_id'])
+        wn.writerow(['id', 'fdc_id', 'nutrient_id', 'amount'])
+        row = 0
+        for fdc_id in range(100000, 100000 + foods):
+            w.writerow([fdc_id, 'foundation_food', f'Food {fdc_id}', 1])
+            for nut in rng.sample(nutrient_ids, nutrients_per_food):
+                wn.writerow([row, fdc_id, nut, f'{rng.uniform(0, 100):.3f}'])
+                row += 1
+
+    return food_path, food_nutrient_path, nutrient_path
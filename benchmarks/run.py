@@ -0,0 +1,410 @@
+"""Runs the benchmark suite, stores results as JSON and flags regressions
+against a previous run.
+
+    python -m benchmarks [--size small|medium|large] [-o results.json]
+                         [--compare baseline.json] [--threshold 0.1]
+
+Any parameter of the generated project can be overridden, e.g. `--depth 6` or
+`--shape star`, and `--emit DIR` writes the project out instead of running.
+"""
+
+from .generate import (
+    ProjectParams, generate_deep, generate_project, generate_usda,
+)
+from . import startup
+
+from nutcalc import interpret, model, parser, protocol, repl, usda
+
+from contextlib import redirect_stdout
+from io import StringIO
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+SIZES = {
+    'small': ProjectParams(pantry=50, recipes=10, depth=2, journal=60),
+    'medium': ProjectParams(),
+    'large': ProjectParams(
+        pantry=2000, recipes=300, fanout=8, depth=4, journal=3650,
+        pantry_modules=16,
+    ),
+}
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Registers a benchmark. A benchmark is a function taking the benchmark
+    context and returning a thunk to time; the setup work done before
+    returning the thunk is not timed."""
+    def wrapper(f):
+        BENCHMARKS[name] = f
+        return f
+    return wrapper
+
+class Context:
+    """Shared, lazily computed fixtures for the benchmarks."""
+    def __init__(self, params: ProjectParams, usda_foods: int, deep_depth: int):
+        self.params = params
+        self.project = generate_project(params)
+        self.usda_foods = usda_foods
+        self.deep_depth = deep_depth
+        self._deep = None
+        self._tmp = tempfile.TemporaryDirectory()
+        self._parsed = None
+        self._interpreter = None
+        self._usda_paths = None
+
+    def parse(self):
+        return {
+            name + '.nut': parser.parse_module(StringIO(text), source=name)
+            for name, text in self.project.modules.items()
+        }
+
+    def load(self, parsed):
+        interpreter = interpret.Interpreter(output_stream=StringIO())
+        for path, module in parsed.items():
+            interpreter.load_module(path, module)
+        return interpreter
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = self.parse()
+        return self._parsed
+
+    @property
+    def interpreter(self):
+        if self._interpreter is None:
+            self._interpreter = self.load(self.parsed)
+        return self._interpreter
+
+    @property
+    def usda_paths(self):
+        if self._usda_paths is None:
+            self._usda_paths = generate_usda(self._tmp.name, self.usda_foods)
+        return self._usda_paths
+
+    @property
+    def deep(self):
+        """A serving of the outermost food of a tree `deep_depth` levels
+        deep."""
+        if self._deep is None:
+            interpreter = interpret.Interpreter(output_stream=StringIO())
+            interpreter.load_module('deep.nut', parser.parse_module(
+                StringIO(generate_deep(self.deep_depth)),
+                source='deep',
+            ))
+            self._deep = model.QuantifiedFood(
+                quantity=model.Quantity(1, 'portion'),
+                tags=set(),
+                food=interpreter.foodDB.get(f'level {self.deep_depth}'),
+            )
+        return self._deep
+
+    def journal_foods(self):
+        db = self.interpreter.foodDB
+        return [
+            model.QuantifiedFood(
+                quantity=model.Quantity(1, 'x'),
+                tags=set(),
+                food=db.get(day),
+            )
+            for day in self.project.journal_days
+        ]
+
+    def close(self):
+        self._tmp.cleanup()
+
+@benchmark('parse')
+def bench_parse(ctx):
+    return ctx.parse
+
+@benchmark('load')
+def bench_load(ctx):
+    parsed = ctx.parsed
+    return lambda: ctx.load(parsed)
+
+@benchmark('nutrition_facts')
+def bench_nutrition_facts(ctx):
+    qfs = ctx.journal_foods()
+    return lambda: [interpret.nutrition_facts(qf) for qf in qfs]
+
+@benchmark('shopping_list')
+def bench_shopping_list(ctx):
+    qfs = ctx.journal_foods()
+    return lambda: [interpret.shopping_list(qf) for qf in qfs]
+
+# The recursive evaluators nutcalc used before switching to an explicit work
+# stack, kept as a baseline for the deep benchmarks.
+
+def recursive_nutrition_facts(qf: model.QuantifiedFood):
+    nut = None
+    match qf.food:
+        case model.Nutrient():
+            nut = model.NutritionFacts.of(qf.food)
+        case model.CompoundFood():
+            nut = model.NutritionFacts.empty()
+            for constituent in qf.food.constituents:
+                nut += recursive_nutrition_facts(constituent)
+    return nut * qf.scale_factor
+
+def recursive_shopping_list(qf: model.QuantifiedFood):
+    if 'use' in qf.tags:
+        return model.ShoppingList.empty()
+    if 'buy' in qf.tags:
+        return model.ShoppingList.singleton(qf)
+    match qf.food:
+        case model.Nutrient():
+            return model.ShoppingList.empty()
+        case model.CompoundFood():
+            slist = model.ShoppingList.empty()
+            for constituent in qf.food.constituents:
+                slist += recursive_shopping_list(constituent)
+            return slist * qf.scale_factor
+
+def with_recursion_limit(depth, f, *args):
+    """Calls f, allowing enough recursion for a tree `depth` levels deep."""
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 1000 + 2 * depth))
+    try:
+        return f(*args)
+    finally:
+        sys.setrecursionlimit(limit)
+
+@benchmark('deep_nutrition_facts')
+def bench_deep_nutrition_facts(ctx):
+    qf = ctx.deep
+    return lambda: interpret.nutrition_facts(qf)
+
+@benchmark('deep_nutrition_facts_recursive')
+def bench_deep_nutrition_facts_recursive(ctx):
+    qf = ctx.deep
+    return lambda: with_recursion_limit(
+        ctx.deep_depth, recursive_nutrition_facts, qf,
+    )
+
+@benchmark('deep_shopping_list')
+def bench_deep_shopping_list(ctx):
+    qf = ctx.deep
+    return lambda: interpret.shopping_list(qf)
+
+@benchmark('deep_shopping_list_recursive')
+def bench_deep_shopping_list_recursive(ctx):
+    qf = ctx.deep
+    return lambda: with_recursion_limit(
+        ctx.deep_depth, recursive_shopping_list, qf,
+    )
+
+@benchmark('usda_ingest')
+def bench_usda_ingest(ctx):
+    paths = ctx.usda_paths
+    return lambda: usda.USDA.load(*paths)
+
+@benchmark('repl')
+def bench_repl(ctx):
+    lines = [
+        f"print 1 x '{day}'" for day in ctx.project.journal_days[-50:]
+    ] + [
+        f"shop 1 x '{day}'" for day in ctx.project.journal_days[-50:]
+    ]
+    interpreter = ctx.interpreter
+    def run():
+        with redirect_stdout(StringIO()):
+            for line in lines:
+                repl.handle(interpreter, line)
+    return run
+
+@benchmark('sessions')
+def bench_sessions(ctx):
+    """Starts 200 sessions layered over one loaded project, each making a
+    definition of its own and querying it."""
+    base = ctx.load(ctx.parsed)
+    recipe = ctx.project.recipe_names[0]
+    define = parser.parse_stmt(f"1 x snack = 0.1 portion '{recipe}' + 10 g fat")
+    query = parser.parse_stmt('print 1 x snack')
+    def run():
+        for _ in range(200):
+            session = base.session(output_stream=StringIO())
+            session.execute(define)
+            session.execute(query)
+    return run
+
+@benchmark('protocol')
+def bench_protocol(ctx):
+    """Drives the worker protocol like the web frontend would, from a cold
+    parse cache: load the journal, answering batched import requests, then
+    pipeline a burst of queries."""
+    modules = ctx.project.modules
+    queries = [
+        {'type': 'eval', 'id': f'q{i}', 'contents': f"print 1 x '{day}'"}
+        for i, day in enumerate(ctx.project.journal_days[-100:])
+    ]
+    def run():
+        protocol.PARSE_CACHE.clear()
+        outbox = []
+        engine = protocol.Engine(outbox.append)
+        engine.dispatch({
+            'type': 'load-module',
+            'id': 'root',
+            'name': 'journal',
+            'contents': modules['journal'],
+        })
+        while outbox and outbox[-1]['type'] == 'load-modules':
+            message = outbox.pop()
+            engine.dispatch({
+                'type': 'response',
+                'of': message['id'],
+                'data': {
+                    'success': True,
+                    'data': {n: modules[n] for n in message['names']},
+                },
+            })
+        for query in queries:
+            engine.dispatch(query)
+        assert all(m['data']['success'] for m in outbox)
+    return run
+
+@benchmark('rank')
+def bench_rank(ctx):
+    """Runs a mix of rank and find queries over every food, once the
+    nutrient index is built."""
+    interpreter = ctx.interpreter
+    interpreter.nutrient_index()
+    queries = [
+        parser.parse_stmt(line) for line in [
+            'rank foods by protein limit 20',
+            'rank foods by protein per kcal limit 20',
+            'rank foods by potassium where sodium < 100 mg limit 20',
+            'find foods where sodium < 100 mg and protein > 10 g limit 20',
+        ]
+    ]
+    def run():
+        for _ in range(25):
+            for query in queries:
+                interpreter.execute(query)
+    return run
+
+@benchmark('startup')
+def bench_startup(ctx):
+    """Runs a one-shot `nutcalc -c` query in a fresh interpreter, as shell
+    scripts do, checking that it imports only what it needs."""
+    startup.check(startup.import_times())
+    return startup.import_times
+
+def time_thunk(thunk, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        thunk()
+        runs.append(time.perf_counter() - start)
+    return {
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.fmean(runs),
+    }
+
+def run(params: ProjectParams, names=None, repeat=5, usda_foods=2000,
+        deep_depth=2000):
+    """Runs the selected benchmarks (all of them by default) and returns the
+    results as a JSON-serializable dict."""
+    ctx = Context(params, usda_foods, deep_depth)
+    results = {}
+    try:
+        for name, bench in BENCHMARKS.items():
+            if names is not None and name not in names:
+                continue
+            results[name] = time_thunk(bench(ctx), repeat)
+            print(
+                f'{name:>30}: {results[name]["median"]*1000:10.2f} ms',
+                file=sys.stderr,
+            )
+    finally:
+        ctx.close()
+    return {
+        'version': 1,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params.as_dict(),
+        'repeat': repeat,
+        'benchmarks': results,
+    }
+
+def compare(old, new, threshold):
+    """Compares the median timings of two runs. Returns a list of rows
+    (name, old median, new median, ratio, regressed)."""
+    rows = []
+    if old.get('params') != new.get('params'):
+        print(
+            'warning: comparing runs with different project parameters',
+            file=sys.stderr,
+        )
+    for name, result in new['benchmarks'].items():
+        if name not in old['benchmarks']:
+            continue
+        before = old['benchmarks'][name]['median']
+        after = result['median']
+        ratio = after / before if before else float('inf')
+        rows.append((name, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m benchmarks')
+    ap.add_argument('--size', choices=SIZES, default='medium')
+    for field, default in ProjectParams().as_dict().items():
+        ap.add_argument(f'--{field.replace("_", "-")}', type=type(default))
+    ap.add_argument('--usda-foods', type=int, default=2000)
+    ap.add_argument(
+        '--deep-depth', type=int, default=2000,
+        help='nesting depth of the tree for the deep_* benchmarks',
+    )
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--only', action='append', choices=BENCHMARKS)
+    ap.add_argument('-o', '--output', help='write results as JSON to this path')
+    ap.add_argument(
+        '--emit', metavar='DIR',
+        help='only write the generated project as .nut files under DIR',
+    )
+    ap.add_argument('--compare', help='JSON results of a previous run')
+    ap.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative slowdown of the median to flag as a regression',
+    )
+    args = ap.parse_args(argv)
+
+    params = ProjectParams(**SIZES[args.size].as_dict())
+    for field in params.as_dict():
+        value = getattr(args, field)
+        if value is not None:
+            setattr(params, field, value)
+
+    if args.emit is not None:
+        print(generate_project(params).write(args.emit))
+        return
+
+    results = run(
+        params, args.only, args.repeat, args.usda_foods, args.deep_depth,
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = 0
+        for name, before, after, ratio, regressed in compare(
+            old, results, args.threshold,
+        ):
+            regressions += regressed
+            print(
+                f'{name:>30}: {before*1000:10.2f} ms -> {after*1000:10.2f} ms '
+                f'({ratio:.2f}x){"  REGRESSION" if regressed else ""}'
+            )
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,59 @@
+"""Measures the startup of the nutcalc CLI with `python -X importtime`."""
+
+import os
+import os.path as ospath
+import subprocess
+import sys
+
+ROOT = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+
+# A one-shot query, as shell scripts run it.
+QUERY = ['-c', 'print 10 g fat + 5 g protein']
+
+# Modules that a one-shot query must not import.
+UNWANTED = ('readline', 'nutcalc.repl', 'nutcalc.usda', 'nutcalc.protocol')
+
+def import_times(args=QUERY):
+    """Runs `python -X importtime -m nutcalc` with the given arguments.
+    Returns a dict mapping each imported module to its cumulative import time
+    in microseconds."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (ROOT, env.get('PYTHONPATH')) if p
+    )
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'nutcalc', *args],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        cumulative = cumulative.strip()
+        # Skips the header line, whose columns are titles.
+        if cumulative.isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+def check(times):
+    """Raises an AssertionError if a one-shot query imported a module it
+    shouldn't need."""
+    unwanted = [m for m in UNWANTED if m in times]
+    assert not unwanted, f'startup imports {", ".join(unwanted)}'
+
+def report(times, limit=15):
+    """The slowest nutcalc imports, as lines of text."""
+    ours = sorted(
+        ((t, m) for m, t in times.items() if m.split('.')[0] == 'nutcalc'),
+        reverse=True,
+    )
+    return [f'{t/1000:10.2f} ms  {m}' for t, m in ours[:limit]]
+
+if __name__ == '__main__':
+    times = import_times(sys.argv[1:] or QUERY)
+    print('\n'.join(report(times)))
+    check(times)
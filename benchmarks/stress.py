@@ -0,0 +1,142 @@
+"""Stress test of an interpreter shared between threads.
+
+    python -m benchmarks.stress [--readers 8] [--writers 4] [--seconds 5]
+
+Writer threads keep defining new foods and new units of a shared recipe, while
+reader threads keep querying the recipe and the writers' foods. Every query's
+output is checked against the answer it must have, whatever else is going on;
+the test exits with a nonzero status on any mismatch or error.
+"""
+
+from .generate import ProjectParams, generate_project
+
+from nutcalc import interpret, parser
+from nutcalc.error import NutcalcError
+
+from io import StringIO
+import argparse
+import random
+import sys
+import threading
+import time
+
+def query(interpreter, line):
+    out = StringIO()
+    interpreter.execute(parser.parse_stmt(line), output_stream=out)
+    return out.getvalue()
+
+class Stress:
+    def __init__(self, seconds):
+        project = generate_project(ProjectParams(
+            pantry=50, recipes=10, depth=2, journal=30,
+        ))
+        self.interpreter = interpret.Interpreter(output_stream=StringIO())
+        for name, text in project.modules.items():
+            self.interpreter.load_module(
+                name + '.nut',
+                parser.parse_module(StringIO(text), source=name),
+            )
+        self.recipe = project.recipe_names[-1]
+        self.portion = query(
+            self.interpreter, f"print 1 portion '{self.recipe}'",
+        )
+        self.shopping = query(
+            self.interpreter, f"shop 1 portion '{self.recipe}'",
+        )
+        self.deadline = time.monotonic() + seconds
+        # Names and fat content of the foods defined by writers so far
+        self.defined = []
+        self.failures = []
+        self.queries = 0
+        self.definitions = 0
+
+    def fail(self, message):
+        self.failures.append(message)
+
+    def writer(self, w):
+        rng = random.Random(w)
+        i = 0
+        while time.monotonic() < self.deadline and not self.failures:
+            name = f'writer {w} food {i}'
+            fat = rng.randint(1, 100)
+            try:
+                query(self.interpreter, f"1 x '{name}' = {fat} g fat")
+                unit = f'w{w}u{i}'
+                query(
+                    self.interpreter,
+                    f"1 {unit} '{self.recipe}' = 1 portion",
+                )
+                # A unit equal to one portion gives the same facts.
+                got = query(self.interpreter, f"print 1 {unit} '{self.recipe}'")
+                if got != self.portion:
+                    self.fail(f'1 {unit} gave {got!r}')
+            except NutcalcError as e:
+                self.fail(f'writer {w}: {e}')
+            self.defined.append((name, fat))
+            self.definitions += 2
+            i += 1
+
+    def reader(self, r):
+        rng = random.Random(-1 - r)
+        while time.monotonic() < self.deadline and not self.failures:
+            try:
+                match rng.randrange(3):
+                    case 0:
+                        got = query(
+                            self.interpreter,
+                            f"print 1 portion '{self.recipe}'",
+                        )
+                        expected = self.portion
+                    case 1:
+                        got = query(
+                            self.interpreter,
+                            f"shop 1 portion '{self.recipe}'",
+                        )
+                        expected = self.shopping
+                    case 2:
+                        if not self.defined:
+                            continue
+                        name, fat = rng.choice(self.defined)
+                        got = query(self.interpreter, f"print 1 x '{name}'")
+                        expected = \
+                            f'energy: {9.0 * fat:.2f} kcal\nfat: {fat:.2f} g\n'
+            except NutcalcError as e:
+                self.fail(f'reader {r}: {e}')
+                return
+            if got != expected:
+                self.fail(f'reader {r} expected {expected!r}, got {got!r}')
+            self.queries += 1
+
+    def run(self, readers, writers):
+        threads = [
+            threading.Thread(target=self.writer, args=(w,))
+            for w in range(writers)
+        ] + [
+            threading.Thread(target=self.reader, args=(r,))
+            for r in range(readers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m benchmarks.stress')
+    ap.add_argument('--readers', type=int, default=8)
+    ap.add_argument('--writers', type=int, default=4)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    args = ap.parse_args(argv)
+
+    stress = Stress(args.seconds)
+    stress.run(args.readers, args.writers)
+    print(
+        f'{stress.queries} queries, {stress.definitions} definitions, '
+        f'{len(stress.failures)} failures',
+    )
+    for failure in stress.failures[:10]:
+        print(failure, file=sys.stderr)
+    if stress.failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
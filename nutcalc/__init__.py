@@ -1,5 +1,12 @@
 from .error import NutcalcError
-from . import syntax
-from . import parser
-from . import model
-from . import interpret
+
+import importlib
+
+# Submodules are imported on first use, so that e.g. `python -m nutcalc -c`
+# doesn't pay for the ones it never touches.
+SUBMODULES = ('syntax', 'parser', 'model', 'interpret')
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,37 +1,48 @@
-from . import repl
-from . import syntax
+# Only what every run needs is imported here; the REPL (and readline), the
+# protocol server, stdin streaming, checkpoints, reports and exports are
+# imported when requested.
+from . import profile
 from . import config
 from .interpret import Interpreter, InterpretationError
-from .parser import (parse_stmt, parse_module, LocatedParseError)
+from .parser import (parse_stmt, LocatedParseError)
 
-import os.path as ospath
 import sys
 
 USAGE = (
-    f'usage: {sys.argv[0]} [-i] [-v] [-c STMT | PATH]...\n'
+    f'usage: {sys.argv[0]} [-i] [-v] [-j N] [--serve] [--profile TRACE] [--jsonl]\n'
+    '\t[--report FORMAT [--windows N,...]] [--sqlite DB] [--checkpoint DIR]\n'
+    '\t[--ledger PATH]\n'
+    '\t[-c STMT | PATH | -]...\n'
     '\twhere STMT is a nutcalc statement to execute;\n'
     '\twhere PATH is a path to a .nut file to load.\n'
     '\n'
     'Executes all statements and .nut modules in order.\n'
-    # 'Reads from stdin if no files or statements are specified.\n'
+    'The path - reads statements from stdin, executing each as soon as it\n'
+    'is complete and carrying on past errors.\n'
     '\n'
     '\t-i: start REPL afterwards\n'
     '\t-v: enable verbose output during execution\n'
+    '\t-j N: execute long runs of print, shop, solve, sweep and breakdown\n'
+    '\t\tstatements of modules in N processes; output stays in order\n'
+    '\t--jsonl: when reading stdin, write the outcome of each statement as\n'
+    '\t\ta JSON object on its own line\n'
+    '\t--serve: afterwards, serve the worker protocol as JSON Lines over\n'
+    '\t\tstdin/stdout, resolving imports from the current directory;\n'
+    '\t\tsessions start from (and share) everything loaded before\n'
+    '\t--profile TRACE: time parsing, module loading and every statement;\n'
+    '\t\tprint a summary to stderr and write a Chrome trace to TRACE\n'
+    '\t--report FORMAT: afterwards, write a rolling-window trend report of\n'
+    '\t\tthe journal (foods named by ISO date) to stdout as csv or json\n'
+    '\t--windows N,...: window lengths in days for --report '
+    '(default 7,30,90)\n'
+    '\t--sqlite DB: afterwards, export every food to the SQLite database\n'
+    '\t\tDB, rewriting only the foods that changed since the last export\n'
+    '\t--checkpoint DIR: checkpoint every PATH in DIR, so that loading it\n'
+    '\t\tagain only parses and executes what was appended to it since\n'
+    '\t--ledger PATH: keep the inventory of stock and consume statements\n'
+    '\t\tin the ledger PATH, across runs\n'
 )
 
-def load_module(interpreter, path):
-    """Loads a module specified by a path into the given interpreter.
-    Recursively loads imported modules. No effort is made to detect import
-    loops."""
-    with open(path) as f:
-        module = parse_module(f, source=path)
-        for imp in module.imports:
-            load_module(
-                interpreter,
-                ospath.join(ospath.dirname(path), imp.path + '.nut'),
-            )
-        interpreter.load_module(path, module)
-
 def parse_args():
     targets = []
 
@@ -46,6 +57,54 @@ def parse_args():
             config.INTERACTIVE = True
         elif arg == '-v':
             config.VERBOSE = True
+        elif arg == '-j':
+            try:
+                processes = int(sys.argv[i+1])
+            except (IndexError, ValueError):
+                processes = 0
+            if processes <= 0:
+                print('Error: the number of processes must be a positive integer')
+                print(USAGE)
+                sys.exit(1)
+            config.PROCESSES = processes
+            i += 1
+        elif arg == '--jsonl':
+            config.JSONL = True
+        elif arg == '-':
+            targets.append( ('stdin', i, arg) )
+        elif arg == '--serve':
+            config.SERVE = True
+        elif arg == '--profile':
+            config.PROFILE = sys.argv[i+1]
+            i += 1
+        elif arg == '--report':
+            from . import report
+            config.REPORT = sys.argv[i+1]
+            if config.REPORT not in report.WRITERS:
+                print(f'Error: unknown report format {config.REPORT}')
+                print(USAGE)
+                sys.exit(1)
+            i += 1
+        elif arg == '--windows':
+            try:
+                windows = tuple(int(n) for n in sys.argv[i+1].split(','))
+            except ValueError:
+                windows = ()
+            if not windows or min(windows) <= 0:
+                print('Error: window lengths must be positive integers')
+                print(USAGE)
+                sys.exit(1)
+            config.REPORT_WINDOWS = windows
+            i += 1
+        elif arg == '--ledger':
+            config.LEDGER = sys.argv[i+1]
+            i += 1
+        elif arg == '--checkpoint':
+            config.CHECKPOINT = sys.argv[i+1]
+            i += 1
+        elif arg == '--sqlite':
+            config.SQLITE = sys.argv[i+1]
+            i += 1
         elif arg == '-c':
             targets.append( ('stmt', i+1, sys.argv[i+1]) )
             i += 1
@@ -56,26 +115,78 @@ def parse_args():
     return targets
 
 def execute_targets(interpreter, targets):
+    failures = 0
     try:
         for (kind, i, target) in targets:
             if kind == 'stmt':
                 stmt = parse_stmt(target, source=f'<argument {i}>')
                 interpreter.execute(stmt)
+            elif kind == 'module' and config.CHECKPOINT is not None:
+                from . import checkpoint
+                checkpoint.load_file(interpreter, target, config.CHECKPOINT)
             elif kind == 'module':
-                load_module(interpreter, target)
+                interpreter.load_file(target)
+            elif kind == 'stdin':
+                from . import stream
+                failures += stream.run(
+                    interpreter,
+                    sys.stdin,
+                    sys.stdout,
+                    interpreter.load_file,
+                    jsonl=config.JSONL,
+                )
     except (LocatedParseError, InterpretationError) as e:
         print('Error:', e)
         sys.exit(1)
+    finally:
+        if config.PROFILE is not None:
+            print(profile.summary(), file=sys.stderr)
+            profile.write_chrome_trace(config.PROFILE)
+    if failures:
+        sys.exit(1)
     return interpreter
 
 ### REAL MAIN ###
 
 targets = parse_args()
-if not config.INTERACTIVE and not len(targets):
+if not config.INTERACTIVE and not config.SERVE and not len(targets):
     print('Error: nothing to do')
     print(USAGE)
     sys.exit(1)
 
-interpreter = execute_targets(Interpreter(), targets)
+interpreter = Interpreter()
+interpreter.processes = config.PROCESSES
+if config.LEDGER is not None:
+    from .inventory import Inventory
+    try:
+        interpreter.inventory = Inventory.open(config.LEDGER)
+    except (OSError, ValueError) as e:
+        print('Error:', e)
+        sys.exit(1)
+interpreter = execute_targets(interpreter, targets)
+if config.REPORT is not None:
+    from . import report
+    columns = report.report_columns(interpreter.foodDB.schema)
+    report.WRITERS[config.REPORT](
+        report.rolling_report(
+            interpreter.foodDB,
+            windows=config.REPORT_WINDOWS,
+            columns=columns,
+        ),
+        columns,
+        sys.stdout,
+    )
+if config.SQLITE is not None:
+    from . import export
+    print(
+        export.export_sqlite(interpreter.foodDB, config.SQLITE),
+        file=sys.stderr,
+    )
+if config.SERVE:
+    from . import protocol
+    protocol.serve(base=interpreter)
+    # The served sessions were layered over the interpreter, freezing it.
+    interpreter = interpreter.session()
 if config.INTERACTIVE:
+    from . import repl
     repl.start(interpreter)
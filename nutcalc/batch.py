@@ -0,0 +1,213 @@
+"""Evaluates many client projects built on a common base of modules.
+
+    python -m nutcalc.batch --base PATH [--base PATH]... [-j N] [-o DIR]
+                            PROJECT...
+
+The base modules (e.g. a shared pantry and recipes) are loaded once. The
+nutrition facts of every food they define are then compiled into a matrix of
+foods by nutrients, published in shared memory, and the client projects are
+fanned out to a pool of processes. Each process receives a copy of the base's
+foods when it starts, and layers a session over it for every project it runs,
+so that it only evaluates the project's own modules; the facts of base foods
+are read from the shared matrix rather than evaluated again in every process.
+
+Paths are made absolute, so that projects find the base modules whichever
+directory they import them from.
+"""
+
+from . import interpret, model
+from .error import NutcalcError
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import StringIO
+from multiprocessing import shared_memory
+import argparse
+import math
+import os
+import os.path as ospath
+import sys
+
+@dataclass
+class MatrixLayout:
+    """Describes a nutrient matrix in shared memory: row `rows[name]` holds the
+    nutrition facts of the reference quantity of the food `name`, with one
+    column per nutrient of the schema as of `schema_version`. Nutrients a food
+    doesn't have are NaN."""
+    shm_name: str
+    rows: dict[model.FoodName, int]
+    columns: list[model.Nutrient]
+    schema_version: int
+
+class NutrientMatrix:
+    def __init__(self, layout: MatrixLayout, shm: shared_memory.SharedMemory):
+        self.layout = layout
+        self.shm = shm
+        self.values = shm.buf.cast('d')
+        self._facts = {}
+
+    @staticmethod
+    def publish(foodDB: interpret.FoodDB) -> 'NutrientMatrix':
+        """Evaluates every compound food of `foodDB` and publishes the
+        results in a new block of shared memory."""
+        columns = list(foodDB.schema)
+        index = {n.name: j for j, n in enumerate(columns)}
+        foods = [
+            food for _, food in foodDB.items()
+            if isinstance(food, model.CompoundFood)
+        ]
+        shm = shared_memory.SharedMemory(
+            create=True,
+            size=max(1, len(foods) * len(columns)) * 8,
+        )
+        matrix = NutrientMatrix(
+            MatrixLayout(
+                shm_name=shm.name,
+                rows={food.name: i for i, food in enumerate(foods)},
+                columns=columns,
+                schema_version=foodDB.schema.version,
+            ),
+            shm,
+        )
+        values = {} # shared between foods, so that each is evaluated once
+        for i, food in enumerate(foods):
+            start = i * len(columns)
+            for j in range(len(columns)):
+                matrix.values[start + j] = math.nan
+            facts = interpret.food_facts(food, values=values)
+            for name, qty in facts.data.items():
+                matrix.values[start + index[name]] = qty.count
+        return matrix
+
+    @staticmethod
+    def attach(layout: MatrixLayout) -> 'NutrientMatrix':
+        """Maps a published matrix into this process, without copying it."""
+        try:
+            shm = shared_memory.SharedMemory(name=layout.shm_name, track=False)
+        except TypeError: # before Python 3.13
+            shm = shared_memory.SharedMemory(name=layout.shm_name)
+        return NutrientMatrix(layout, shm)
+
+    def facts(self, food: model.Food) -> model.NutritionFacts | None:
+        """The nutrition facts of the reference quantity of a food of the
+        matrix, or None for any other food. Suitable as a FoodDB's
+        `known_facts`."""
+        i = self.layout.rows.get(food.name)
+        if i is None:
+            return None
+        facts = self._facts.get(i)
+        if facts is None:
+            n = len(self.layout.columns)
+            present = [
+                (nutrient, x)
+                for nutrient, x in zip(
+                    self.layout.columns,
+                    self.values[i * n:(i + 1) * n],
+                )
+                if not math.isnan(x)
+            ]
+            facts = model.NutritionFacts(
+                data={
+                    nutrient.name: model.Quantity(x, nutrient.natural_unit)
+                    for nutrient, x in present
+                },
+                energy=sum(nutrient.energy * x for nutrient, x in present),
+            )
+            self._facts[i] = facts
+        return facts
+
+    def close(self):
+        self.values.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+@dataclass
+class ProjectResult:
+    path: str
+    output: str
+    error: str | None = None
+
+# The base interpreter of a worker process
+_BASE = None
+
+def _init_worker(layout, foodDB, modules):
+    global _BASE
+    foodDB.known_facts = NutrientMatrix.attach(layout).facts
+    _BASE = interpret.Interpreter(foodDB=foodDB)
+    _BASE.modules = modules
+
+def _run_project(path) -> ProjectResult:
+    output = StringIO()
+    session = _BASE.session(output_stream=output)
+    try:
+        session.load_file(ospath.abspath(path))
+    except (NutcalcError, OSError) as e:
+        return ProjectResult(path, output.getvalue(), str(e))
+    except Exception as e:
+        # A bug, but one that only concerns this project
+        return ProjectResult(
+            path, output.getvalue(), f'{type(e).__name__}: {e}',
+        )
+    return ProjectResult(path, output.getvalue())
+
+def run_batch(base_paths, project_paths, processes=None, output_stream=None):
+    """Loads the base modules, then runs every project on top of them in a
+    pool of `processes` processes (by default, one per CPU). Output of the
+    base modules goes to `output_stream`. Returns a ProjectResult per
+    project, in order."""
+    base = interpret.Interpreter(output_stream=output_stream)
+    for path in base_paths:
+        base.load_file(ospath.abspath(path))
+    base.foodDB.freeze()
+    matrix = NutrientMatrix.publish(base.foodDB)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(matrix.layout, base.foodDB, base.modules),
+        ) as pool:
+            return list(pool.map(_run_project, project_paths))
+    finally:
+        matrix.close()
+        matrix.unlink()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m nutcalc.batch')
+    ap.add_argument(
+        '--base', action='append', default=[], metavar='PATH',
+        help='a module shared by all projects, loaded once',
+    )
+    ap.add_argument('-j', '--processes', type=int, help='size of the pool')
+    ap.add_argument(
+        '-o', '--output', metavar='DIR',
+        help='write the output of each project to DIR/<project>.out',
+    )
+    ap.add_argument('projects', nargs='+', metavar='PROJECT')
+    args = ap.parse_args(argv)
+
+    try:
+        results = run_batch(args.base, args.projects, args.processes)
+    except (NutcalcError, OSError) as e:
+        print('Error:', e, file=sys.stderr)
+        sys.exit(1)
+
+    failures = 0
+    for result in results:
+        if args.output is None:
+            print(f'==> {result.path} <==')
+            sys.stdout.write(result.output)
+        else:
+            os.makedirs(args.output, exist_ok=True)
+            name = ospath.splitext(ospath.basename(result.path))[0]
+            with open(ospath.join(args.output, name + '.out'), 'w') as f:
+                f.write(result.output)
+        if result.error is not None:
+            failures += 1
+            print(f'Error: {result.path}: {result.error}', file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
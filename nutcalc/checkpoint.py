@@ -0,0 +1,215 @@
+"""Checkpoints of append-only modules, such as a journal that only ever grows
+at the end.
+
+After a module is loaded, the interpreter's state as of the start of the
+module's last statement is saved next to the byte offset of that statement
+and a digest of the bytes before it. The last statement itself is left out:
+it may still be growing, e.g. today's entry in bullet form. Loading the
+module again restores the state and only parses and executes the text after
+the offset, provided the bytes before it, and the modules imported, are
+unchanged; otherwise the module is loaded from scratch.
+
+Checkpoints are pickles; only read those written by this machine."""
+
+from . import parser, profile
+from .interpret import NUTRIENT_DB, import_path
+
+from dataclasses import dataclass
+from io import StringIO
+import hashlib
+import os
+import os.path as ospath
+import pickle
+
+# Bumped whenever the checkpoint format changes; older checkpoints are then
+# ignored.
+FORMAT = 3
+
+@dataclass
+class Checkpoint:
+    format: int
+    offset: int # bytes of the module before the checkpoint
+    lines: int # lines of the module before the checkpoint
+    digest: str # sha256 of those bytes
+    imports: dict[str, str] # path -> sha256 of every module loaded before
+    output: str # printed by the statements before the checkpoint
+    # The pickled FoodDB, with its nutrient schema, loaded modules and
+    # inventory as of the checkpoint; kept apart so that it's only unpickled
+    # once validated.
+    state: bytes
+
+class _Fallback(Exception):
+    """The module can't be loaded statement by statement."""
+
+class _Tee:
+    """Writes to a stream while keeping a copy of what was written."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = StringIO()
+
+    def write(self, s):
+        self.copy.write(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+def checkpoint_path(directory, path) -> str:
+    key = hashlib.sha256(ospath.abspath(path).encode()).hexdigest()[:16]
+    return ospath.join(directory, key + '.pickle')
+
+def load_file(interpreter, path: str, directory: str):
+    """Loads the module at `path` like `interpreter.load_file`, resuming from
+    its checkpoint in `directory` if it has a valid one, and checkpointing it
+    again afterwards. Only a fresh interpreter, whose inventory isn't kept in
+    a ledger, can be restored; any other loads the module normally."""
+    fresh = not interpreter.modules and interpreter.foodDB.base is None \
+        and interpreter.foodDB.known_facts is None \
+        and interpreter.foodDB.data.keys() == NUTRIENT_DB.keys() \
+        and interpreter.inventory.path is None \
+        and not interpreter.inventory.stock
+    if not fresh:
+        return interpreter.load_file(path)
+    with open(path, 'rb') as f:
+        contents = f.read()
+    saved = _read(checkpoint_path(directory, path))
+    try:
+        if saved is not None and _valid(saved, contents):
+            _resume(interpreter, path, directory, contents, saved)
+        else:
+            _start(interpreter, path, directory, contents)
+    except _Fallback:
+        interpreter.load_file(path)
+
+def _read(cp_path) -> Checkpoint | None:
+    try:
+        with open(cp_path, 'rb') as f:
+            saved = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None # missing, or written by another version of nutcalc
+    if not isinstance(saved, Checkpoint) or saved.format != FORMAT:
+        return None
+    return saved
+
+def _valid(saved: Checkpoint, contents: bytes) -> bool:
+    if len(contents) < saved.offset or \
+            _digest(contents[:saved.offset]) != saved.digest:
+        return False
+    for path, digest in saved.imports.items():
+        try:
+            with open(path, 'rb') as f:
+                if _digest(f.read()) != digest:
+                    return False
+        except OSError:
+            return False
+    return True
+
+def _digest(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+def _lines(contents: bytes) -> list[str]:
+    lines = contents.decode().split('\n')
+    return [line + '\n' for line in lines[:-1]] + \
+        ([lines[-1]] if lines[-1] else [])
+
+def _statements(lines, path, first_line):
+    """Parses the statements of `lines`, which start on line `first_line` of
+    the module. Returns the leading imports, as the text of a module, the
+    statements and the line the last statement starts on."""
+    def parse(text, line):
+        if parser.IMPORT.match(text):
+            return None # parsed along with the other imports
+        return parser.parse_stmt(text, path, first_line + line)
+
+    imports, stmts, last = [], [], None
+    for start, text, stmt in parser.merge_statements(
+        parser.split_statements(lines), parse,
+    ):
+        if isinstance(stmt, parser.LocatedParseError):
+            raise stmt
+        if stmt is None:
+            if stmts:
+                raise _Fallback() # let the module grammar report it
+            imports.append(text)
+            continue
+        stmts.append(stmt)
+        last = first_line + start
+    return ''.join(imports), stmts, last
+
+def _start(interpreter, path, directory, contents):
+    lines = _lines(contents)
+    imports, stmts, last = _statements(lines, path, 0)
+    if imports:
+        module = parser.parse_module(StringIO(imports), source=path)
+        for imp in module.imports:
+            interpreter.load_file(import_path(path, imp.path))
+    hashes = {}
+    for p in interpreter.modules:
+        with open(p, 'rb') as f:
+            hashes[p] = _digest(f.read())
+    empty = Checkpoint(
+        format=FORMAT, offset=0, lines=0, digest=_digest(b''),
+        imports=hashes, output='', state=b'',
+    )
+    _run(interpreter, path, directory, contents, lines, stmts, last, empty)
+
+def _resume(interpreter, path, directory, contents, saved):
+    lines = _lines(contents[saved.offset:])
+    imports, stmts, last = _statements(lines, path, saved.lines)
+    if imports:
+        raise _Fallback()
+    foodDB, modules, inventory = pickle.loads(saved.state)
+    interpreter.foodDB = foodDB
+    interpreter.modules = modules
+    interpreter.inventory = inventory
+    interpreter.output_stream.write(saved.output)
+    _run(interpreter, path, directory, contents, lines, stmts, last, saved)
+
+def _run(interpreter, path, directory, contents, lines, stmts, last, saved):
+    """Executes the statements parsed from `lines`, which follow the
+    checkpoint `saved`, then checkpoints the state as of the last one."""
+    tee = _Tee(interpreter.output_stream)
+    state, output = None, ''
+    with profile.span('load', path):
+        for i, stmt in enumerate(stmts):
+            if i == len(stmts) - 1 and last != saved.lines:
+                state = _state(interpreter)
+                output = tee.copy.getvalue()
+            interpreter.execute(stmt, output_stream=tee)
+    interpreter.modules.add(path)
+    if state is None:
+        return # the checkpoint is as far as it can go
+    offset = saved.offset + len(''.join(lines[:last - saved.lines]).encode())
+    _write(checkpoint_path(directory, path), Checkpoint(
+        format=FORMAT,
+        offset=offset,
+        lines=last,
+        digest=_digest(contents[:offset]),
+        imports=saved.imports,
+        output=saved.output + output,
+        state=state,
+    ))
+
+def _state(interpreter) -> bytes | None:
+    """Pickles the state of the interpreter, or gives None if it's too deeply
+    nested to."""
+    try:
+        return pickle.dumps(
+            (
+                interpreter.foodDB,
+                interpreter.modules,
+                interpreter.inventory,
+            ),
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    except RecursionError:
+        return None
+
+def _write(cp_path, checkpoint: Checkpoint):
+    """Writes a checkpoint atomically, so that concurrent runs read either
+    the old one or the new one."""
+    os.makedirs(ospath.dirname(cp_path) or '.', exist_ok=True)
+    tmp = f'{cp_path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cp_path)
@@ -0,0 +1,175 @@
+"""Context-aware tab completion of keywords, units and food names.
+
+Food names are kept in a sorted array searched with bisect, so that completing
+a prefix costs O(log n + k) for k results, even with tens of thousands of
+foods. The index follows the FoodDB as foods are registered or gain units."""
+
+from . import model
+
+from bisect import bisect_left
+import re
+
+KEYWORDS = ['print', 'facts', 'shop', 'solve', 'sweep', 'breakdown', 'rank', 'find',
+    'nutrient', 'stats', 'stock', 'consume', 'import', 'exit']
+
+# Limit on the number of candidates offered for one completion.
+MAX_CANDIDATES = 200
+
+TOKEN = re.compile(
+    r"""\s*('[^']*'?|"[^"]*"?|[0-9][0-9.]*|[a-zA-Z][0-9a-zA-Z]*|[-+*/():=,])"""
+)
+BARE_NAME = re.compile(r'[a-zA-Z][0-9a-zA-Z]*')
+NUMBER = re.compile(r'[0-9][0-9.]*|\)')
+OPERATORS = set('-+*/():=,')
+
+def quote(name: str) -> str:
+    """How a food name must be written in nutcalc source."""
+    if BARE_NAME.fullmatch(name):
+        return name
+    return f"'{name}'" if "'" not in name else f'"{name}"'
+
+def unquote(token: str) -> str:
+    if token[:1] in ('"', "'"):
+        return token[1:-1] if len(token) > 1 and token[-1] == token[0] \
+            else token[1:]
+    return token
+
+class NameIndex:
+    """A case-insensitive sorted array of names supporting prefix search."""
+    def __init__(self, names=()):
+        # Sorted once, rather than inserted one at a time in O(n) each
+        entries = sorted({(name.lower(), name) for name in names})
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+
+    def add(self, name: str):
+        """Adds a name, in O(n); meant for names arriving one at a time after
+        the index is built."""
+        key = name.lower()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.names[i] == name:
+                return
+            i += 1
+        self.keys.insert(i, key)
+        self.names.insert(i, name)
+
+    def prefixed(self, prefix: str):
+        """Generates the names starting with the given prefix, in order."""
+        key = prefix.lower()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key):
+            yield self.names[i]
+            i += 1
+
+    def __len__(self):
+        return len(self.names)
+
+class Completer:
+    def __init__(self, foodDB):
+        self.foodDB = foodDB
+        # Every compound food has all the weight units, so only the foods of
+        # the other units are worth indexing separately.
+        foods, units, foods_by_unit = [], [], {}
+        for _, food in foodDB.items():
+            foods.append(food.name)
+            for unit in _unit_names(food):
+                units.append(unit)
+                if unit not in model.WEIGHTS:
+                    foods_by_unit.setdefault(unit, []).append(food.name)
+        self.foods = NameIndex(foods)
+        self.units = NameIndex(units)
+        self.foods_by_unit = {
+            unit: NameIndex(names) for unit, names in foods_by_unit.items()
+        }
+        foodDB.watch(self.index)
+        self._matches = []
+
+    def index(self, food: model.Food):
+        self.foods.add(food.name)
+        for unit in _unit_names(food):
+            self.units.add(unit)
+            if unit not in model.WEIGHTS:
+                self.foods_by_unit.setdefault(unit, NameIndex()).add(food.name)
+
+    def candidates(self, line: str) -> list[str]:
+        """Completes the last word of `line`, returning replacements for that
+        whole word."""
+        tokens, word = _split(line)
+        prev = tokens[-1] if tokens else None
+        if prev is None:
+            return [k for k in KEYWORDS if k.startswith(word)]
+        if NUMBER.fullmatch(prev):
+            return self._units(tokens, word)
+        if len(tokens) >= 2 and NUMBER.fullmatch(tokens[-2]) \
+                and BARE_NAME.fullmatch(prev):
+            return self._foods(word, unit=prev)
+        return []
+
+    def _units(self, tokens, word):
+        # In `N unit food = M |` or `N unit food weighs M |`, only the units of
+        # that food make sense.
+        for op in ('=', 'weighs'):
+            if op in tokens:
+                i = tokens.index(op)
+                if i >= 1 and len(tokens) - i == 2:
+                    name = unquote(tokens[i - 1])
+                    if op == 'weighs' or not self.foodDB.has(name):
+                        units = model.WEIGHTS
+                    else:
+                        units = _unit_names(self.foodDB.get(name))
+                    return sorted(u for u in units if u.startswith(word))
+        return list(_take(self.units.prefixed(word)))
+
+    def _foods(self, word, unit):
+        quoted = word[:1] in ('"', "'")
+        prefix = unquote(word)
+        if unit in model.WEIGHTS:
+            matches = (
+                name for name in self.foods.prefixed(prefix)
+                if unit in _unit_names(self.foodDB.get(name))
+            )
+        else:
+            matches = self.foods_by_unit.get(unit, NameIndex()).prefixed(prefix)
+        return [
+            (f"{word[0]}{name}{word[0]}" if quoted else quote(name))
+            for name in _take(matches)
+        ]
+
+    def complete(self, text: str, state: int):
+        """A completer function for `readline.set_completer`. Completes
+        whole food names, even those containing spaces, while readline's
+        `text` is only the part after the last space."""
+        if state == 0:
+            import readline
+            line = readline.get_line_buffer()[:readline.get_endidx()]
+            candidates = self.candidates(line)
+            # Drop the part of each candidate that precedes readline's word.
+            _, word = _split(line)
+            skip = len(word) - len(text)
+            self._matches = [
+                c[skip:] for c in candidates if skip <= len(c)
+            ]
+        if state < len(self._matches):
+            return self._matches[state]
+        return None
+
+def _unit_names(food: model.Food):
+    if isinstance(food, model.Nutrient):
+        return [food.natural_unit]
+    return [u.name for u in food.units]
+
+def _split(line):
+    """Splits a line into its complete tokens and the word being typed."""
+    tokens = TOKEN.findall(line)
+    if tokens and not line[-1:].isspace() and tokens[-1] not in OPERATORS:
+        return tokens[:-1], tokens[-1]
+    return tokens, ''
+
+def _take(iterable, n=MAX_CANDIDATES):
+    result = []
+    for x in iterable:
+        if len(result) >= n:
+            break
+        result.append(x)
+    return result
@@ -2,3 +2,26 @@
 
 INTERACTIVE = False
 VERBOSE = False
+SERVE = False
+
+# Whether statements read from stdin report their outcomes as JSON Lines
+JSONL = False
+
+# Format of the rolling-window trend report to write after execution, if any
+REPORT = None
+REPORT_WINDOWS = (7, 30, 90)
+
+# Path of the SQLite database to export the food database to, if any
+SQLITE = None
+
+# How many processes may execute the read-only statements of modules
+PROCESSES = None
+
+# Path of the ledger keeping the inventory, if any
+LEDGER = None
+
+# Directory of the checkpoints of modules loaded from the command line, if any
+CHECKPOINT = None
+
+# Path of the Chrome trace to write if profiling is enabled
+PROFILE = None
@@ -2,4 +2,16 @@ class NutcalcError(RuntimeError):
     """Base class for any error raised by Nutcalc."""
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+class InterpretationError(NutcalcError):
+    def __init__(self, msg, location=None, **kwargs):
+        self.location = location
+        self.msg = msg
+        super().__init__(self, **kwargs)
+
+    def __str__(self):
+        if self.location is None:
+            return self.msg
+        else:
+            return f'{self.location.as_prefix()} {self.msg}'
         
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""Export of a food database to SQLite, for querying with other tools.
+
+Every food gets a row in `foods`, and its units, direct constituents and
+evaluated nutrient vector (per 100 g, for compound foods) rows in `units`,
+`constituents` and `nutrients`:
+
+    SELECT food, amount FROM nutrients WHERE nutrient = 'protein'
+    ORDER BY amount DESC LIMIT 10;
+
+Exports are incremental. Each food is stored with a digest of its definition
+and, transitively, of the definitions of its constituents; exporting again to
+the same database only rewrites the foods whose digest changed and deletes
+the foods that no longer exist."""
+
+from . import interpret, model
+
+from dataclasses import dataclass
+import hashlib
+import sqlite3
+
+# Bumped whenever the schema changes; older databases are then rebuilt.
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE foods (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL, -- 'nutrient' or 'compound'
+    energy REAL, -- kcal per 100 g, for compound foods
+    digest TEXT NOT NULL
+);
+CREATE TABLE units (
+    food TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    grams REAL -- NULL for nutrients not measured by weight
+);
+CREATE TABLE constituents (
+    food TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    constituent TEXT NOT NULL,
+    count REAL NOT NULL, -- per 100 g of the food
+    unit TEXT NOT NULL,
+    tags TEXT NOT NULL -- space-separated, sorted
+);
+CREATE TABLE nutrients (
+    food TEXT NOT NULL,
+    nutrient TEXT NOT NULL,
+    amount REAL NOT NULL, -- per 100 g of the food
+    unit TEXT NOT NULL
+);
+CREATE INDEX units_food ON units (food);
+CREATE INDEX constituents_food ON constituents (food);
+CREATE INDEX constituents_constituent ON constituents (constituent);
+CREATE INDEX nutrients_food ON nutrients (food);
+CREATE INDEX nutrients_nutrient ON nutrients (nutrient, amount);
+"""
+
+TABLES = ('units', 'constituents', 'nutrients', 'foods')
+
+@dataclass
+class ExportSummary:
+    foods: int
+    written: int
+    deleted: int
+
+    def __str__(self):
+        return (
+            f'exported {self.foods} foods '
+            f'({self.written} written, {self.deleted} deleted)'
+        )
+
+def digests(foodDB) -> dict[model.FoodName, str]:
+    """Computes the digest of every food of `foodDB`. A food's digest covers
+    its units, its constituents and their digests, so it changes whenever the
+    food's nutrient vector may have."""
+    result = {}
+    for _, root in foodDB.items():
+        stack = [(root, False)]
+        while stack:
+            food, expanded = stack.pop()
+            if food.name in result:
+                continue
+            if isinstance(food, model.CompoundFood) and not expanded:
+                stack.append((food, True))
+                stack.extend(
+                    (qf.food, False) for qf in food.constituents
+                    if qf.food.name not in result
+                )
+                continue
+            result[food.name] = _digest(food, result)
+    return result
+
+def _digest(food: model.Food, known: dict[model.FoodName, str]) -> str:
+    match food:
+        case model.Nutrient():
+            definition = ('nutrient', food.name, food.energy, food.natural_unit)
+        case model.CompoundFood():
+            definition = (
+                'compound',
+                food.name,
+                [(u.name, u.gram_equivalent) for u in food.units],
+                [
+                    (
+                        qf.food.name, known[qf.food.name],
+                        qf.quantity.count, qf.quantity.unit,
+                        sorted(qf.tags),
+                    )
+                    for qf in food.constituents
+                ],
+            )
+    return hashlib.sha256(repr(definition).encode()).hexdigest()
+
+def export_sqlite(foodDB, path) -> ExportSummary:
+    """Writes every food of `foodDB` to the SQLite database at `path`,
+    creating it if needed, in a single transaction."""
+    new = digests(foodDB)
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            version, = db.execute('PRAGMA user_version').fetchone()
+            if version != SCHEMA_VERSION:
+                for table in TABLES:
+                    db.execute(f'DROP TABLE IF EXISTS {table}')
+                # Not executescript, which would commit first.
+                for statement in SCHEMA.split(';'):
+                    db.execute(statement)
+                db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            old = dict(db.execute('SELECT name, digest FROM foods'))
+
+            stale = [
+                (name,) for name, digest in old.items()
+                if new.get(name) != digest
+            ]
+            for table in TABLES:
+                column = 'name' if table == 'foods' else 'food'
+                db.executemany(
+                    f'DELETE FROM {table} WHERE {column} = ?',
+                    stale,
+                )
+
+            foods = [
+                foodDB.get(name) for name, digest in new.items()
+                if old.get(name) != digest
+            ]
+            _insert(db, foods, new, foodDB.known_facts)
+    finally:
+        db.close()
+    return ExportSummary(
+        foods=len(new),
+        written=len(foods),
+        deleted=sum(1 for name in old if name not in new),
+    )
+
+def _insert(db, foods, digests, known):
+    values = {} # shared between foods, so that each is evaluated once
+    food_rows, unit_rows, constituent_rows, nutrient_rows = [], [], [], []
+    for food in foods:
+        match food:
+            case model.Nutrient():
+                food_rows.append(
+                    (food.name, 'nutrient', None, digests[food.name]),
+                )
+                unit_rows.append((
+                    food.name,
+                    food.natural_unit,
+                    food.unit.gram_equivalent or None,
+                ))
+            case model.CompoundFood():
+                facts = interpret.food_facts(
+                    food, known=known, values=values,
+                )
+                food_rows.append(
+                    (food.name, 'compound', facts.energy, digests[food.name]),
+                )
+                unit_rows.extend(
+                    (food.name, u.name, u.gram_equivalent)
+                    for u in food.units
+                )
+                constituent_rows.extend(
+                    (
+                        food.name, i, qf.food.name,
+                        qf.quantity.count, qf.quantity.unit,
+                        ' '.join(sorted(qf.tags)),
+                    )
+                    for i, qf in enumerate(food.constituents)
+                )
+                nutrient_rows.extend(
+                    (food.name, name, qty.count, qty.unit)
+                    for name, qty in facts.data.items()
+                )
+    db.executemany('INSERT INTO foods VALUES (?, ?, ?, ?)', food_rows)
+    db.executemany('INSERT INTO units VALUES (?, ?, ?)', unit_rows)
+    db.executemany(
+        'INSERT INTO constituents VALUES (?, ?, ?, ?, ?, ?)',
+        constituent_rows,
+    )
+    db.executemany('INSERT INTO nutrients VALUES (?, ?, ?, ?)', nutrient_rows)
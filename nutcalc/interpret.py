@@ -1,25 +1,20 @@
 from . import syntax
 from . import model
 from . import config
-from .error import NutcalcError
+from . import profile
+from . import solve
+from . import limits
+from .error import InterpretationError, NutcalcError
+from .inventory import Inventory
 from .log import log
+from .rwlock import RWLock
 
-from dataclasses import dataclass
-from typing import NewType
+from dataclasses import dataclass, replace
+from typing import Callable, NewType
+import math
 import os.path as ospath
 import sys
-
-class InterpretationError(NutcalcError):
-    def __init__(self, msg, location=None, **kwargs):
-        self.location = location
-        self.msg = msg
-        super().__init__(self, **kwargs)
-
-    def __str__(self):
-        if self.location is None:
-            return self.msg
-        else:
-            return f'{self.location.as_prefix()} {self.msg}'
+import threading
 
 ###############################################################################
 
@@ -32,84 +27,647 @@ NUTRIENT_DB = {
 }
 
 class FoodDB:
+    """Maps food names to foods.
+
+    A FoodDB may be layered over a frozen base FoodDB: lookups fall through to
+    the base, while new definitions go in this layer only. Many layers can
+    share one base, e.g. one per session over a common pantry, without copying
+    it. Defining a unit for a food of the base first copies the food into this
+    layer, leaving the base as it was.
+
+    The nutrients among the foods make up the FoodDB's nutrient schema, which
+    is layered over that of the base in the same way."""
     data: FoodMap = {}
 
-    def __init__(self, data: FoodMap | None = None):
+    def __init__(self, data: FoodMap | None = None, base: 'FoodDB | None' = None):
+        if base is not None and not base.frozen:
+            raise ValueError('the base of a FoodDB must be frozen')
         if data is None:
-            data = dict(NUTRIENT_DB)
+            data = dict(NUTRIENT_DB) if base is None else {}
         self.data = data
+        self.base = base
+        self.schema = model.NutrientSchema(
+            base=model.BUILTIN_SCHEMA if base is None else base.schema,
+        )
+        self.frozen = False
+        self.watchers = []
+        # Optionally, a function giving the nutrition facts of a food's
+        # reference quantity computed beforehand, or None; see
+        # `nutrition_facts`. Layers inherit that of their base.
+        self.known_facts = None if base is None else base.known_facts
+
+    def freeze(self):
+        """Forbids any further change to this FoodDB, so that it can serve as
+        the base of others."""
+        self.frozen = True
+
+    def overlay(self):
+        """A new, empty FoodDB layered over this one, which becomes frozen.
+        Its foods are then evaluated, once, for every layer over it to look up
+        as their `known_facts`."""
+        if not self.frozen:
+            self.freeze()
+            self.known_facts = FactsTable(self)
+        return FoodDB(base=self)
+
+    def watch(self, callback):
+        """Registers a callback to be called with every food that is
+        registered, or that gains a unit, from now on."""
+        self.watchers.append(callback)
+
+    def changed(self, food: model.Food):
+        for callback in self.watchers:
+            callback(food)
+
+    def __getstate__(self):
+        # Watchers belong to the process, e.g. a nutrient index; a copy of
+        # the FoodDB starts without any.
+        state = self.__dict__.copy()
+        state['watchers'] = []
+        return state
 
     def register(self, food: model.Food, location=None):
-        if food.name in self.data:
+        self._check_writable(location)
+        if self.has(food.name):
             raise InterpretationError(
                 f"food '{food.name}' already defined",
                 location=location,
             )
         self.data[food.name] = food
+        self.changed(food)
 
-    def get(self, name: model.FoodName, location = None):
-        if name not in self.data:
+    def declare(self, nutrient: model.Nutrient, location=None):
+        """Registers a nutrient, adding it to the schema first, so that the
+        watchers find it there."""
+        self._check_writable(location)
+        if self.has(nutrient.name):
+            raise InterpretationError(
+                f"food '{nutrient.name}' already defined",
+                location=location,
+            )
+        try:
+            self.schema.declare(nutrient)
+        except ValueError as e:
+            raise InterpretationError(str(e), location=location)
+        self.register(nutrient, location=location)
+
+    def retract(self, name: model.FoodName):
+        """Takes back a food of this layer, and the nutrient if it is one,
+        e.g. when the language server re-executes its definition."""
+        food = self.data.pop(name, None)
+        if isinstance(food, model.Nutrient):
+            self.schema.retract(name)
+
+    def own(self, food: model.Food, location=None) -> model.Food:
+        """The copy of a registered food that this layer may modify, copying it
+        out of the base if necessary."""
+        self._check_writable(location)
+        if food.name in self.data:
+            return self.data[food.name]
+        food = replace(food, units=list(food.units))
+        self.data[food.name] = food
+        return food
+
+    def _check_writable(self, location):
+        if self.frozen:
             raise InterpretationError(
-                f'food {name} is not defined',
+                'definitions are read-only here',
                 location=location,
             )
-        return self.data[name]
+
+    def get(self, name: model.FoodName, location = None):
+        db = self
+        while db is not None:
+            food = db.data.get(name)
+            if food is not None:
+                return food
+            db = db.base
+        raise InterpretationError(
+            f'food {name} is not defined',
+            location=location,
+        )
 
     def has(self, name: model.FoodName):
-        return name in self.data
+        db = self
+        while db is not None:
+            if name in db.data:
+                return True
+            db = db.base
+        return False
+
+    def items(self):
+        """Generates (name, food) for every food, through all layers."""
+        if self.base is None:
+            yield from self.data.items()
+            return
+        yield from self.data.items()
+        for name, food in self.base.items():
+            if name not in self.data:
+                yield name, food
 
 ###############################################################################
 
-def nutrition_facts(qf: model.QuantifiedFood):
-    nut = None
-    match qf.food:
-        case model.Nutrient():
-            nut = model.NutritionFacts(data={qf.food.name: qf.food.reference_quantity})
-        case model.CompoundFood():
-            nut = model.NutritionFacts.empty()
-            for constituent in qf.food.constituents:
-                nut += nutrition_facts(constituent)
-    return nut * qf.scale_factor
+def nutrition_facts(qf: model.QuantifiedFood, known=None, values=None):
+    """The nutrition facts of a quantified food. If given, `known(food)` may
+    return the nutrition facts of the food's reference quantity, computed
+    beforehand, or None. See `food_facts` for `values`."""
+    return food_facts(qf.food, known, values) * qf.scale_factor
+
+def food_facts(food: model.Food, known=None, values=None):
+    """The nutrition facts of a food's reference quantity. Passing the same
+    dict as `values` to several calls shares the work of evaluating the foods
+    they have in common."""
+    return _evaluate(
+        food,
+        model.NutritionFacts.empty,
+        _nutrient_facts,
+        _constituent_facts,
+        known=known,
+        values=values,
+    )
+
+class FactsTable:
+    """The nutrition facts of the reference quantity of every compound food
+    of a frozen layer, evaluated beforehand; suitable as a FoodDB's
+    `known_facts`. Other foods are looked up in the `known_facts` the layer
+    had, if any. It doesn't change once built, so that layers over the same
+    base can share it without locking."""
+    def __init__(self, foodDB: 'FoodDB'):
+        self.known = foodDB.known_facts
+        values = {} # shared between foods, so that each is evaluated once
+        # name -> (food, nutrition facts of its reference quantity)
+        self.facts = {
+            name: (food, food_facts(food, self.known, values))
+            for name, food in foodDB.data.items()
+            if isinstance(food, model.CompoundFood)
+        }
+
+    def __call__(self, food: model.Food) -> model.NutritionFacts | None:
+        entry = self.facts.get(food.name)
+        if entry is not None and entry[0] is food:
+            return entry[1]
+        return None if self.known is None else self.known(food)
 
 def shopping_list(qf: model.QuantifiedFood):
+    return traverse(qf, SHOPPING)
+
+@dataclass(frozen=True)
+class TagPolicy:
+    """Which constituents a traversal of a food tree takes into account, by
+    their tags.
+
+    Constituents tagged with one of `exclude` are pruned, along with everything
+    under them. Given `only`, just the constituents tagged with one of `only`
+    count, along with everything under them; the traversal goes through the
+    other compound foods to find them. Constituents tagged with one of `stop`
+    count as a whole, if they count, without descending into them."""
+    only: frozenset[str] | None = None
+    exclude: frozenset[str] = frozenset()
+    stop: frozenset[str] = frozenset()
+
+    @property
+    def within(self) -> 'TagPolicy':
+        """The policy under a constituent tagged with one of `only`."""
+        return TagPolicy(exclude=self.exclude, stop=self.stop)
+
+EVERYTHING = TagPolicy()
+
+@dataclass(frozen=True)
+class Fold:
+    """A kind of evaluation of food trees; see `_evaluate` for the meaning of
+    the fields. `whole(qf)`, if given, is the value of a constituent that a
+    tag policy stops at; by default, its value under EVERYTHING."""
+    empty: Callable
+    leaf: Callable
+    constituent: Callable
+    descend: Callable | None = None
+    whole: Callable | None = None
+
+@dataclass
+class CacheStats:
+    """How many foods evaluations found in their memo (hits) rather than
+    evaluated (misses). Counts may race between concurrent statements; they
+    are indicative only."""
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float | None:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+def traverse(qf: model.QuantifiedFood, fold: Fold, policy=EVERYTHING,
+             memo=None, known=None, stats=None):
+    """Evaluates a quantified food with `fold`, under a tag policy.
+
+    If given, `memo` maps tag policies to the memos of `_evaluate`, and is
+    filled in as foods are evaluated: evaluations sharing it under the same
+    policy, e.g. by successive statements, share their work. The `known`
+    values of foods only apply under EVERYTHING. Hits and misses of the memo
+    are counted in `stats`, if given."""
+    if memo is None:
+        memo = {}
+
+    def descends(policy, qf):
+        if qf.tags & (policy.exclude | policy.stop):
+            return False
+        if fold.descend is not None and not fold.descend(qf):
+            return False
+        if policy.only is None:
+            return True
+        return not qf.tags & policy.only and \
+            isinstance(qf.food, model.CompoundFood)
+
+    def constituent(policy):
+        def f(qf, value):
+            if qf.tags & policy.exclude:
+                return fold.empty()
+            if qf.tags & policy.stop:
+                if policy.only is not None and not qf.tags & policy.only:
+                    return fold.empty() # outside of what counts
+                if fold.whole is not None:
+                    return fold.whole(qf)
+                return fold.constituent(qf, evaluator(EVERYTHING))
+            if policy.only is None:
+                return fold.constituent(qf, value)
+            if qf.tags & policy.only:
+                return fold.constituent(qf, evaluator(policy.within))
+            if descends(policy, qf):
+                return value(qf.food) * qf.scale_factor
+            return fold.empty() # outside of what counts
+        return f
+
+    def evaluator(policy):
+        return lambda food: _evaluate(
+            food,
+            fold.empty,
+            fold.leaf,
+            constituent(policy),
+            descend=lambda qf: descends(policy, qf),
+            known=known if policy == EVERYTHING else None,
+            values=memo.setdefault(policy, {}),
+            stats=stats,
+        )
+
+    return constituent(policy)(qf, evaluator(policy))
+
+def breakdown(qf: model.QuantifiedFood, ingredients=False, known=None,
+              values=None):
+    """Attributes the nutrition facts of a quantified food to the direct
+    constituents of its food or, with `ingredients`, to its ingredients: the
+    nutrients and the compound foods made only of nutrients found at the
+    bottom of its tree. A nutrient is attributed to itself.
+
+    Every food of the tree is visited once, however many recipes share it.
+    `known` and `values` are as for `food_facts`."""
+    if values is None:
+        values = {}
+    facts = lambda food: food_facts(food, known, values)
+    if isinstance(qf.food, model.Nutrient):
+        return model.Breakdown.singleton(qf.food.name, facts(qf.food)) \
+            * qf.scale_factor
+    if not ingredients:
+        total = model.Breakdown.empty()
+        for constituent in qf.food.constituents:
+            total += model.Breakdown.singleton(
+                constituent.food.name,
+                facts(constituent.food) * constituent.scale_factor,
+            )
+        return total * qf.scale_factor
+
+    def ingredient(food):
+        if isinstance(food, model.CompoundFood) and any(
+            isinstance(c.food, model.CompoundFood) for c in food.constituents
+        ):
+            return None
+        return model.Breakdown.singleton(food.name, facts(food))
+    return _evaluate(
+        qf.food,
+        model.Breakdown.empty,
+        ingredient,
+        lambda c, value: value(c.food) * c.scale_factor,
+        known=ingredient,
+    ) * qf.scale_factor
+
+def _nutrient_facts(nutrient: model.Nutrient):
+    return model.NutritionFacts.of(nutrient)
+
+def _constituent_facts(qf: model.QuantifiedFood, value):
+    return value(qf.food) * qf.scale_factor
+
+def _constituent_shopping_list(qf: model.QuantifiedFood, value):
     if 'use' in qf.tags:
         return model.ShoppingList.empty()
     if 'buy' in qf.tags:
         return model.ShoppingList.singleton(qf)
-    match qf.food:
-        case model.Nutrient():
-            return model.ShoppingList.empty()
-        case model.CompoundFood():
-            slist = model.ShoppingList.empty()
-            for constituent in qf.food.constituents:
-                slist += shopping_list(constituent)
-            return slist * qf.scale_factor
-    import pdb;pdb.set_trace()
+    if isinstance(qf.food, model.Nutrient):
+        return model.ShoppingList.empty()
+    return value(qf.food) * qf.scale_factor
+
+def _whole_shopping_list(qf: model.QuantifiedFood):
+    if 'use' in qf.tags or isinstance(qf.food, model.Nutrient):
+        return model.ShoppingList.empty()
+    return model.ShoppingList.singleton(qf)
+
+FACTS = Fold(
+    model.NutritionFacts.empty,
+    _nutrient_facts,
+    _constituent_facts,
+)
+
+SHOPPING = Fold(
+    model.ShoppingList.empty,
+    lambda _: model.ShoppingList.empty(),
+    _constituent_shopping_list,
+    descend=lambda qf: not qf.tags & {'use', 'buy'},
+    whole=_whole_shopping_list,
+)
+
+def _evaluate(root: model.Food, empty, leaf, constituent, descend=None,
+              known=None, values=None, stats=None):
+    """Folds over the food tree under `root` with an explicit work stack, so
+    that the depth of a tree isn't limited by Python's recursion limit.
+
+    The value of a nutrient is `leaf(nutrient)`; the value of a compound food
+    is `empty()` plus `constituent(qf, value)` for each of its constituents qf,
+    where `value(food)` looks up the value of a constituent's food. Only the
+    foods of constituents satisfying `descend`, if given, are evaluated. A food
+    for which `known(food)`, if given, returns a value isn't evaluated at all.
+    A food shared by several branches is evaluated once.
+
+    `values` memoizes the value of each food by its identity. It holds on to
+    the foods, so that their ids can't be reused, and so may be kept for later
+    evaluations, for as long as the foods' constituents don't change. If
+    given, `stats` counts the foods found in `values` and those evaluated."""
+    if values is None:
+        values = {} # id(food) -> (food, value of food)
+    value = lambda food: values[id(food)][1]
+    before = len(values)
+    hits = 0
+    meter = limits.current_meter()
+    stack = [(root, False)]
+    while stack:
+        food, expanded = stack.pop()
+        if meter is not None:
+            meter.visit()
+        if id(food) in values:
+            hits += 1
+            continue
+        if known is not None and not expanded:
+            v = known(food)
+            if v is not None:
+                values[id(food)] = (food, v)
+                continue
+        match food:
+            case model.Nutrient():
+                values[id(food)] = (food, leaf(food))
+            case model.CompoundFood() if expanded:
+                total = empty()
+                for qf in food.constituents:
+                    total += constituent(qf, value)
+                values[id(food)] = (food, total)
+            case model.CompoundFood():
+                # Evaluate the constituents first, then come back.
+                stack.append((food, True))
+                for qf in reversed(food.constituents):
+                    if id(qf.food) in values:
+                        hits += 1
+                    elif descend is None or descend(qf):
+                        stack.append((qf.food, False))
+    if stats is not None:
+        stats.hits += hits
+        stats.misses += len(values) - before
+    return value(root)
+
+def portion_sweep(
+    food: model.Food,
+    unit: model.UnitName,
+    counts: list[float],
+    schema: model.NutrientSchema,
+    known=None,
+):
+    """Evaluates the nutrition facts of `t unit food` for every count t,
+    with a column per nutrient of `schema` that the food has."""
+    direction = nutrition_facts(model.QuantifiedFood(
+        quantity=model.Quantity(1, unit),
+        tags=set(),
+        food=food,
+    ), known)
+    return model.Sweep.linear(
+        f'{unit} {food.name}',
+        model.NutritionFacts.empty(),
+        direction,
+        counts,
+        schema,
+    )
+
+def constituent_sweep(
+    qf: model.QuantifiedFood,
+    replaces: model.FoodName,
+    food: model.Food,
+    unit: model.UnitName,
+    counts: list[float],
+    schema: model.NutrientSchema,
+    known=None,
+):
+    """Evaluates the nutrition facts of `qf` for every count t, after
+    replacing its direct constituent `replaces` by `t unit food`.
+    The rest of the recipe is only evaluated once."""
+    if not isinstance(qf.food, model.CompoundFood):
+        raise InterpretationError(f"'{qf.food.name}' has no constituents")
+    base = model.NutritionFacts.empty()
+    found = False
+    for constituent in qf.food.constituents:
+        if constituent.food.name == replaces:
+            found = True
+        else:
+            base += nutrition_facts(constituent, known)
+    if not found:
+        raise InterpretationError(
+            f"'{replaces}' is not a constituent of '{qf.food.name}'",
+        )
+    direction = nutrition_facts(model.QuantifiedFood(
+        quantity=model.Quantity(1, unit),
+        tags=set(),
+        food=food,
+    ), known)
+    label = f'{unit} {food.name}'
+    if replaces != food.name:
+        label += f' for {replaces}'
+    return model.Sweep.linear(
+        label,
+        base * qf.scale_factor,
+        direction,
+        counts,
+        schema,
+    )
 
 ###############################################################################
 
+# Stands for energy where a nutrient is expected, e.g. in `rank foods by
+# energy`; its natural unit is kcal.
+ENERGY = model.Nutrient(
+    name=model.FoodName('energy'),
+    energy=1.0,
+    natural_unit=model.UnitName('kcal'),
+)
+
+# Statements that only read definitions; any number of them may execute at
+# once, while other statements execute alone.
+READ_ONLY = (
+    syntax.PrintStmt,
+    syntax.ShopStmt,
+    syntax.SolveStmt,
+    syntax.SweepStmt,
+    syntax.BreakdownStmt,
+    syntax.RankStmt,
+    syntax.FindStmt,
+)
+
+# How many foods a rank statement lists by default
+RANK_LIMIT = 10
+
+def import_path(importer: str, name: str) -> str:
+    """The path of the module imported as `name` by the module at path
+    `importer`, normalized so that a module imported from different
+    directories is known by a single path."""
+    return ospath.normpath(ospath.join(ospath.dirname(importer), name + '.nut'))
+
 class Interpreter:
+    """Executes statements. An interpreter may be shared between threads:
+    read-only statements run concurrently, while definitions and module loads
+    wait for them to finish and then run alone, so that every statement sees a
+    consistent set of definitions."""
     def __init__(self, foodDB: FoodDB | None = None, output_stream=None):
         self.output_stream = \
             sys.stdout if output_stream is None else output_stream
-        if foodDB is None:
-            self.foodDB = FoodDB()
+        self.foodDB = FoodDB() if foodDB is None else foodDB
         self.modules = set()
+        self.lock = RWLock()
+        self._local = threading.local()
+        self._nutrient_index = None
+        self._nutrient_index_lock = threading.Lock()
+        # Fold -> memo of `traverse`, shared by the statements evaluating
+        # food trees; foods don't change once registered, bar their units.
+        self.memos = {}
+        # Fold -> CacheStats of its memo
+        self.cache_stats = {}
+        # What's in stock, for stock, consume and `shop ... net` statements
+        self.inventory = Inventory()
+        # How many processes may execute the read-only statements of a
+        # module; see `parallel`. None or 1 executes them here, in order.
+        self.processes = None
+
+    @property
+    def output_stream(self):
+        """Where statements print, unless `execute` was given another stream
+        for the current thread."""
+        return getattr(self._local, 'output_stream', None) \
+            or self._output_stream
+
+    @output_stream.setter
+    def output_stream(self, stream):
+        self._output_stream = stream
+
+    def nutrient_index(self):
+        """The index of the nutrients of every food, for rank and find
+        statements. It is built on first use, then kept up to date as foods
+        are registered."""
+        from .search import NutrientIndex
+        # Read-only statements may run concurrently; build the index once.
+        with self._nutrient_index_lock:
+            if self._nutrient_index is None:
+                self._nutrient_index = NutrientIndex(self.foodDB)
+            return self._nutrient_index
+
+    def stats(self):
+        """Counts and sizes what this interpreter holds on to: foods, caches
+        and so on, along with the hit rates of its caches. Waits for the
+        statements executing to finish, so that nothing changes meanwhile."""
+        from .introspect import interpreter_stats
+        with self.lock.write():
+            return interpreter_stats(self)
+
+    def session(self, output_stream=None):
+        """A new interpreter starting from everything defined in this one,
+        whose own definitions are layered over this one's. This interpreter
+        becomes read-only, so that any number of sessions can share it, along
+        with the nutrition facts of its foods, evaluated for the first one."""
+        with self.lock.write():
+            session = Interpreter(
+                foodDB=self.foodDB.overlay(),
+                output_stream=output_stream,
+            )
+            session.modules = set(self.modules)
+            # Sessions start from the stock but don't write to the ledger.
+            session.inventory = self.inventory.copy()
+        return session
+
+    def load_file(self, path: str):
+        """Loads the module at `path`, after loading its imports from the
+        files next to it. No effort is made to detect import loops."""
+        from .parser import parse_module
+        if path in self.modules:
+            return # imported by more than one module; parse it once
+        with open(path) as f:
+            module = parse_module(f, source=path)
+        for imp in module.imports:
+            self.load_file(import_path(path, imp.path))
+        self.load_module(path, module)
 
     def load_module(self, path: str, module: syntax.Module):
+        with self.lock.write():
+            self._load_module(path, module)
+
+    def _load_module(self, path: str, module: syntax.Module):
         if path in self.modules: return # already loaded
-        normalize = lambda p: ospath.join(ospath.dirname(path), p + '.nut')
-        if any(normalize(m.path) not in self.modules for m in module.imports):
+        if any(
+            import_path(path, m.path) not in self.modules
+            for m in module.imports
+        ):
             raise InterpretationError(
                 f'Module {path} cannot be loaded; at least one of its imports '
                 'is not loaded yet.',
             )
-        for stmt in module.body:
-            self.execute(stmt)
+        with profile.span('load', path):
+            if self.processes is not None and self.processes > 1:
+                from .parallel import execute_all
+                execute_all(self, module.body, self.processes)
+            else:
+                for stmt in module.body:
+                    self.execute(stmt)
         self.modules.add(path)
 
-    def execute(self, stmt: syntax.Stmt) -> None:
-        """Execute a statement in this interpreter."""
+    def execute(self, stmt: syntax.Stmt, output_stream=None,
+                budget: limits.Budget | None = None):
+        """Execute a statement in this interpreter. If given, the statement
+        prints to `output_stream` rather than the interpreter's stream; this
+        lets threads sharing an interpreter each collect their own output.
+
+        If given, `budget` limits the work of the statement; see `limits`.
+        Otherwise, it's charged to the budget metered by the caller, if any.
+
+        Returns what the statement printed as plain data, e.g. for JSON, for
+        the statements that have such a form: the `as_dict` of a breakdown.
+        Returns None for the others."""
+        name = type(stmt).__name__.removesuffix('WithLocation')
+        lock = self.lock.read() if isinstance(stmt, READ_ONLY) \
+            else self.lock.write()
+        previous_stream = getattr(self._local, 'output_stream', None)
+        if output_stream is not None:
+            self._local.output_stream = output_stream
+        try:
+            with lock, profile.span('execute', name, stmt.location), \
+                    limits.metered(budget):
+                return self._execute(stmt)
+        except limits.BudgetExceeded as e:
+            if e.location is None:
+                e.location = stmt.location
+            raise
+        finally:
+            self._local.output_stream = previous_stream
+
+    def _execute(self, stmt: syntax.Stmt) -> None:
         match stmt:
             case syntax.FoodStmt():
                 self._food_stmt(stmt)
@@ -119,6 +677,22 @@ class Interpreter:
                 self._print_stmt(stmt)
             case syntax.ShopStmt():
                 self._shop_stmt(stmt)
+            case syntax.SolveStmt():
+                self._solve_stmt(stmt)
+            case syntax.SweepStmt():
+                self._sweep_stmt(stmt)
+            case syntax.BreakdownStmt():
+                return self._breakdown_stmt(stmt)
+            case syntax.RankStmt():
+                self._rank_stmt(stmt)
+            case syntax.FindStmt():
+                self._find_stmt(stmt)
+            case syntax.NutrientStmt():
+                self._nutrient_stmt(stmt)
+            case syntax.StatsStmt():
+                self._stats_stmt(stmt)
+            case syntax.StockStmt():
+                self._stock_stmt(stmt)
             case _:
                 assert False, f'statement {stmt} is handled'
 
@@ -126,17 +700,288 @@ class Interpreter:
 
     def _print_stmt(self, stmt: syntax.PrintStmt):
         qfs = [self._quantified_food(part) for part in stmt.body]
+        policy = self._tag_policy(stmt.policy)
+        memo = self.memos.setdefault(FACTS, {})
+        stats = self.cache_stats.setdefault(FACTS, CacheStats())
         print(sum(
-            (nutrition_facts(qf) for qf in qfs),
+            (
+                traverse(
+                    qf, FACTS, policy, memo, self.foodDB.known_facts, stats,
+                )
+                for qf in qfs
+            ),
             start=model.NutritionFacts.empty(),
-        ).pretty, file=self.output_stream)
+        ).pretty_in(self.foodDB.schema), file=self.output_stream)
 
     def _shop_stmt(self, stmt: syntax.ShopStmt):
         qfs = [self._quantified_food(part) for part in stmt.body]
-        print(sum(
-            (shopping_list(qf) for qf in qfs),
+        policy = self._tag_policy(stmt.policy)
+        memo = self.memos.setdefault(SHOPPING, {})
+        stats = self.cache_stats.setdefault(SHOPPING, CacheStats())
+        shopping_list = sum(
+            (traverse(qf, SHOPPING, policy, memo, stats=stats) for qf in qfs),
             start=model.ShoppingList.empty(),
-        ).pretty, file=self.output_stream)
+        )
+        if stmt.net:
+            shopping_list = shopping_list.net(self.inventory.stock)
+        print(shopping_list.pretty, file=self.output_stream)
+
+    @staticmethod
+    def _tag_policy(policy: syntax.TagPolicy | None) -> TagPolicy:
+        if policy is None:
+            return EVERYTHING
+        return TagPolicy(
+            only=None if policy.only is None else frozenset(policy.only),
+            exclude=frozenset(policy.exclude),
+            stop=frozenset(policy.stop),
+        )
+
+    def _solve_stmt(self, stmt: syntax.SolveStmt):
+        for part in stmt.foods + stmt.targets:
+            bound = part.bound
+            if bound.low is not None and bound.high is not None \
+                    and bound.low > bound.high:
+                raise InterpretationError(
+                    'an interval must end at or above its start',
+                    location=bound.location,
+                )
+        portions = [] # one QuantifiedFood per candidate, for 1 of its unit
+        unit_facts = []
+        for part in stmt.foods:
+            food = self.foodDB.get(part.food, location=part.location)
+            qf = model.QuantifiedFood(
+                quantity=self._quantity(
+                    syntax.Quantity(1, part.unit, location=part.location),
+                    food,
+                ),
+                tags=set(),
+                food=food,
+            )
+            portions.append(qf)
+            unit_facts.append(nutrition_facts(qf, self.foodDB.known_facts))
+
+        targets = [self._target(part) for part in stmt.targets]
+        lows = [
+            -math.inf if t.bound.low is None else t.bound.low / k
+            for t, _, k in targets
+        ]
+        highs = [
+            math.inf if t.bound.high is None else t.bound.high / k
+            for t, _, k in targets
+        ]
+        x = solve.solve(
+            columns=[
+                [get(facts) for _, get, _ in targets]
+                for facts in unit_facts
+            ],
+            lows=lows,
+            highs=highs,
+            lower_bounds=[
+                0 if part.bound.low is None else part.bound.low
+                for part in stmt.foods
+            ],
+            upper_bounds=[
+                math.inf if part.bound.high is None else part.bound.high
+                for part in stmt.foods
+            ],
+        )
+
+        solution = [qf * xj for qf, xj in zip(portions, x)]
+        facts = sum(
+            (facts * xj for facts, xj in zip(unit_facts, x)),
+            start=model.NutritionFacts.empty(),
+        )
+        rows = [qf.pretty for qf in solution]
+        rows.append('')
+        rows.append(facts.pretty_in(self.foodDB.schema))
+        for (target, get, k), lo, hi in zip(targets, lows, highs):
+            total = get(facts)
+            if total < lo - 1e-4 * abs(lo) or total > hi + 1e-4 * abs(hi):
+                rows.append(
+                    f'unmet: {target.food} is {total * k:.2f} {target.unit}, '
+                    f'wanted {self._pretty_bound(target.bound)} {target.unit}'
+                )
+        print('\n'.join(rows), file=self.output_stream)
+
+    def _sweep_stmt(self, stmt: syntax.SweepStmt):
+        food = self.foodDB.get(stmt.food, location=stmt.location)
+        unit = self._quantity(
+            syntax.Quantity(1, stmt.unit, location=stmt.location),
+            food,
+        ).unit
+        try:
+            # A row per count; charged before the grid is laid out.
+            limits.charge(model.Sweep.size(stmt.start, stmt.stop, stmt.step))
+            counts = model.Sweep.grid(stmt.start, stmt.stop, stmt.step)
+        except ValueError as e:
+            raise InterpretationError(str(e), location=stmt.location)
+        if stmt.within is None:
+            if stmt.replaces is not None:
+                raise InterpretationError(
+                    'sweeping a replacement requires a food to sweep it in',
+                    location=stmt.location,
+                )
+            sweep = portion_sweep(
+                food, unit, counts, self.foodDB.schema, self.foodDB.known_facts,
+            )
+        else:
+            qf = self._quantified_food(stmt.within)
+            try:
+                sweep = constituent_sweep(
+                    qf,
+                    stmt.food if stmt.replaces is None else stmt.replaces,
+                    food,
+                    unit,
+                    counts,
+                    self.foodDB.schema,
+                    self.foodDB.known_facts,
+                )
+            except InterpretationError as e:
+                e.location = stmt.location
+                raise
+        print(sweep.pretty, file=self.output_stream)
+
+    def _breakdown_stmt(self, stmt: syntax.BreakdownStmt):
+        top = None if stmt.top is None else \
+            self._whole_number(stmt.top, 'top', stmt.location)
+        values = {} # shared between the parts
+        total = sum(
+            (
+                breakdown(
+                    self._quantified_food(part),
+                    stmt.ingredients,
+                    self.foodDB.known_facts,
+                    values,
+                )
+                for part in stmt.body
+            ),
+            start=model.Breakdown.empty(),
+        )
+        print(
+            total.pretty_top(self.foodDB.schema, top),
+            file=self.output_stream,
+        )
+        return total.as_dict(self.foodDB.schema, top)
+
+    def _rank_stmt(self, stmt: syntax.RankStmt):
+        from .search import Column
+        column = Column.of(
+            self._measured(stmt.nutrient, stmt.location),
+            stmt.per_kcal,
+        )
+        limit = RANK_LIMIT if stmt.limit is None else \
+            self._whole_number(stmt.limit, 'limit', stmt.location)
+        ranking = self.nutrient_index().rank(
+            column,
+            limit,
+            [self._condition(c) for c in stmt.conditions],
+        )
+        precision = 4 if stmt.per_kcal else 2
+        print('\n'.join(
+            [f'{x:>10.{precision}f} {column.unit}  {name}' for name, x in ranking]
+            or ['<no foods found>']
+        ), file=self.output_stream)
+
+    def _find_stmt(self, stmt: syntax.FindStmt):
+        limit = None if stmt.limit is None else \
+            self._whole_number(stmt.limit, 'limit', stmt.location)
+        names = self.nutrient_index().find(
+            [self._condition(c) for c in stmt.conditions],
+            limit,
+        )
+        print(
+            '\n'.join(names or ['<no foods found>']),
+            file=self.output_stream,
+        )
+
+    def _measured(self, name: str, location=None):
+        """The nutrient of that name, or ENERGY for energy."""
+        if name == 'energy':
+            return ENERGY
+        return self._nutrient(name, location)
+
+    def _condition(self, condition: syntax.Condition):
+        """Interprets a condition of a rank or find statement, converting
+        its amount into the natural unit of its nutrient."""
+        from .search import Column, Condition
+        nutrient = self._measured(condition.nutrient, condition.location)
+        if nutrient is ENERGY:
+            if condition.unit != 'kcal':
+                raise InterpretationError(
+                    f"energy must be given in 'kcal', not '{condition.unit}'",
+                    location=condition.location,
+                )
+            k = 1.0
+        else:
+            k = self._unit_factor(
+                nutrient, condition.unit, condition.location,
+            )
+        return Condition(
+            Column.of(nutrient, condition.per_kcal),
+            condition.op,
+            condition.count / k,
+        )
+
+    @staticmethod
+    def _whole_number(x: float, what: str, location=None) -> int:
+        if x < 1 or x != int(x):
+            raise InterpretationError(
+                f'{what} must be a positive whole number, not {x:g}',
+                location=location,
+            )
+        return int(x)
+
+    def _target(self, target: syntax.BoundedFood):
+        """Interprets the target of a solve statement into a triple
+        (target, get, k) where `get` extracts the targeted amount from a
+        NutritionFacts and `k` converts that amount into the target's unit."""
+        if target.food == 'energy':
+            if target.unit != 'kcal':
+                raise InterpretationError(
+                    f"energy must be given in 'kcal', not '{target.unit}'",
+                    location=target.location,
+                )
+            return target, (lambda facts: facts.energy), 1.0
+        nutrient = self._nutrient(target.food, target.location)
+        k = self._unit_factor(nutrient, target.unit, target.location)
+        def get(facts):
+            qty = facts.data.get(nutrient.name)
+            return 0.0 if qty is None else qty.count
+        return target, get, k
+
+    def _nutrient(self, name: str, location=None) -> model.Nutrient:
+        nutrient = self.foodDB.get(name, location=location)
+        if not isinstance(nutrient, model.Nutrient):
+            raise InterpretationError(
+                f"'{name}' is not a nutrient",
+                location=location,
+            )
+        return nutrient
+
+    @staticmethod
+    def _unit_factor(nutrient: model.Nutrient, unit: str, location=None):
+        """Converts amounts of a nutrient in its natural unit to `unit`."""
+        units = model.MASSES
+        if unit == nutrient.natural_unit:
+            return 1.0
+        elif unit in units and nutrient.natural_unit in units:
+            return units[nutrient.natural_unit].gram_equivalent / \
+                units[unit].gram_equivalent
+        else:
+            raise InterpretationError(
+                f"'{unit}' is not a unit of '{nutrient.name}'",
+                location=location,
+            )
+
+    @staticmethod
+    def _pretty_bound(bound: syntax.Bound):
+        if bound.low is None:
+            return f'at most {bound.high:.2f}'
+        if bound.high is None:
+            return f'at least {bound.low:.2f}'
+        if bound.low == bound.high:
+            return f'{bound.low:.2f}'
+        return f'{bound.low:.2f} to {bound.high:.2f}'
 
     def _food_stmt(self, stmt: syntax.FoodStmt):
         lhs_qty = self._quantity(stmt.lhs.quantity)
@@ -163,6 +1008,12 @@ class Interpreter:
         else:
             if stmt.weight is None:
                 # e.g. `1 x foo = ...`
+                if not sum(qf.weight for qf in rhs):
+                    raise InterpretationError(
+                        f"food '{stmt.lhs.food}' weighs nothing; give its "
+                        "weight with `weighs`",
+                        location=stmt.location,
+                    )
                 self.foodDB.register(
                     model.CompoundFood.from_constituent_sum(
                         name=stmt.lhs.food,
@@ -189,6 +1040,59 @@ class Interpreter:
                     f'weight {weight}'
                 )
 
+    def _nutrient_stmt(self, stmt: syntax.NutrientStmt):
+        nutrient = model.Nutrient(
+            name=model.FoodName(stmt.name),
+            energy=stmt.energy,
+            natural_unit=model.UnitName(stmt.unit),
+        )
+        if self.foodDB.has(stmt.name) and \
+                self.foodDB.get(stmt.name) == nutrient:
+            return # declared already, e.g. a built-in nutrient
+        self.foodDB.declare(nutrient, location=stmt.location)
+        log(f'declared nutrient {stmt.name} in {stmt.unit}')
+
+    def _stock_stmt(self, stmt: syntax.StockStmt):
+        if stmt.body is None:
+            print(self.inventory.pretty, file=self.output_stream)
+            return
+        deltas = {}
+        for part in stmt.body:
+            qf = self._quantified_food(part)
+            if stmt.consume and self.inventory.grams(qf.food.name) <= 0:
+                # Not stocked as is: a recipe uses up what goes into it.
+                memo = self.memos.setdefault(SHOPPING, {})
+                stats = self.cache_stats.setdefault(SHOPPING, CacheStats())
+                items = traverse(qf, SHOPPING, memo=memo, stats=stats).items
+                qfs = list(items.values()) or [qf]
+            else:
+                qfs = [qf]
+            for qf in qfs:
+                try:
+                    grams = qf.weight
+                except ValueError:
+                    grams = 0.0
+                if grams <= 0:
+                    raise InterpretationError(
+                        f"'{qf.food.name}' can't be weighed in "
+                        f'{qf.quantity.unit}',
+                        location=part.location,
+                    )
+                deltas[qf.food.name] = deltas.get(qf.food.name, 0.0) + \
+                    (-grams if stmt.consume else grams)
+        try:
+            self.inventory.change(deltas)
+        except ValueError as e:
+            raise InterpretationError(str(e), location=stmt.location)
+        except OSError as e:
+            raise InterpretationError(
+                f'could not write to the ledger: {e}',
+                location=stmt.location,
+            )
+
+    def _stats_stmt(self, stmt: syntax.StatsStmt):
+        print(self.stats().pretty, file=self.output_stream)
+
     def _weight_stmt(self, stmt: syntax.WeightStmt):
         lhs_food = self.foodDB.get(stmt.lhs.food)
         lhs_qty = self._quantity(stmt.lhs.quantity)
@@ -219,7 +1123,7 @@ class Interpreter:
         return model.Quantity(qty.count, qty.unit)
 
     def _quantified_food(self, syn: syntax.QuantifiedFood) -> model.QuantifiedFood:
-        food = self.foodDB.get(syn.food)
+        food = self.foodDB.get(syn.food, location=syn.location)
         qty = self._quantity(syn.quantity, food)
         return model.QuantifiedFood(
             quantity=qty,
@@ -236,7 +1140,7 @@ class Interpreter:
                      reference: model.Quantity,
                      location=None):
         match food:
-            case model.Nutrient:
+            case model.Nutrient():
                 raise InterpretationError(
                     'new units cannot be defined for nutrients',
                     location=location,
@@ -246,6 +1150,12 @@ class Interpreter:
                 f"unit '{qty.unit}' already defined for food '{food.name}'",
                 location=location,
             )
+        registered = self.foodDB.has(food.name) and \
+            self.foodDB.get(food.name) is food
+        if registered:
+            food = self.foodDB.own(food, location=location)
         food.define_unit(qty, reference)
+        if registered:
+            self.foodDB.changed(food)
 
 ###############################################################################
@@ -0,0 +1,164 @@
+"""Statistics about what an interpreter holds on to, to keep an eye on the
+memory of long-lived sessions.
+
+Sizes are estimated by walking the objects reachable from each part of the
+interpreter and adding up `sys.getsizeof` of each. An object reachable from
+several parts, such as a food held by a memo, is counted in the first part
+only, in the order foods, caches, base facts, nutrient index, modules."""
+
+from . import interpret, model
+
+from dataclasses import dataclass, fields, is_dataclass, replace
+import sys
+
+# Containers whose items the walk follows; anything else that isn't a
+# dataclass, such as functions, is counted without following it.
+CONTAINERS = (list, tuple, set, frozenset)
+
+@dataclass
+class InterpreterStats:
+    foods: int # every food of the FoodDB, including its base layers
+    nutrients: int # of which nutrients
+    units: int # of compound foods
+    constituents: int
+    modules: int
+    # values held by the memos, the facts tables of the base layers and the
+    # nutrient index
+    cached: int
+    sizes: dict[str, int] # part of the interpreter -> approximate bytes
+    caches: dict[str, interpret.CacheStats]
+
+    def as_dict(self):
+        return {
+            'foods': self.foods,
+            'nutrients': self.nutrients,
+            'units': self.units,
+            'constituents': self.constituents,
+            'modules': self.modules,
+            'cached': self.cached,
+            'bytes': dict(self.sizes),
+            'caches': {
+                name: {
+                    'hits': s.hits,
+                    'misses': s.misses,
+                    'hit_rate': s.hit_rate,
+                }
+                for name, s in self.caches.items()
+            },
+        }
+
+    @property
+    def pretty(self):
+        rows = [
+            f'foods: {self.foods} ({self.nutrients} nutrients)',
+            f'units: {self.units}',
+            f'constituents: {self.constituents}',
+            f'modules: {self.modules}',
+            f'cached values: {self.cached}',
+            'memory:',
+        ]
+        rows.extend(
+            f'  {part}: {_bytes(n)}' for part, n in self.sizes.items()
+        )
+        rows.append(f'  total: {_bytes(sum(self.sizes.values()))}')
+        rows.append('caches:')
+        for name, s in self.caches.items():
+            if s.hit_rate is None:
+                rows.append(f'  {name}: no lookups')
+            else:
+                rows.append(
+                    f'  {name}: {s.hit_rate:.1%} hits '
+                    f'({s.hits} hits, {s.misses} misses)'
+                )
+        return '\n'.join(rows)
+
+def _bytes(n: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if n < 1024:
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} GiB'
+
+class _Walk:
+    """Adds up the sizes of objects, counting each object once."""
+    def __init__(self):
+        self.seen = set()
+
+    def size(self, *roots) -> int:
+        total = 0
+        stack = list(roots)
+        while stack:
+            obj = stack.pop()
+            if id(obj) in self.seen:
+                continue
+            self.seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, CONTAINERS):
+                stack.extend(obj)
+            elif is_dataclass(obj) and not isinstance(obj, type):
+                # Not through __dict__, which Python may have to create.
+                stack.extend(getattr(obj, f.name) for f in fields(obj))
+        return total
+
+def interpreter_stats(interpreter) -> InterpreterStats:
+    """Counts and sizes what `interpreter` retains. The interpreter must not
+    change meanwhile; see `Interpreter.stats`."""
+    foodDB = interpreter.foodDB
+    foods = nutrients = units = constituents = 0
+    for _, food in foodDB.items():
+        foods += 1
+        match food:
+            case model.Nutrient():
+                nutrients += 1
+            case model.CompoundFood():
+                units += len(food.units)
+                constituents += len(food.constituents)
+
+    layers = []
+    layer = foodDB
+    while layer is not None:
+        layers.append(layer.data)
+        layer = layer.base
+    # The nutrition facts evaluated beforehand for the base layers, shared
+    # with any other sessions over them; see `interpret.FactsTable`.
+    tables = []
+    known = foodDB.known_facts
+    while isinstance(known, interpret.FactsTable):
+        tables.append(known.facts)
+        known = known.known
+
+    index = interpreter._nutrient_index
+    walk = _Walk()
+    sizes = {
+        'foods': walk.size(*layers),
+        'caches': walk.size(interpreter.memos),
+        'base facts': walk.size(*tables),
+        'nutrient index': 0 if index is None else
+            walk.size(index.vectors, index.columns),
+        'modules': walk.size(interpreter.modules),
+    }
+    cached = sum(
+        len(values)
+        for memo in interpreter.memos.values()
+        for values in memo.values()
+    )
+    cached += sum(len(table) for table in tables)
+    cached += 0 if index is None else len(index.vectors)
+
+    names = {interpret.FACTS: 'facts', interpret.SHOPPING: 'shopping'}
+    return InterpreterStats(
+        foods=foods,
+        nutrients=nutrients,
+        units=units,
+        constituents=constituents,
+        modules=len(interpreter.modules),
+        cached=cached,
+        sizes=sizes,
+        caches={
+            names[fold]: replace(stats)
+            for fold, stats in interpreter.cache_stats.items()
+        },
+    )
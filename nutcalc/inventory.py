@@ -0,0 +1,129 @@
+"""The inventory of a pantry: how many grams of each food are in stock.
+
+Stock statements add to the inventory and consume statements take from it;
+`shop ... net` leaves out of a shopping list what's in stock already.
+
+An inventory may be kept in a ledger: a file of JSON Lines to which every
+change is appended as an event `{"food": NAME, "grams": DELTA}`. Opening the
+ledger replays its events. Once the ledger holds many more events than there
+are foods in stock, it's compacted: rewritten with a single event per food in
+stock, so that replaying it stays fast however long it has been kept. Only
+one process should write to a ledger at a time."""
+
+from . import model
+
+import json
+import os
+
+# A ledger is compacted once it holds more than COMPACT_RATIO events per food
+# in stock, and more than COMPACT_MIN events in all.
+COMPACT_RATIO = 4
+COMPACT_MIN = 1000
+
+# Amounts of stock below this many grams are rounding errors
+EPSILON = 1e-9
+
+class Inventory:
+    def __init__(self, stock: dict[model.FoodName, float] | None = None,
+                 path: str | None = None):
+        # food name -> grams in stock, for the foods in stock
+        self.stock = {} if stock is None else stock
+        # The ledger, if any, and how many events it holds
+        self.path = path
+        self.events = 0
+
+    @staticmethod
+    def open(path: str) -> 'Inventory':
+        """The inventory kept in the ledger at `path`, which is created if
+        missing. An event cut short, e.g. by a crash while it was being
+        appended, is dropped."""
+        inventory = Inventory(path=path)
+        try:
+            with open(path, 'rb') as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return inventory
+        complete = contents[:contents.rfind(b'\n') + 1]
+        for n, line in enumerate(complete.decode().splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                inventory._apply(event['food'], float(event['grams']))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'{path}:{n}: malformed ledger event: {e}')
+            inventory.events += 1
+        if len(complete) < len(contents):
+            with open(path, 'r+b') as f:
+                f.truncate(len(complete))
+        inventory._maybe_compact()
+        return inventory
+
+    def copy(self) -> 'Inventory':
+        """An inventory starting with the same stock, kept in memory only."""
+        return Inventory(stock=dict(self.stock))
+
+    def grams(self, name: model.FoodName) -> float:
+        return self.stock.get(name, 0.0)
+
+    def change(self, deltas: dict[model.FoodName, float]):
+        """Adds `deltas` grams of foods to the stock, or takes them from it
+        for negative deltas, all at once. Raises ValueError, changing nothing,
+        if more of a food would be taken than is in stock."""
+        for name, delta in deltas.items():
+            if self.grams(name) + delta < -EPSILON:
+                raise ValueError(
+                    f"only {self.grams(name):.2f} g of '{name}' in stock",
+                )
+        if self.path is not None:
+            # Written first, so that the stock only changes once it's logged.
+            with open(self.path, 'a') as f:
+                f.write(''.join(
+                    json.dumps({'food': name, 'grams': delta}) + '\n'
+                    for name, delta in deltas.items()
+                ))
+            self.events += len(deltas)
+        for name, delta in deltas.items():
+            self._apply(name, delta)
+        if self.path is not None:
+            self._maybe_compact()
+
+    def revert(self, deltas: dict[model.FoodName, float]):
+        """Takes back a change, e.g. when the language server re-executes a
+        statement. This isn't logged; it's meant for inventories without a
+        ledger."""
+        for name, delta in deltas.items():
+            self._apply(name, -delta)
+
+    def _apply(self, name, delta):
+        grams = self.grams(name) + delta
+        if grams > EPSILON:
+            self.stock[name] = grams
+        else:
+            self.stock.pop(name, None)
+
+    def _maybe_compact(self):
+        if self.events > max(COMPACT_MIN, COMPACT_RATIO * len(self.stock)):
+            try:
+                self.compact()
+            except OSError:
+                pass # the ledger is still right, just long; try next time
+
+    def compact(self):
+        """Rewrites the ledger with a single event per food in stock. The
+        ledger is replaced atomically, so that a crash leaves either the old
+        ledger or the new one."""
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            for name, grams in sorted(self.stock.items()):
+                f.write(json.dumps({'food': name, 'grams': grams}) + '\n')
+        os.replace(tmp, self.path)
+        self.events = len(self.stock)
+
+    @property
+    def pretty(self):
+        return '\n'.join(
+            [f'{grams:.2f} g {name}' for name, grams in sorted(self.stock.items())]
+            if self.stock else
+            ['<nothing in stock>']
+        )
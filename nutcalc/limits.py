@@ -0,0 +1,156 @@
+"""Budgets bounding the work of a request: wall time, visits of the nodes of
+food trees, and memory.
+
+A budget is enforced cooperatively. While a budget is metered on a thread,
+evaluations on that thread charge every food they visit to it, and every so
+often check the time and memory spent; on a breach, they raise
+BudgetExceeded, leaving any memo as it was before the food being evaluated.
+Nothing is charged when no budget is metered.
+
+Memory is measured with tracemalloc, which only knows the allocations of the
+whole process: requests running at the same time are charged for each other's
+allocations, as well as for their own."""
+
+from .error import InterpretationError
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+import threading
+import time
+
+class BudgetExceeded(InterpretationError):
+    pass
+
+@dataclass(frozen=True)
+class Budget:
+    """Limits on a request; None means unlimited."""
+    seconds: float | None = None # of wall time
+    visits: int | None = None # of nodes of food trees
+    # Bytes allocated by the process, net, while the request runs, including
+    # those of concurrent requests. Needs tracemalloc, which slows allocations
+    # down while it's running.
+    memory: int | None = None
+
+    @staticmethod
+    def from_dict(d) -> 'Budget':
+        """Reads a budget from a request, e.g.
+        `{"seconds": 1, "visits": 1000000, "memory": 100000000}`."""
+        d = dict(d)
+        unknown = set(d) - {'seconds', 'visits', 'memory'}
+        if unknown:
+            raise ValueError(f'unknown budget limits: {", ".join(sorted(unknown))}')
+        for key, value in d.items():
+            if value is not None and (
+                isinstance(value, bool) or
+                not isinstance(value, (int, float)) or value < 0
+            ):
+                raise ValueError(f'budget {key} must be a non-negative number')
+        return Budget(
+            seconds=d.get('seconds'),
+            visits=None if d.get('visits') is None else int(d['visits']),
+            memory=None if d.get('memory') is None else int(d['memory']),
+        )
+
+# How many visits go by between checks of the time and memory spent
+CHECK_EVERY = 1024
+
+class Meter:
+    """What a request has spent of its budget so far."""
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.visits = 0
+        self.deadline = None if budget.seconds is None else \
+            time.monotonic() + budget.seconds
+        self.next_check = CHECK_EVERY
+        self.baseline = None
+        if budget.memory is not None:
+            self.baseline = _Tracing.start()
+
+    def close(self):
+        if self.baseline is not None:
+            _Tracing.stop()
+
+    def visit(self, n=1):
+        """Charges `n` visits, checking the rest of the budget every
+        CHECK_EVERY of them."""
+        self.visits += n
+        limit = self.budget.visits
+        if limit is not None and self.visits > limit:
+            raise BudgetExceeded(f'exceeded the budget of {limit} visits')
+        if self.visits >= self.next_check:
+            self.next_check = self.visits + CHECK_EVERY
+            self.check()
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded(
+                f'exceeded the budget of {self.budget.seconds:g} s',
+            )
+        if self.baseline is not None:
+            used = _Tracing.current() - self.baseline
+            if used > self.budget.memory:
+                raise BudgetExceeded(
+                    f'exceeded the budget of {self.budget.memory} bytes',
+                )
+
+class _Tracing:
+    """Shares tracemalloc between the meters of concurrent requests; it runs
+    for as long as any of them needs it."""
+    lock = threading.Lock()
+    users = 0
+    started = False # whether tracing was started here, rather than by a user
+
+    @classmethod
+    def start(cls) -> int:
+        import tracemalloc
+        with cls.lock:
+            if cls.users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                cls.started = True
+            cls.users += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    @classmethod
+    def stop(cls):
+        import tracemalloc
+        with cls.lock:
+            cls.users -= 1
+            if cls.users == 0 and cls.started:
+                tracemalloc.stop()
+                cls.started = False
+
+    @staticmethod
+    def current() -> int:
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[0]
+
+_local = threading.local()
+
+def current_meter() -> Meter | None:
+    """The meter of the request running on this thread, if it has a
+    budget."""
+    return getattr(_local, 'meter', None)
+
+def charge(n: int):
+    """Charges `n` visits to the budget of the current request, if any, e.g.
+    for the rows of a table about to be computed."""
+    meter = current_meter()
+    if meter is not None:
+        meter.visit(n)
+
+@contextmanager
+def metered(budget: Budget | None):
+    """Meters `budget` for the work done on this thread in the block. Without
+    a budget, the work stays charged to the enclosing budget, if any."""
+    if budget is None:
+        yield
+        return
+    previous = current_meter()
+    meter = Meter(budget)
+    _local.meter = meter
+    try:
+        meter.check() # e.g. a budget of 0 seconds
+        yield meter
+    finally:
+        _local.meter = previous
+        meter.close()
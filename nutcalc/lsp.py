@@ -0,0 +1,581 @@
+"""A language server for .nut files, speaking LSP over stdio.
+
+    python -m nutcalc.lsp
+
+Every open document keeps a live interpreter holding its definitions. A
+document is cut into top-level statements with `parser.split_statements` and
+`parser.merge_statements`; on each edit, only the statements whose text
+changed are parsed again, and only those and the statements depending on the
+foods they define are executed again, after undoing what they did before.
+Statements that merely moved keep their parse, shifted to their new lines.
+
+Provides diagnostics for parse and interpretation errors, go to definition
+of foods, and hover showing a food's nutrition facts.
+"""
+
+from . import interpret, model, parser, syntax
+from .error import NutcalcError
+
+from bisect import bisect_right
+from dataclasses import dataclass, field, fields
+from io import StringIO
+from parsy import line_info_at
+from urllib.parse import unquote, urlparse
+import json
+import math
+import os.path as ospath
+import sys
+
+def uri_to_path(uri: str) -> str:
+    return unquote(urlparse(uri).path)
+
+def path_to_uri(path: str) -> str:
+    return 'file://' + ospath.abspath(path)
+
+def lsp_range(span: syntax.SourceSpan):
+    return {
+        'start': {'line': span.start[0], 'character': span.start[1]},
+        'end': {'line': span.end[0], 'character': span.end[1]},
+    }
+
+def _nodes(node):
+    """Generates the syntax node and all the syntax nodes under it."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        for f in fields(node):
+            attr = getattr(node, f.name)
+            if isinstance(attr, syntax.Located):
+                stack.append(attr)
+            elif isinstance(attr, list):
+                stack.extend(x for x in attr if isinstance(x, syntax.Located))
+
+def _food_nodes(stmt):
+    """The nodes of a statement naming a food."""
+    return [
+        node for node in _nodes(stmt)
+        if isinstance(getattr(node, 'food', None), str)
+    ]
+
+def _message(e: Exception, located=True) -> str:
+    """The message of a diagnostic for an exception; with `located`, without
+    the location the range of the diagnostic shows."""
+    if isinstance(e, OSError):
+        return str(e)
+    if not isinstance(e, NutcalcError):
+        return f'{type(e).__name__}: {e}' # a bug, to be reported
+    return getattr(e, 'msg', str(e)) if located else str(e)
+
+@dataclass(eq=False)
+class Chunk:
+    """The text of one top-level statement of a document, and what became
+    of it."""
+    line: int # first line, counting from 0
+    text: str
+    # The parsed statement, unless parsing failed, with locations as of when
+    # its first line was `stmt_line`; see `statement`
+    stmt: object = None
+    stmt_line: int = 0
+    parse_error: Exception | None = None
+    # Diagnostic, as (message, (start row, start col), (end row, end col)),
+    # with rows relative to the chunk's first line
+    error: tuple | None = None
+    # Foods that the statement registers or gives new units to
+    defines: frozenset = frozenset()
+    # Nodes of the foods that the statement looks up, by food name
+    uses: dict = field(default_factory=dict)
+    # Functions undoing the statement's effect on the interpreter
+    undo: list = field(default_factory=list)
+
+    @property
+    def is_import(self):
+        return isinstance(self.stmt, syntax.ImportStmt)
+
+    @property
+    def statement(self):
+        """The parsed statement, with locations on the chunk's current lines.
+        Chunks move about on every edit above them, so their statements are
+        only shifted to match when needed."""
+        if self.stmt is not None and self.stmt_line != self.line:
+            self.stmt.shift(self.line - self.stmt_line)
+            self.stmt_line = self.line
+        return self.stmt
+
+    def fail(self, message: str, span: syntax.SourceSpan | None = None):
+        if span is None:
+            start, end = (0, 0), (0, len(self.text.split('\n', 1)[0]))
+        else:
+            start = (span.start[0] - self.line, span.start[1])
+            end = (span.end[0] - self.line, span.end[1])
+        self.error = (message, start, end)
+
+    def diagnostic(self):
+        message, start, end = self.error
+        return {
+            'range': {
+                'start': {'line': self.line + start[0], 'character': start[1]},
+                'end': {'line': self.line + end[0], 'character': end[1]},
+            },
+            'severity': 1,
+            'source': 'nutcalc',
+            'message': message,
+        }
+
+class Document:
+    def __init__(self, uri: str, text: str):
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.text = text
+        self.rebuild()
+
+    ### EDITING ###########################################################
+
+    def apply(self, change: dict):
+        """Applies one content change of a didChange notification."""
+        if 'range' not in change:
+            self.text = change['text']
+            return
+        start = self._offset(change['range']['start'])
+        end = self._offset(change['range']['end'])
+        self.text = self.text[:start] + change['text'] + self.text[end:]
+
+    def _offset(self, position):
+        line, character = position['line'], position['character']
+        offset = 0
+        for _ in range(line):
+            newline = self.text.find('\n', offset)
+            if newline == -1:
+                return len(self.text)
+            offset = newline + 1
+        return min(offset + character, len(self.text))
+
+    ### EVALUATION ########################################################
+
+    def rebuild(self):
+        """Evaluates the whole document from scratch."""
+        self.interpreter = interpret.Interpreter(output_stream=StringIO())
+        self.imported = {} # food name -> (uri, span) of imported definitions
+        self.facts = {} # food name -> (food, facts of its reference quantity)
+        parsed = {}
+        self.chunks = [
+            self._chunk(line, text, parsed)
+            for line, text in self._split({}, parsed)
+        ]
+        self._index()
+        for i, chunk in enumerate(self.chunks):
+            self._execute(i, chunk)
+
+    def update(self):
+        """Brings the evaluation up to date with the text, after edits."""
+        old = self.chunks
+        parsed = {}
+        new = self._split({c.text: c for c in old}, parsed)
+        n = min(len(old), len(new))
+        p = 0 # length of the common prefix
+        while p < n and old[p].line == new[p][0] and old[p].text == new[p][1]:
+            p += 1
+        s = 0 # length of the common suffix
+        while s < n - p and old[-1 - s].text == new[-1 - s][1]:
+            s += 1
+        removed = old[p:len(old) - s]
+        added = [
+            self._chunk(line, text, parsed)
+            for line, text in new[p:len(new) - s]
+        ]
+        suffix = old[len(old) - s:]
+        for chunk, (line, _) in zip(suffix, new[len(new) - s:]):
+            chunk.line = line
+
+        if any(
+            c.is_import or parser.IMPORT.match(c.text)
+            for c in removed + added
+        ):
+            self.rebuild()
+            return
+
+        # Work out which of the following statements are affected, from the
+        # names of the foods involved.
+        affected = set()
+        for chunk in removed + added:
+            affected |= chunk.defines
+        dirty = []
+        for chunk in suffix:
+            if affected & (chunk.defines | chunk.uses.keys()):
+                dirty.append(chunk)
+                affected |= chunk.defines
+
+        for chunk in reversed(removed + dirty):
+            self._undo(chunk)
+        for name in affected:
+            self.facts.pop(name, None)
+        self.chunks = old[:p] + added + suffix
+        self._index()
+        position = {id(c): i for i, c in enumerate(self.chunks)}
+        for chunk in added + dirty:
+            self._execute(position[id(chunk)], chunk)
+
+    def _lines(self):
+        return self.text.splitlines(keepends=True)
+
+    def _split(self, known: dict, parsed: dict) -> list:
+        """Cuts the text into top-level statements, as pairs (line, text),
+        joining texts that only parse together; see
+        `parser.merge_statements`. Whether a text parses is looked up in
+        `known`, chunks by text, and otherwise found by parsing it into a
+        new chunk, kept in `parsed` by line and text for `_chunk`."""
+        def parse(text, line):
+            chunk = known.get(text)
+            if chunk is None:
+                chunk = parsed[line, text] = self._parse(Chunk(line, text))
+            if chunk.stmt is None:
+                raise chunk.parse_error
+        return [
+            (line, text)
+            for line, text, _ in parser.merge_statements(
+                parser.split_statements(self._lines()), parse,
+            )
+        ]
+
+    def _chunk(self, line: int, text: str, parsed: dict) -> Chunk:
+        """The chunk of the statement at `line`, parsed by `_split` if it
+        could be."""
+        chunk = parsed.pop((line, text), None)
+        return self._parse(Chunk(line, text)) if chunk is None else chunk
+
+    def _parse(self, chunk: Chunk) -> Chunk:
+        try:
+            if parser.IMPORT.match(chunk.text):
+                chunk.stmt = parser.parse_import(
+                    chunk.text, None, chunk.line,
+                )
+            else:
+                chunk.stmt = parser.parse_stmt(chunk.text, self.path, chunk.line)
+            chunk.stmt_line = chunk.line
+        except parser.LocatedParseError as e:
+            chunk.parse_error = e
+            row, col = line_info_at(e.parse_error.stream, e.parse_error.index)
+            expected = sorted(repr(x) for x in e.parse_error.expected)
+            chunk.error = (
+                'expected ' + (
+                    f'one of {", ".join(expected)}'
+                    if len(expected) > 1 else
+                    expected[0]
+                ),
+                (row, col),
+                (row, col + 1),
+            )
+            return chunk
+
+        nodes = _food_nodes(chunk.stmt)
+        match chunk.stmt:
+            case syntax.FoodStmt():
+                chunk.defines = frozenset([chunk.stmt.lhs.food])
+                nodes.remove(chunk.stmt.lhs)
+            case syntax.WeightStmt():
+                chunk.defines = frozenset([chunk.stmt.lhs.food])
+            case syntax.NutrientStmt():
+                chunk.defines = frozenset([chunk.stmt.name])
+        nodes.sort(key=lambda node: (
+            (math.inf,) if node.location is None else node.location.start
+        ))
+        for node in nodes:
+            chunk.uses.setdefault(node.food, node)
+        return chunk
+
+    def _index(self):
+        """Indexes the statements defining each food, by position."""
+        self.definer = {}
+        for i, chunk in enumerate(self.chunks):
+            if isinstance(chunk.stmt, syntax.FoodStmt):
+                self.definer.setdefault(chunk.stmt.lhs.food, i)
+
+    def _execute(self, i: int, chunk: Chunk):
+        stmt = chunk.statement
+        if stmt is None:
+            return # it didn't parse
+        chunk.error = None
+        chunk.undo = []
+        if chunk.is_import:
+            self._import(chunk)
+            return
+        # Definitions made by statements further down are still in place;
+        # they mustn't be visible yet. Foods are looked up in order, so the
+        # first one missing is the one to report.
+        db = self.interpreter.foodDB
+        for name, node in chunk.uses.items():
+            if not db.has(name) or (
+                self.definer.get(name, i) > i and name not in self.imported
+            ):
+                chunk.fail(f'food {name} is not defined', node.location)
+                return
+        inventory = self.interpreter.inventory
+        if isinstance(stmt, syntax.StockStmt):
+            stock = dict(inventory.stock) # to work out what to undo
+        try:
+            self.interpreter.execute(stmt, output_stream=StringIO())
+        except Exception as e:
+            # Even an error the interpreter didn't expect only concerns this
+            # statement. The range of the diagnostic shows where; leave it
+            # out of the message.
+            chunk.fail(_message(e), getattr(e, 'location', stmt.location))
+            return
+
+        match chunk.stmt:
+            case syntax.FoodStmt() | syntax.NutrientStmt():
+                name = chunk.stmt.lhs.food \
+                    if isinstance(chunk.stmt, syntax.FoodStmt) \
+                    else chunk.stmt.name
+                food = db.get(name)
+                def undo():
+                    if db.data.get(name) is food:
+                        db.retract(name) # and a nutrient's declaration
+                chunk.undo.append(undo)
+            case syntax.WeightStmt():
+                food = db.get(chunk.stmt.lhs.food)
+                unit = food.units[-1]
+                def undo():
+                    food.units[:] = [u for u in food.units if u is not unit]
+                chunk.undo.append(undo)
+            case syntax.StockStmt():
+                deltas = {
+                    name: inventory.grams(name) - stock.get(name, 0.0)
+                    for name in stock.keys() | inventory.stock.keys()
+                }
+                chunk.undo.append(lambda: inventory.revert(deltas))
+
+    def _undo(self, chunk: Chunk):
+        for undo in reversed(chunk.undo):
+            undo()
+        if chunk.undo:
+            # The memos would keep the foods taken back alive.
+            self.interpreter.memos.clear()
+        chunk.undo = []
+
+    def _import(self, chunk: Chunk):
+        stmt = chunk.statement
+        path = interpret.import_path(self.path, stmt.path)
+        try:
+            self._load(path)
+        except Exception as e:
+            chunk.fail(_message(e, located=False), stmt.location)
+
+    def _load(self, path):
+        """Loads a module and its imports from files, indexing their
+        definitions."""
+        if path in self.interpreter.modules:
+            return
+        with open(path) as f:
+            module = parser.parse_module(f, source=path)
+        for imp in module.imports:
+            self._load(interpret.import_path(path, imp.path))
+        self.interpreter.load_module(path, module)
+        for stmt in module.body:
+            if isinstance(stmt, syntax.FoodStmt):
+                self.imported.setdefault(
+                    stmt.lhs.food,
+                    (path_to_uri(path), stmt.lhs.location),
+                )
+
+    ### QUERIES ###########################################################
+
+    def diagnostics(self):
+        return [c.diagnostic() for c in self.chunks if c.error is not None]
+
+    def node_at(self, line: int, character: int):
+        """The innermost node naming a food at the given position, if any."""
+        i = bisect_right([c.line for c in self.chunks], line) - 1
+        if i < 0 or self.chunks[i].statement is None:
+            return None
+        best = None
+        for node in _food_nodes(self.chunks[i].statement):
+            span = node.location
+            if span is not None and \
+                    span.start <= (line, character) <= span.end:
+                if best is None or span.start >= best.location.start:
+                    best = node
+        return best
+
+    def definition(self, name: str):
+        """The uri and span of the definition of a food, if known."""
+        i = self.definer.get(name)
+        if i is not None:
+            return self.uri, self.chunks[i].statement.lhs.location
+        return self.imported.get(name)
+
+    def food_facts(self, name: str):
+        """The food of the given name and the nutrition facts of its reference
+        quantity, cached until the food is redefined."""
+        db = self.interpreter.foodDB
+        if not db.has(name):
+            return None
+        food = db.get(name)
+        cached = self.facts.get(name)
+        if cached is None or cached[0] is not food:
+            cached = (food, interpret.food_facts(food))
+            self.facts[name] = cached
+        return cached
+
+    def hover(self, line: int, character: int):
+        node = self.node_at(line, character)
+        if node is None:
+            return None
+        found = self.food_facts(node.food)
+        if found is None:
+            return None
+        food, facts = found
+        units = ', '.join(
+            [food.natural_unit] if isinstance(food, model.Nutrient) else
+            (u.name for u in food.units)
+        )
+        return {
+            'contents': {
+                'kind': 'markdown',
+                'value':
+                    f'**{food.name}** ({units})\n\n'
+                    f'Per {food.reference_quantity}:\n'
+                    f'```\n{facts.pretty_in(self.interpreter.foodDB.schema)}'
+                    '\n```',
+            },
+            'range': lsp_range(node.location),
+        }
+
+### SERVER ################################################################
+
+class Server:
+    def __init__(self, infile, outfile):
+        self.infile = infile
+        self.outfile = outfile
+        self.documents = {}
+        self.running = True
+
+    def serve(self):
+        while self.running:
+            message = self.read()
+            if message is None:
+                break
+            self.handle(message)
+
+    def read(self):
+        length = None
+        while True:
+            line = self.infile.readline()
+            if not line:
+                return None
+            line = line.decode('ascii').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            if key.lower() == 'content-length':
+                length = int(value)
+        return json.loads(self.infile.read(length))
+
+    def send(self, message):
+        body = json.dumps({'jsonrpc': '2.0', **message}).encode('utf-8')
+        self.outfile.write(f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii'))
+        self.outfile.write(body)
+        self.outfile.flush()
+
+    def handle(self, message):
+        method = message.get('method')
+        params = message.get('params', {})
+        handler = getattr(self, 'on_' + (method or '').replace('/', '_'), None)
+        if 'id' not in message:
+            if handler is not None:
+                try:
+                    handler(params)
+                except Exception as e:
+                    self.log(f'{method} failed: {_message(e)}')
+            return
+        if handler is None:
+            self.send({
+                'id': message['id'],
+                'error': {'code': -32601, 'message': f'no method {method}'},
+            })
+            return
+        try:
+            result = handler(params)
+        except Exception as e:
+            # One bad request fails alone, rather than the server.
+            self.send({
+                'id': message['id'],
+                'error': {'code': -32603, 'message': _message(e)},
+            })
+            return
+        self.send({'id': message['id'], 'result': result})
+
+    def log(self, message: str):
+        self.send({
+            'method': 'window/logMessage',
+            'params': {'type': 1, 'message': message},
+        })
+
+    def publish(self, doc: Document):
+        self.send({
+            'method': 'textDocument/publishDiagnostics',
+            'params': {'uri': doc.uri, 'diagnostics': doc.diagnostics()},
+        })
+
+    def on_initialize(self, params):
+        return {
+            'capabilities': {
+                'textDocumentSync': {'openClose': True, 'change': 2},
+                'hoverProvider': True,
+                'definitionProvider': True,
+            },
+            'serverInfo': {'name': 'nutcalc'},
+        }
+
+    def on_shutdown(self, params):
+        return None
+
+    def on_exit(self, params):
+        self.running = False
+
+    def on_textDocument_didOpen(self, params):
+        item = params['textDocument']
+        doc = Document(item['uri'], item['text'])
+        self.documents[doc.uri] = doc
+        self.publish(doc)
+
+    def on_textDocument_didChange(self, params):
+        doc = self.documents[params['textDocument']['uri']]
+        for change in params['contentChanges']:
+            doc.apply(change)
+        doc.update()
+        self.publish(doc)
+
+    def on_textDocument_didClose(self, params):
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self.send({
+            'method': 'textDocument/publishDiagnostics',
+            'params': {'uri': uri, 'diagnostics': []},
+        })
+
+    def on_textDocument_hover(self, params):
+        doc = self.documents.get(params['textDocument']['uri'])
+        if doc is None:
+            return None
+        position = params['position']
+        return doc.hover(position['line'], position['character'])
+
+    def on_textDocument_definition(self, params):
+        doc = self.documents.get(params['textDocument']['uri'])
+        if doc is None:
+            return None
+        position = params['position']
+        node = doc.node_at(position['line'], position['character'])
+        if node is None:
+            return None
+        found = doc.definition(node.food)
+        if found is None:
+            return None
+        uri, span = found
+        return {'uri': uri, 'range': lsp_range(span)}
+
+def main():
+    Server(sys.stdin.buffer, sys.stdout.buffer).serve()
+
+if __name__ == '__main__':
+    main()
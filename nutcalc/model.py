@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from typing import NewType
+import heapq
 
 UnitName = NewType('UnitName', str)
 
@@ -29,14 +30,17 @@ class Nutrient:
                 f"Cannot retrieve weight of {self.name} in {name}; it's "
                 f"natural unit is {self.natural_unit}.",
             )
-        unit = WEIGHTS.get(name)
-        if unit is None:
-            raise ValueError(f"Nutrient natural unit must be a weight")
-        return unit.gram_equivalent
+        return self.unit.gram_equivalent
+
+    @property
+    def unit(self) -> Unit:
+        """The natural unit of this nutrient. A unit that isn't a mass, such
+        as IU or a currency, weighs nothing."""
+        return MASSES.get(self.natural_unit) or Unit(self.natural_unit, 0)
 
     @property
     def units(self):
-        return [WEIGHTS[self.natural_unit]]
+        return [self.unit]
 
     @property
     def reference_quantity(self):
@@ -203,6 +207,10 @@ class QuantifiedFood:
     def scale_factor(self):
         """How many multiples of the underlying food's reference quantity are
         contained in this QuantifiedFood?"""
+        reference = self.food.reference_quantity
+        if self.quantity.unit == reference.unit:
+            # No need to weigh; some units, like IU, weigh nothing.
+            return self.quantity.count / reference.count
         return self.weight / self.reference_weight
 
     @property
@@ -249,6 +257,27 @@ class ShoppingList:
             },
         )
 
+    def net(self, stock) -> ShoppingList:
+        """What's left to buy when `stock` maps the names of foods to the
+        grams of them in stock. Items in units that weigh nothing are left
+        as they are."""
+        items = {}
+        for name, qf in self.items.items():
+            have = stock.get(name, 0.0)
+            if have <= 0:
+                items[name] = qf
+                continue
+            try:
+                need = qf.weight
+            except ValueError:
+                items[name] = qf
+                continue
+            if need <= 0:
+                items[name] = qf
+            elif have < need:
+                items[name] = qf * ((need - have) / need)
+        return ShoppingList(items)
+
     @property
     def pretty(self):
         return '\n'.join(
@@ -260,15 +289,28 @@ class ShoppingList:
 @dataclass
 class NutritionFacts:
     """Wraps a map of nutrients -> quantities with some arithmetic
-    operations."""
+    operations. The energy content in kcal is added up alongside, as the
+    nutrients' energy depends on the schema they were declared in."""
     data: dict[FoodName, Quantity]
+    energy: float = 0.0
 
     @staticmethod
     def empty():
         return NutritionFacts(data={})
 
+    @staticmethod
+    def of(nutrient: Nutrient) -> NutritionFacts:
+        """The nutrition facts of the reference quantity of a nutrient."""
+        return NutritionFacts(
+            data={nutrient.name: nutrient.reference_quantity},
+            energy=nutrient.energy,
+        )
+
     def __add__(self, other: NutritionFacts) -> NutritionFacts:
-        nut = NutritionFacts(data=dict(self.data))
+        nut = NutritionFacts(
+            data=dict(self.data),
+            energy=self.energy + other.energy,
+        )
         for name, qty in other.data.items():
             nut.data[name] = nut.data.get(name, Quantity.zero(qty.unit)) + qty
         return nut
@@ -278,27 +320,192 @@ class NutritionFacts:
             case float:
                 return NutritionFacts(
                     { name: qty*k for name, qty in self.data.items() },
+                    self.energy * k,
                 )
         raise ValueError(
             f'NutritionFacts cannot be multiplied by {type(k)}, only `float`.',
         )
 
-    @property
-    def energy(self):
-        """The energy content in kcal of these nutrition facts."""
-        return sum(
-            NUTRIENTS[name].energy * qty.count
-            for name, qty in
-            self.data.items()
+    def pretty_in(self, schema: NutrientSchema):
+        """The facts as text, listing nutrients in the order of `schema`."""
+        rows = []
+        rows.append(f'energy: {Quantity(self.energy, "kcal")}')
+        for k in (n.name for n in schema):
+            if k in self.data:
+                rows.append(f'{k}: {self.data[k]}')
+        return '\n'.join(rows)
+
+@dataclass
+class Sweep:
+    """Nutrition facts evaluated over a grid of counts of some unit.
+    Each row is a vector of amounts laid out according to `columns`, the first
+    of which is always energy."""
+    label: str
+    counts: list[float]
+    columns: list[FoodName]
+    units: list[UnitName] # of the columns
+    rows: list[list[float]]
+
+    @staticmethod
+    def size(start: float, stop: float, step: float) -> int:
+        """The number of counts from start to stop inclusive, in increments
+        of step."""
+        if step <= 0:
+            raise ValueError('sweep step must be positive')
+        if stop < start:
+            raise ValueError('sweep must stop at or after its start')
+        return int((stop - start) / step + 1e-9) + 1
+
+    @staticmethod
+    def grid(start: float, stop: float, step: float) -> list[float]:
+        """The counts from start to stop inclusive, in increments of step."""
+        return [start + i * step for i in range(Sweep.size(start, stop, step))]
+
+    @staticmethod
+    def linear(
+        label: str,
+        base: NutritionFacts,
+        direction: NutritionFacts,
+        counts: list[float],
+        schema: NutrientSchema,
+    ) -> Sweep:
+        """Evaluates `base + t * direction` for every count t at once, as a
+        single linear combination of two vectors. Columns are in the order of
+        `schema`."""
+        columns = [
+            n for n in schema
+            if n.name in base.data or n.name in direction.data
+        ]
+        b = [base.energy] + [
+            base.data[n.name].count if n.name in base.data else 0.0
+            for n in columns
+        ]
+        d = [direction.energy] + [
+            direction.data[n.name].count if n.name in direction.data else 0.0
+            for n in columns
+        ]
+        rows = [[bi + t * di for bi, di in zip(b, d)] for t in counts]
+        return Sweep(
+            label,
+            counts,
+            [FoodName('energy')] + [n.name for n in columns],
+            [UnitName('kcal')] + [n.natural_unit for n in columns],
+            rows,
         )
 
     @property
     def pretty(self):
+        header = [self.label] + [
+            f'{c} ({u})' for c, u in zip(self.columns, self.units)
+        ]
+        table = [header] + [
+            [f'{t:.2f}'] + [f'{x:.2f}' for x in row]
+            for t, row in zip(self.counts, self.rows)
+        ]
+        widths = [max(len(r[i]) for r in table) for i in range(len(header))]
+        return '\n'.join(
+            '  '.join(cell.rjust(w) for cell, w in zip(r, widths)).rstrip()
+            for r in table
+        )
+
+@dataclass
+class Breakdown:
+    """Nutrition facts attributed to the foods that contributed them, with
+    some arithmetic operations. The contributions of a food listed twice are
+    added up."""
+    data: dict[FoodName, NutritionFacts]
+
+    @staticmethod
+    def empty():
+        return Breakdown(data={})
+
+    @staticmethod
+    def singleton(name: FoodName, facts: NutritionFacts):
+        return Breakdown(data={name: facts})
+
+    def __add__(self, other: Breakdown) -> Breakdown:
+        data = dict(self.data)
+        for name, facts in other.data.items():
+            data[name] = data[name] + facts if name in data else facts
+        return Breakdown(data)
+
+    def __mul__(self, k) -> Breakdown:
+        return Breakdown(
+            data={name: facts * k for name, facts in self.data.items()},
+        )
+
+    @property
+    def total(self) -> NutritionFacts:
+        return sum(self.data.values(), start=NutritionFacts.empty())
+
+    def columns(self, schema: NutrientSchema) -> list[FoodName]:
+        """Energy, followed by every nutrient that some food contributed, in
+        the order of `schema`."""
+        present = set()
+        for facts in self.data.values():
+            present.update(facts.data)
+        return [FoodName('energy')] + [
+            n.name for n in schema if n.name in present
+        ]
+
+    def contributors(self, column: FoodName, top: int | None = None):
+        """The foods contributing to `column` (a nutrient, or energy) as
+        pairs (food name, amount), largest first, leaving out foods that
+        contribute nothing. With `top`, only the `top` largest are listed."""
+        amounts = (
+            (name, facts.energy if column == 'energy' else
+                facts.data[column].count)
+            for name, facts in self.data.items()
+            if column == 'energy' or column in facts.data
+        )
+        amounts = [(name, x) for name, x in amounts if x]
+        if top is None:
+            return sorted(amounts, key=lambda p: p[1], reverse=True)
+        return heapq.nlargest(top, amounts, key=lambda p: p[1])
+
+    def as_dict(self, schema: NutrientSchema, top: int | None = None):
+        """A plain-data rendition, e.g. for JSON: maps each column, in the
+        order of `schema`, to its unit, its total, its contributors, largest
+        first, as dicts with keys `food` and `amount`, and the total amount of
+        the other contributors left out by `top`."""
+        total = self.total
+        result = {}
+        for column in self.columns(schema):
+            listed = self.contributors(column, top)
+            amount = total.energy if column == 'energy' else \
+                total.data[column].count
+            result[column] = {
+                'unit': 'kcal' if column == 'energy' else
+                    total.data[column].unit,
+                'total': amount,
+                'contributors': [
+                    {'food': name, 'amount': x} for name, x in listed
+                ],
+                'others': amount - sum(x for _, x in listed),
+            }
+        return result
+
+    def pretty_top(self, schema: NutrientSchema, top: int | None = None):
+        """The breakdown as text, listing at most `top` contributors per
+        column and summing up the rest."""
         rows = []
-        rows.append(f'energy: {Quantity(self.energy, "kcal")}')
-        for k in (n.name for n in ALL_NUTRIENTS):
-            if k in self.data:
-                rows.append(f'{k}: {self.data[k]}')
+        for column, entry in self.as_dict(schema, top).items():
+            total = entry['total']
+            share = lambda x: f'{x / total:6.1%}' if total else '     -'
+            rows.append(
+                f'{column}: {Quantity(total, entry["unit"])}'
+            )
+            for c in entry['contributors']:
+                rows.append(
+                    f'  {c["amount"]:>10.2f} {share(c["amount"])}  {c["food"]}'
+                )
+            hidden = len(self.contributors(column)) - \
+                len(entry['contributors'])
+            if hidden:
+                rows.append(
+                    f'  {entry["others"]:>10.2f} {share(entry["others"])}  '
+                    f'({hidden} other{"s" if hidden > 1 else ""})'
+                )
         return '\n'.join(rows)
 
 ### GLOBAL CONSTANTS: ###
@@ -317,6 +524,9 @@ IU = Unit(name=UnitName('IU'), gram_equivalent=0)
 ALL_WEIGHTS = [G, KG, MG, OZ, LB]
 WEIGHTS = { w.name: w for w in ALL_WEIGHTS }
 
+# The units of mass that nutrients may be measured in
+MASSES = { u.name: u for u in ALL_WEIGHTS + [MCG] }
+
 PROTEIN = Nutrient(name=FoodName('protein'), energy=4, natural_unit=G.name)
 CARBS = Nutrient(name=FoodName('carbs'), energy=4, natural_unit=G.name)
 FAT = Nutrient(name=FoodName('fat'), energy=9, natural_unit=G.name)
@@ -347,3 +557,60 @@ ALL_NUTRIENTS = MACRONUTRIENTS + [Nutrient(FoodName('water'), 0, G.name)] + \
     MILLI_MINERALS + MICRO_MINERALS + VITAMINS
 
 NUTRIENTS = { nut.name: nut for nut in ALL_NUTRIENTS }
+
+class NutrientSchema:
+    """The nutrients that foods are made of, in order: those of the base
+    schema, then those declared in this one. Like FoodDBs, which each hold a
+    schema, a schema may be layered over a base that many layers share, e.g.
+    one per session, each declaring its own nutrients.
+
+    Anything laid out according to a schema, e.g. an array with one column
+    per nutrient, should record the schema's `version` and catch up with the
+    nutrients declared since."""
+    def __init__(self, nutrients=(), base: NutrientSchema | None = None):
+        self.base = base
+        self.declared = {n.name: n for n in nutrients}
+        self.changes = 0 # declarations and retractions in this layer
+
+    @property
+    def version(self) -> int:
+        """Changes whenever a nutrient is declared or retracted."""
+        return self.changes + (0 if self.base is None else self.base.version)
+
+    def get(self, name: FoodName) -> Nutrient | None:
+        schema = self
+        while schema is not None:
+            nutrient = schema.declared.get(name)
+            if nutrient is not None:
+                return nutrient
+            schema = schema.base
+        return None
+
+    def __iter__(self):
+        if self.base is not None:
+            yield from self.base
+        yield from self.declared.values()
+
+    def declare(self, nutrient: Nutrient) -> bool:
+        """Adds a nutrient to the schema, unless it's there already. Returns
+        whether the schema changed."""
+        existing = self.get(nutrient.name)
+        if existing is not None:
+            if existing != nutrient:
+                raise ValueError(
+                    f'nutrient {existing.name} is already declared in '
+                    f'{existing.natural_unit} with energy {existing.energy:g}',
+                )
+            return False
+        self.declared[nutrient.name] = nutrient
+        self.changes += 1
+        return True
+
+    def retract(self, name: FoodName):
+        """Takes back the declaration of a nutrient in this layer, e.g. when
+        the language server re-executes it."""
+        if self.declared.pop(name, None) is not None:
+            self.changes += 1
+
+# The built-in nutrients, the base of every schema
+BUILTIN_SCHEMA = NutrientSchema(ALL_NUTRIENTS)
@@ -0,0 +1,121 @@
+"""Evaluation of the read-only statements of a module in a pool of processes.
+
+A module such as a monthly report is mostly a long run of print and shop
+statements after the definitions they read. Each such run is handed to a pool
+of processes, and the output of every statement is written in source order as
+soon as it and those before it are done. Statements that define something run
+in this process, between runs, as usual.
+
+The pool is started once per module, at its first run, each process starting
+from a copy of the FoodDB as of then. The statements that changed something
+here since are sent along with the next run, for the processes to execute
+before it, so that they keep their foods and what they evaluated of them
+rather than receiving a new copy of every food for each run.
+
+A statement failing in a worker is executed again here, so that its error is
+raised as if it had run here in the first place; the statements after it
+are then not reported, as when running sequentially."""
+
+from . import interpret, limits, syntax
+from .error import NutcalcError
+from .inventory import Inventory
+
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import chain, groupby
+
+# Statements a worker can run; rank and find are left out, as every worker
+# would build its own nutrient index.
+PARALLEL = (
+    syntax.PrintStmt,
+    syntax.ShopStmt,
+    syntax.SolveStmt,
+    syntax.SweepStmt,
+    syntax.BreakdownStmt,
+)
+
+# Shorter runs aren't worth starting a pool for
+MIN_RUN = 8
+
+def runs(stmts):
+    """Splits statements into runs, generating pairs (parallel, statements):
+    runs of at least MIN_RUN statements that workers can execute, and runs
+    of statements to execute here."""
+    for parallel, group in groupby(stmts, lambda s: isinstance(s, PARALLEL)):
+        group = list(group)
+        yield parallel and len(group) >= MIN_RUN, group
+
+def execute_all(interpreter, stmts, processes: int):
+    """Executes statements in order, as `interpreter.execute` would, running
+    long runs of read-only statements in `processes` processes. Under a
+    budget, which workers couldn't charge, everything runs here."""
+    metered = limits.current_meter() is not None
+    pool = None
+    # The statements executed here that changed something since the pool
+    # started, for the workers to catch up with.
+    changes = []
+    try:
+        for parallel, group in runs(stmts):
+            if not parallel or metered:
+                for stmt in group:
+                    interpreter.execute(stmt)
+                    if pool is not None and \
+                            not isinstance(stmt, interpret.READ_ONLY):
+                        changes.append(stmt)
+                continue
+            if pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers=processes,
+                    initializer=_init_worker,
+                    initargs=(interpreter.foodDB, interpreter.inventory.stock),
+                )
+            size = max(1, len(group) // (4 * processes))
+            outputs = chain.from_iterable(pool.map(
+                _execute_chunk,
+                [
+                    (changes, group[k:k + size])
+                    for k in range(0, len(group), size)
+                ],
+            ))
+            for stmt, output in zip(group, outputs):
+                if output is None:
+                    interpreter.execute(stmt) # raises the error
+                else:
+                    interpreter.output_stream.write(output)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+# The interpreter of a worker process, and how many of the changes made in
+# the main process since the pool started it has executed.
+_WORKER = None
+_CAUGHT_UP = 0
+
+def _init_worker(foodDB, stock):
+    global _WORKER
+    _WORKER = interpret.Interpreter(foodDB=foodDB)
+    _WORKER.inventory = Inventory(stock=dict(stock)) # for `shop ... net`
+
+def _execute_chunk(task) -> list[str | None]:
+    """The outputs of a chunk of statements, after catching up with the
+    changes made in the main process; see `_execute`."""
+    global _CAUGHT_UP
+    changes, stmts = task
+    try:
+        for stmt in changes[_CAUGHT_UP:]:
+            _WORKER.execute(stmt, output_stream=StringIO())
+            _CAUGHT_UP += 1
+    except NutcalcError:
+        # They succeeded in the main process, so this shouldn't happen; the
+        # statements are then executed there instead.
+        return [None] * len(stmts)
+    return [_execute(stmt) for stmt in stmts]
+
+def _execute(stmt) -> str | None:
+    """The output of a statement, or None if it failed."""
+    output = StringIO()
+    try:
+        _WORKER.execute(stmt, output_stream=output)
+    except NutcalcError:
+        return None
+    return output.getvalue()
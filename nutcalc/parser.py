@@ -1,9 +1,11 @@
 from .syntax import *
 from .error import NutcalcError
+from . import profile
 
 from parsy import (
     ParseError,
     alt,
+    line_info_at,
     char_from,
     digit,
     fail,
@@ -12,15 +14,21 @@ from parsy import (
     seq,
     string,
 )
+import re
 
 @dataclass
 class LocatedParseError(NutcalcError):
     parse_error: ParseError
     source: str
+    first_line: int = 0
+
+    def line_info(self):
+        line, col = line_info_at(self.parse_error.stream, self.parse_error.index)
+        return f'{line + self.first_line}:{col}'
 
     def __str__(self):
         expected_list = sorted(repr(e) for e in self.parse_error.expected)
-        return f'{self.source}:{self.parse_error.line_info()}: expected ' + \
+        return f'{self.source}:{self.line_info()}: expected ' + \
             (f'one of {', '.join(expected_list)}'
              if len(expected_list) > 1 else
              expected_list[0])
@@ -28,24 +36,129 @@ class LocatedParseError(NutcalcError):
 def parse_module(f, source=None):
     """Parses an entire file. Returns a Module."""
     contents = f.read() # XXX find a way to avoid buffering the whole file
+    with profile.span('parse', '<unknown>' if source is None else source):
+        try:
+            result = (junk >> module).parse(contents)
+        except ParseError as e:
+            raise LocatedParseError(e, '<unknown>' if source is None else source)
+        else:
+            if source is not None:
+                for stmt in result.body:
+                    stmt.filename = source
+            return result
+
+def parse_stmt(line: str, source=None, first_line=0):
+    """Parses one statement. If the statement was cut out of a larger text,
+    `first_line` gives the line it starts on, so that locations refer to the
+    larger text."""
+    with profile.span('parse', '<unknown>' if source is None else source):
+        try:
+            result = (junk >> stmt).parse(line)
+            result.filename = source
+            if first_line:
+                result.shift(first_line)
+            return result
+        except ParseError as e:
+            raise LocatedParseError(
+                e,
+                '<unknown>' if source is None else source,
+                first_line,
+            )
+
+def parse_import(line: str, source=None, first_line=0):
+    """Parses one import statement, like `parse_stmt`."""
     try:
-        result = (junk >> module).parse(contents)
-    except ParseError as e:
-        raise LocatedParseError(e, '<unknown>' if source is None else source)
-    else:
-        if source is not None:
-            for stmt in result.body:
-                stmt.filename = source
-        return result
-
-def parse_stmt(line: str, source=None):
-    """Parses one statement."""
-    try:
-        result = (junk >> stmt).parse(line)
-        result.filename = source
-        return result
+        result = (junk >> import_stmt << junk).parse(line)
     except ParseError as e:
-        raise LocatedParseError(e, '<unknown>' if source is None else source)
+        raise LocatedParseError(
+            e,
+            '<unknown>' if source is None else source,
+            first_line,
+        )
+    result.filename = source
+    if first_line:
+        result.shift(first_line)
+    return result
+
+# A line ending in one of these continues the statement on the next line.
+CONTINUATIONS = ('+', '*', '/', '=', ':', 'weighs', ',')
+
+# A line starting with one of these continues the statement on the lines
+# before it: no statement starts with an operator, nor with `for`, which
+# introduces the targets of a solve statement.
+CONTINUED = re.compile(r'[-+*/=:,]|(weighs|for)\b')
+
+# The text of an import statement, as cut out by `split_statements`, starts
+# with this; see `parse_import`.
+IMPORT = re.compile(r'\s*import\b')
+
+def split_statements(lines):
+    """Groups lines of source into the text of individual top-level
+    statements, without parsing them. Generates pairs (line number, text),
+    counting lines from 0.
+
+    A statement continues on the next line when its line ends with an
+    operator such as `+` or `:`, or when the next line starts with one, such
+    as a `-` bullet, or with `for`. A statement is thus only complete once
+    the next statement starts, or the lines run out. Blank and comment lines
+    between statements are dropped. This lets callers parse and execute
+    statements one at a time as their lines arrive; see `merge_statements`
+    for the texts that still fail to parse."""
+    chunk = [] # lines of the open statement
+    gap = [] # blank and comment lines after them
+    start = 0
+    pending = False # whether the last line ended with an operator
+    for i, line in enumerate(lines):
+        code = line.split('#', 1)[0].strip()
+        if not code:
+            if chunk:
+                gap.append(line)
+            continue
+        if chunk and not pending and not CONTINUED.match(code):
+            yield start, ''.join(chunk)
+            chunk = []
+        if chunk:
+            chunk.extend(gap)
+        else:
+            start = i
+        gap = []
+        chunk.append(line)
+        pending = code.endswith(CONTINUATIONS)
+    if chunk:
+        yield start, ''.join(chunk)
+
+def merge_statements(chunks, parse):
+    """Parses the pairs (line number, text) of `split_statements` with
+    `parse(text, line)`, generating triples (line number, text, result),
+    where the result is what `parse` returned, or the LocatedParseError it
+    raised.
+
+    The splitter only looks at the start and end of lines, so it may cut a
+    statement in two. A text that fails to parse is therefore parsed again
+    joined with the next one; if that parses, the two are one statement.
+    Otherwise, the error of the first is generated, and the next is parsed
+    by itself."""
+    failed = None # (line, text, error) of the last text, if it failed
+    for line, text in chunks:
+        if failed is not None:
+            failed_line, failed_text, error = failed
+            failed = None
+            # Blank and comment lines between them become empty lines, to
+            # keep the lines of the second text where they were.
+            joined = failed_text + '\n' * (
+                line - failed_line - failed_text.count('\n')
+            ) + text
+            try:
+                yield failed_line, joined, parse(joined, failed_line)
+                continue
+            except LocatedParseError:
+                yield failed_line, failed_text, error
+        try:
+            yield line, text, parse(text, line)
+        except LocatedParseError as e:
+            failed = line, text, e
+    if failed is not None:
+        yield failed
 
 ### LEXING ############################################################
 
@@ -66,6 +179,7 @@ number = lexeme(
 ).desc('number')
 
 operator = lambda c: lexeme(string(c))
+keyword = lambda w: lexeme(regex(w + r'\b')).desc(w)
 
 @generate
 def string_literal():
@@ -134,6 +248,54 @@ bullet_expr = (operator('-') >> expr).at_least(1).map(
     lambda start, body, end: Expr(body, location=SourceSpan(start, end)),
 )
 
+bound = alt(
+    seq(arith, keyword('to') >> arith),
+    (keyword('at') >> keyword('least') >> arith).map(lambda x: (x, None)),
+    (keyword('at') >> keyword('most') >> arith).map(lambda x: (None, x)),
+    arith.map(lambda x: (x, x)),
+).mark().combine(
+    lambda start, x, end: Bound(
+        low=x[0],
+        high=x[1],
+        location=SourceSpan(start, end),
+    ),
+)
+bounded_food = seq(bound, ident, ident).mark().combine(
+    lambda start, x, end: BoundedFood(
+        bound=x[0],
+        unit=x[1],
+        food=x[2],
+        location=SourceSpan(start, end),
+    ),
+)
+bounded_expr = bounded_food.sep_by(operator('+'), min=1)
+bounded_list = alt(
+    operator(':') >> (operator('-') >> bounded_expr).at_least(1).map(
+        lambda xss: [x for xs in xss for x in xs]
+    ),
+    bounded_expr,
+)
+
+per = (keyword('per') >> alt(
+    keyword('kcal').result(True),
+    (keyword('100') >> keyword('g')).result(False),
+)).optional(default=False)
+comparison = alt(*(operator(op) for op in ('<=', '>=', '<', '>')))
+condition = seq(ident, comparison, arith, ident, per).mark().combine(
+    lambda start, x, end: Condition(*x, location=SourceSpan(start, end)),
+)
+conditions = keyword('where') >> condition.sep_by(keyword('and'), min=1)
+limit = (keyword('limit') >> arith).optional()
+
+tag_list = ident.sep_by(operator(','), min=1)
+tag_policy = seq(
+    (keyword('only') >> tag_list).optional(),
+    (keyword('exclude') >> tag_list).optional(default=[]),
+    (keyword('stop') >> tag_list).optional(default=[]),
+).mark().combine(
+    lambda start, x, end: TagPolicy(*x, location=SourceSpan(start, end)),
+)
+
 ### STATEMENTS ################################################################
 
 @generate
@@ -161,12 +323,60 @@ def definition_stmt():
         return FoodStmt(lhs, weight, rhs)
 
 stmt_ = alt(
-    (operator('print') | operator('facts') >> expr).mark().combine(
-        lambda start, e, end: PrintStmt(e, location=SourceSpan(start, end))
+    ((operator('print') | operator('facts')) >> seq(tag_policy, expr))
+    .mark().combine(
+        lambda start, x, end: PrintStmt(
+            x[1], x[0], location=SourceSpan(start, end),
+        )
     ),
-    (operator('shop') >> expr).mark().combine(
-        lambda start, e, end: ShopStmt(e, location=SourceSpan(start, end))
+    (operator('shop') >> seq(
+        tag_policy,
+        expr,
+        keyword('net').result(True).optional(default=False),
+    )).mark().combine(
+        lambda start, x, end: ShopStmt(
+            x[1], x[0], x[2], location=SourceSpan(start, end),
+        )
     ),
+    (keyword('stock') >> expr.optional()).map(StockStmt),
+    (keyword('consume') >> expr).map(lambda body: StockStmt(body, True)),
+    seq(
+        keyword('solve') >> bounded_list,
+        keyword('for') >> bounded_list,
+    ).combine(SolveStmt),
+    seq(
+        keyword('sweep') >> arith,
+        keyword('to') >> arith,
+        keyword('step') >> arith,
+        ident,
+        ident,
+        (keyword('for') >> ident).optional(),
+        (keyword('in') >> quantified_food).optional(),
+    ).combine(SweepStmt),
+    seq(
+        keyword('breakdown') >> expr,
+        (keyword('by') >> alt(
+            keyword('constituent').result(False),
+            keyword('ingredient').result(True),
+        )).optional(default=False),
+        (keyword('top') >> arith).optional(),
+    ).combine(BreakdownStmt),
+    seq(
+        keyword('rank') >> keyword('foods') >> keyword('by') >> ident,
+        per,
+        conditions.optional(default=[]),
+        limit,
+    ).combine(RankStmt),
+    seq(
+        keyword('find') >> keyword('foods') >> conditions,
+        limit,
+    ).combine(FindStmt),
+    seq(
+        keyword('nutrient') >> ident,
+        keyword('in') >> ident,
+        (keyword('energy') >> arith).optional(default=0.0),
+    ).combine(NutrientStmt),
+    keyword('stats').map(lambda _: StatsStmt()),
     definition_stmt,
 )
 
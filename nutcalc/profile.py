@@ -0,0 +1,110 @@
+"""Profiling instrumentation for parsing, module loading and statement
+execution. Enabled by setting `config.PROFILE`; when disabled, spans cost
+next to nothing."""
+
+from . import config
+
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import os
+import sys
+import time
+
+@dataclass
+class Record:
+    """One timed span of work."""
+    kind: str # 'parse', 'load' or 'execute'
+    name: str
+    location: object # SourceSpan | None
+    start: float # seconds, from time.perf_counter
+    duration: float # seconds
+    allocations: int # net change in the number of allocated memory blocks
+
+    @property
+    def where(self):
+        if self.location is None:
+            return ''
+        return self.location.as_prefix()
+
+RECORDS: list[Record] = []
+
+@contextmanager
+def span(kind: str, name: str, location=None):
+    """Records the wall time and net allocations of the enclosed work."""
+    if not config.PROFILE:
+        yield
+        return
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        RECORDS.append(Record(
+            kind=kind,
+            name=name,
+            location=location,
+            start=start,
+            duration=end - start,
+            allocations=sys.getallocatedblocks() - blocks,
+        ))
+
+def reset():
+    RECORDS.clear()
+
+def summary(records=None, limit=25):
+    """Renders a table of the most expensive spans, aggregated by kind, name
+    and location, sorted by total time."""
+    if records is None:
+        records = RECORDS
+    groups = defaultdict(lambda: [0, 0.0, 0])
+    for r in records:
+        g = groups[(r.kind, r.name, r.where)]
+        g[0] += 1
+        g[1] += r.duration
+        g[2] += r.allocations
+    rows = sorted(groups.items(), key=lambda kv: kv[1][1], reverse=True)
+    lines = [
+        f'{"total ms":>10} {"calls":>7} {"allocs":>9}  {"kind":<8} location'
+    ]
+    for (kind, name, where), (calls, total, allocs) in rows[:limit]:
+        lines.append(
+            f'{total*1000:10.2f} {calls:7d} {allocs:9d}  {kind:<8} ' +
+            f'{where} {name}'.strip()
+        )
+    if len(rows) > limit:
+        lines.append(f'... {len(rows) - limit} more')
+    return '\n'.join(lines)
+
+def chrome_trace(records=None):
+    """Converts records to the Chrome trace event format, as loaded by
+    chrome://tracing or Perfetto."""
+    if records is None:
+        records = RECORDS
+    pid = os.getpid()
+    origin = min((r.start for r in records), default=0.0)
+    return {
+        'traceEvents': [
+            {
+                'name': f'{r.where} {r.name}'.strip(),
+                'cat': r.kind,
+                'ph': 'X',
+                'ts': (r.start - origin) * 1e6,
+                'dur': r.duration * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': {
+                    'location': r.where,
+                    'allocations': r.allocations,
+                },
+            }
+            for r in records
+        ],
+        'displayTimeUnit': 'ms',
+    }
+
+def write_chrome_trace(path, records=None):
+    import json
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(records), f)
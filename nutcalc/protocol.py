@@ -0,0 +1,352 @@
+"""The nutcalc worker protocol, independent of any transport.
+
+An Engine receives request messages (dicts) through `dispatch` and sends
+messages back through the `send` callable it was constructed with. The browser
+shim, the `--serve` daemon and test harnesses all drive the same engine.
+
+Message types
+=============
+
+Either side sends this message to answer a request of the other side:
+- { type: 'response', of: string, data: any }
+    - `of` holds the ID of the request
+
+Host -> engine; every request carries an `id` that its response refers to:
+- { type: 'load-module', id, name: string, contents: string }
+    -> loads the module with the given contents as the root of a DAG of
+       modules, requesting any missing imports from the host
+- { type: 'eval', id, contents: string }
+    -> executes a single statement of nutcalc code
+- { type: 'reset', id }
+    -> discards all definitions, starting over with a fresh interpreter
+
+An 'eval' or 'load-module' request may carry a budget limiting its work:
+- budget: { seconds?: number, visits?: number, memory?: number }
+    - wall time, visits of the nodes of food trees and bytes allocated; a
+      request over budget fails with an error, and its statements executed
+      so far stay executed. Without a budget, the engine's default applies.
+
+The data of a response to a request is a dict with key `success`; successful
+responses hold the output of the request under `data`, while failed ones hold
+a message under `error` and, when known, the error's `location`. An 'eval'
+of a statement with a structured result, such as a breakdown, also holds that
+result under `result`; see `Interpreter.execute`.
+
+Engine -> host:
+- { type: 'load-modules', id, names: string[] }
+    - request the code of all the modules with the given `names` at once.
+      The response's data is a dict with key `success` and, under `data`, a
+      dict mapping each name to its code; names that can't be found are left
+      out.
+
+Several requests may be in flight at once: while a module load waits for the
+host to provide imports, other requests are served. Each response carries only
+the output of its own request.
+"""
+
+from . import interpret, limits, parser
+from .error import NutcalcError
+
+from dataclasses import dataclass
+from io import StringIO
+import hashlib
+import json
+import os.path as ospath
+import sys
+
+# Parsed modules, keyed by module name and a hash of the module's contents.
+# This cache is global so that it survives resets: reloading an unchanged
+# module into a fresh interpreter doesn't reparse it.
+PARSE_CACHE = {}
+
+def parse_cached(name, contents):
+    key = (name, hashlib.sha256(contents.encode('utf-8')).hexdigest())
+    module = PARSE_CACHE.get(key)
+    if module is None:
+        module = parser.parse_module(StringIO(contents), source=name)
+        PARSE_CACHE[key] = module
+    return module
+
+def module_path(name):
+    """The path under which the interpreter knows a module by this name."""
+    return name + '.nut'
+
+@dataclass
+class ModuleLoopError(NutcalcError):
+    location: str
+    module_name: str
+    loading_set: set[str]
+
+    def __str__(self):
+        return f'{self.location}: loading {self.module_name} causes an import ' \
+            f'loop among already loaded modules {str(self.loading_set)}'
+
+class MissingModuleError(NutcalcError):
+    def __str__(self):
+        return f'no such module: {self.args[0]}'
+
+class ProtocolError(NutcalcError):
+    pass
+
+def error_data(e: Exception):
+    """The data of a failed response, for an exception. Exceptions other
+    than NutcalcErrors are bugs; their type is shown for reporting them."""
+    data = {
+        'success': False,
+        'error': str(e) if isinstance(e, NutcalcError) else
+            f'{type(e).__name__}: {e}',
+    }
+    location = getattr(e, 'location', None)
+    if location is not None and hasattr(location, 'start'):
+        data['location'] = {
+            'filename': location.filename,
+            'start': list(location.start),
+            'end': list(location.end),
+        }
+    return data
+
+class Engine:
+    def __init__(self, send, resolve_modules=None, base=None, budget=None):
+        """`send` is called with every message for the host. If given,
+        `resolve_modules` is called with a list of module names instead of
+        sending the host a 'load-modules' request, and must return a dict
+        mapping the names it found to their code.
+
+        If given, `base` is an interpreter whose definitions and modules the
+        engine starts from, and returns to on reset. Its definitions are
+        shared rather than copied, so many engines can use the same base.
+
+        If given, `budget` is the default budget of requests."""
+        self.send = send
+        self.resolve_modules = resolve_modules
+        self.base = base
+        self.budget = budget
+        self.continuations = {}
+        self.in_flight = set()
+        self.reset()
+
+    def reset(self):
+        if self.base is None:
+            self.interpreter = interpret.Interpreter(output_stream=StringIO())
+        else:
+            self.interpreter = self.base.session(output_stream=StringIO())
+
+    def dispatch(self, request):
+        try:
+            request = dict(request)
+        except (TypeError, ValueError):
+            raise ProtocolError('a request must be an object')
+        match request:
+            case { 'type': 'response', 'of': of, 'data': data }:
+                continuation = self.continuations.pop(of, None)
+                if continuation is None:
+                    raise ProtocolError(f'no request {of} awaits a response')
+                continuation(data)
+
+            case { 'id': id } if id in self.in_flight:
+                self.respond(request, error_data(
+                    ProtocolError(f'request {id} is already in flight'),
+                ), done=False)
+
+            case { 'type': 'eval', 'id': id, 'contents': line }:
+                self.in_flight.add(id)
+                self._run(request, lambda: self._eval(line))
+
+            case { 'type': 'load-module', 'id': id, 'name': name,
+                   'contents': contents }:
+                self.in_flight.add(id)
+                self._load_root_module(request, name, contents)
+
+            case { 'type': 'reset', 'id': id }:
+                self.in_flight.add(id)
+                self._run(request, self.reset)
+
+            case _:
+                self.send({
+                    'type': 'response',
+                    'of': request.get('id'),
+                    'data': error_data(ProtocolError(
+                        f'unhandled request type {request.get("type")}',
+                    )),
+                })
+
+    def respond(self, request, data, done=True):
+        if done:
+            self.in_flight.discard(request['id'])
+        self.send({
+            'type': 'response',
+            'of': request['id'],
+            'data': data,
+        })
+
+    def _budget(self, request) -> limits.Budget | None:
+        if request.get('budget') is None:
+            return self.budget
+        try:
+            return limits.Budget.from_dict(request['budget'])
+        except (TypeError, ValueError) as e:
+            raise ProtocolError(f'malformed budget: {e}')
+
+    def _run(self, request, f):
+        """Runs `f` on behalf of `request`, within its budget, and responds
+        with its output and the result `f` returns, if any."""
+        output = StringIO()
+        self.interpreter.output_stream = output
+        try:
+            with limits.metered(self._budget(request)):
+                result = f()
+        except Exception as e:
+            # Whatever goes wrong fails the request, not the engine.
+            data = error_data(e)
+        else:
+            data = {'success': True, 'data': output.getvalue()}
+            if result is not None:
+                data['result'] = result
+        finally:
+            self.in_flight.discard(request['id'])
+        self.respond(request, data)
+
+    def _eval(self, line):
+        stmt = parser.parse_stmt(line)
+        return self.interpreter.execute(stmt)
+
+    def _load_root_module(self, originator, name, contents):
+        """Loads a module identified as a 'root module', i.e. the root of a DAG of
+        modules to ultimately be loaded.
+
+        Each round asks for every missing module discovered so far in a single
+        'load-modules' request. Modules are parsed as they arrive, which
+        discovers the next round of imports, so a DAG is fetched in as many
+        round trips as it has levels. Once nothing is missing, the modules are
+        loaded into the interpreter in dependency order."""
+
+        # Parsed modules of this DAG that are not loaded yet, by name.
+        parsed = {}
+        # Names requested from the host so far.
+        requested = set()
+        rounds = 0
+
+        def missing_imports():
+            return sorted({
+                imp.path
+                for module in parsed.values()
+                for imp in module.imports
+                if imp.path not in parsed
+                and module_path(imp.path) not in self.interpreter.modules
+            })
+
+        def receive(modules):
+            try:
+                for module_name, module_contents in modules.items():
+                    parsed[module_name] = parse_cached(module_name, module_contents)
+                missing = missing_imports()
+                not_found = [m for m in missing if m in requested]
+                if not_found:
+                    raise MissingModuleError(', '.join(not_found))
+            except Exception as e:
+                self.respond(originator, error_data(e))
+                return
+            if missing:
+                request_modules(missing)
+            else:
+                self._run(originator, lambda: self._load_parsed(name, parsed))
+
+        def request_modules(names):
+            nonlocal rounds
+            rounds += 1
+            requested.update(names)
+            if self.resolve_modules is not None:
+                receive(dict(self.resolve_modules(names)))
+                return
+            request_id = f'{originator["id"]}/load-modules/{rounds}'
+            # Register a continuation so when the host gets back to us we
+            # parse those modules and keep going
+            self.continuations[request_id] = on_modules
+            self.send({
+                'type': 'load-modules',
+                'id': request_id,
+                'names': names,
+            })
+
+        def on_modules(data):
+            try:
+                data = dict(data)
+                if data.get('success'):
+                    modules = dict(data['data'])
+            except (TypeError, ValueError, KeyError):
+                self.respond(originator, error_data(
+                    ProtocolError('malformed load-modules response'),
+                ))
+                return
+            if not data.get('success'):
+                self.respond(originator, {
+                    'success': False,
+                    'error': data.get('error', 'could not load modules'),
+                })
+            else:
+                receive(modules)
+
+        receive({name: contents})
+
+    def _load_parsed(self, root, parsed):
+        """Loads the parsed module `root` and, first, its imports."""
+        # Modules that are currently being loaded
+        # This is a 'visited set', used to detect import loops.
+        loading = set()
+
+        def load(name, importer):
+            if module_path(name) in self.interpreter.modules: return
+            if name in loading:
+                raise ModuleLoopError(importer, name, set(loading))
+            loading.add(name)
+            module = parsed[name]
+            for imp in module.imports:
+                load(imp.path, name)
+            self.interpreter.load_module(module_path(name), module)
+            loading.remove(name)
+
+        load(root, root)
+
+def filesystem_resolver(root):
+    """A module resolver reading `<name>.nut` files under `root`."""
+    def resolve(names):
+        found = {}
+        for name in names:
+            try:
+                with open(ospath.join(root, module_path(name))) as f:
+                    found[name] = f.read()
+            except FileNotFoundError:
+                pass
+        return found
+    return resolve
+
+def serve(infile=sys.stdin, outfile=sys.stdout, root='.', base=None):
+    """Serves the protocol over JSON Lines: one request per input line, one
+    message per output line. Imports are resolved from files under `root`.
+    The engine starts from the interpreter `base`, if given."""
+    def send(message):
+        outfile.write(json.dumps(message) + '\n')
+        outfile.flush()
+
+    engine = Engine(send, resolve_modules=filesystem_resolver(root), base=base)
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({
+                'type': 'response',
+                'of': None,
+                'data': {'success': False, 'error': f'malformed request: {e}'},
+            })
+            continue
+        try:
+            engine.dispatch(request)
+        except Exception as e:
+            # A bad request fails alone; the daemon serves the next one.
+            send({
+                'type': 'response',
+                'of': request.get('id') if isinstance(request, dict) else None,
+                'data': error_data(e),
+            })
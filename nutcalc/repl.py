@@ -1,4 +1,4 @@
-from . import parser, interpret
+from . import complete, parser, interpret
 
 import readline
 import sys
@@ -18,11 +18,36 @@ def load_history():
 def save_history():
     readline.write_history_file(HISTORY_FILE_PATH)
 
+def setup_completion(interpreter: interpret.Interpreter):
+    completer = complete.Completer(interpreter.foodDB)
+    readline.set_completer(completer.complete)
+    # Food names may contain quotes and other punctuation, so only split
+    # words on whitespace; the completer itself handles quoted names.
+    readline.set_completer_delims(' \t\n')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+
+def handle(interpreter: interpret.Interpreter, user_input: str):
+    """Parses and executes one line of REPL input, reporting any error."""
+    try:
+        stmt = parser.stmt.parse(user_input)
+    except ParseError as e:
+        print('error:', e)
+        return
+
+    try:
+        interpreter.execute(stmt)
+    except interpret.InterpretationError as e:
+        print('error:', e)
+
 def start(interpreter: interpret.Interpreter | None = None):
     if interpreter is None:
         interpreter = interpret.Interpreter()
 
     load_history()
+    setup_completion(interpreter)
     try:
         while True:
             user_input = input("nutcalc> ")
@@ -33,16 +58,7 @@ def start(interpreter: interpret.Interpreter | None = None):
                 import pdb;pdb.set_trace()
                 continue
 
-            try:
-                stmt = parser.stmt.parse(user_input)
-            except ParseError as e:
-                print('error:', e)
-                continue
-
-            try:
-                interpreter.execute(stmt)
-            except interpret.InterpretationError as e:
-                print('error:', e)
+            handle(interpreter, user_input)
 
     except (EOFError, KeyboardInterrupt):
         pass
@@ -0,0 +1,169 @@
+"""Rolling-window trend reports over journal foods.
+
+A journal day is any compound food whose name is an ISO date, e.g.
+`1 x '2025-01-18': ...`. Days are streamed in date order and every window
+slides by adding the newest day's nutrient vector and subtracting the vectors
+of days that fell out of it, so the whole report is computed in one pass."""
+
+from . import model
+from .interpret import nutrition_facts
+
+from collections import deque
+from datetime import date
+import csv
+import json
+
+DEFAULT_WINDOWS = (7, 30, 90)
+
+def report_columns(schema: model.NutrientSchema):
+    """The names of the columns of a day's nutrient vector: energy, then the
+    nutrients of `schema`."""
+    return ['energy'] + [nut.name for nut in schema]
+
+def day_quantity(food: model.CompoundFood) -> model.Quantity:
+    """The quantity of a journal food representing the whole day: one of the
+    units it was defined with, e.g. `1 x`, or its reference quantity if it was
+    defined directly in terms of weight."""
+    unit = next(
+        (u for u in food.units if not model.Unit.is_weight(u.name)),
+        None,
+    )
+    if unit is None:
+        return food.reference_quantity
+    return model.Quantity(count=1, unit=unit.name)
+
+def journal_days(foodDB):
+    """Generates (date, food) for every journal food, in date order."""
+    days = []
+    for name, food in foodDB.items():
+        if not isinstance(food, model.CompoundFood):
+            continue
+        try:
+            day = date.fromisoformat(name)
+        except ValueError:
+            continue
+        days.append((day, name))
+    days.sort()
+    for day, name in days:
+        yield day, foodDB.get(name)
+
+def day_vector(food: model.CompoundFood, columns: list[str], known=None,
+               values=None) -> list[float]:
+    """Computes the nutrient vector of a whole journal day. See
+    `interpret.nutrition_facts` for `known` and `values`; sharing `values`
+    between days evaluates the recipes they have in common once."""
+    facts = nutrition_facts(
+        model.QuantifiedFood(
+            quantity=day_quantity(food),
+            tags=set(),
+            food=food,
+        ),
+        known,
+        values,
+    )
+    return [
+        facts.energy if name == 'energy' else
+        facts.data[name].count if name in facts.data else
+        0.0
+        for name in columns
+    ]
+
+class _Window:
+    """The running state of one sliding window: a sum vector, plus one
+    monotonic deque per column for each of the min and the max."""
+    def __init__(self, days: int, width: int):
+        self.days = days
+        self.members = deque()
+        self.total = [0.0] * width
+        self.mins = [deque() for _ in range(width)]
+        self.maxs = [deque() for _ in range(width)]
+
+    def push(self, ordinal: int, vector: list[float]):
+        self.members.append((ordinal, vector))
+        for i, x in enumerate(vector):
+            self.total[i] += x
+            lo = self.mins[i]
+            while lo and lo[-1][1] >= x:
+                lo.pop()
+            lo.append((ordinal, x))
+            hi = self.maxs[i]
+            while hi and hi[-1][1] <= x:
+                hi.pop()
+            hi.append((ordinal, x))
+
+        cutoff = ordinal - self.days
+        while self.members[0][0] <= cutoff:
+            _, old = self.members.popleft()
+            for i, x in enumerate(old):
+                self.total[i] -= x
+        for dq in self.mins + self.maxs:
+            while dq[0][0] <= cutoff:
+                dq.popleft()
+
+    def row(self):
+        n = len(self.members)
+        return {
+            'mean': [x / n for x in self.total],
+            'min': [dq[0][1] for dq in self.mins],
+            'max': [dq[0][1] for dq in self.maxs],
+            'days': n,
+        }
+
+def rolling_report(foodDB, windows=DEFAULT_WINDOWS, columns=None):
+    """Generates one report row per journal day and window.
+
+    Windows span calendar days, so a 7-day window ending on a given day covers
+    that day and the six before it; days missing from the journal are not
+    counted towards the mean. Each row is a dict with keys `date`, `window`,
+    `days` (the number of journal days in the window) and `mean`, `min`, `max`
+    (vectors laid out according to `columns`)."""
+    if columns is None:
+        columns = report_columns(foodDB.schema)
+    state = [_Window(n, len(columns)) for n in windows]
+    values = {} # shared between days, so that each food is evaluated once
+    for day, food in journal_days(foodDB):
+        vector = day_vector(food, columns, foodDB.known_facts, values)
+        for window in state:
+            window.push(day.toordinal(), vector)
+            yield {'date': day, 'window': window.days, **window.row()}
+
+def write_csv(rows, columns, f):
+    """Writes report rows as CSV with one line per day and window."""
+    writer = csv.writer(f)
+    writer.writerow(
+        ['date', 'window', 'days'] +
+        [f'{name}_{stat}' for name in columns for stat in ('mean', 'min', 'max')]
+    )
+    for row in rows:
+        writer.writerow(
+            [row['date'].isoformat(), row['window'], row['days']] +
+            [
+                f'{row[stat][i]:.2f}'
+                for i in range(len(columns))
+                for stat in ('mean', 'min', 'max')
+            ]
+        )
+
+def write_json(rows, columns, f):
+    """Writes report rows as a JSON array, streaming one row at a time."""
+    f.write('[')
+    for i, row in enumerate(rows):
+        f.write(',\n' if i else '\n')
+        json.dump({
+            'date': row['date'].isoformat(),
+            'window': row['window'],
+            'days': row['days'],
+            'nutrients': {
+                name: {
+                    stat: round(row[stat][j], 2)
+                    for stat in ('mean', 'min', 'max')
+                }
+                for j, name in enumerate(columns)
+            },
+        }, f)
+    f.write('\n]\n')
+
+WRITERS = {
+    'csv': write_csv,
+    'json': write_json,
+}
@@ -0,0 +1,226 @@
+"""Searching and ranking every food of a FoodDB by its nutrients.
+
+The nutrition facts of 100 g of every compound food are evaluated once, into
+a vector per food. For every nutrient, and for energy, the index keeps the
+foods sorted by their amount of it per 100 g and, separately, per kcal. A
+threshold such as `sodium < 100 mg` is then a bisection of one column, and
+the top k foods by a column are the last k entries of the column. The index
+follows the FoodDB as foods are registered, and grows a column for every
+nutrient declared since it was built, without evaluating any food again.
+Both happen as foods and nutrients are registered, while the statement
+registering them executes alone; queries only read the index."""
+
+from . import interpret, limits, model
+
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+import heapq
+
+def columns(schema: model.NutrientSchema):
+    """The nutrients of the columns of the index: energy, in kcal, then every
+    nutrient of the schema in its natural unit."""
+    return [interpret.ENERGY] + list(schema)
+
+@dataclass(frozen=True)
+class Column:
+    """A nutrient, or energy, per 100 g of a food or, with `per_kcal`, per
+    kcal of the food."""
+    nutrient: model.FoodName
+    natural_unit: model.UnitName # of the nutrient, or kcal for energy
+    per_kcal: bool = False
+
+    @staticmethod
+    def of(nutrient: model.Nutrient, per_kcal=False) -> 'Column':
+        return Column(nutrient.name, nutrient.natural_unit, per_kcal)
+
+    def value(self, facts: model.NutritionFacts) -> float | None:
+        """This column's value for a food of the given facts per 100 g. Per
+        kcal, foods without energy have no value."""
+        if self.nutrient == 'energy':
+            amount = facts.energy
+        else:
+            qty = facts.data.get(self.nutrient)
+            amount = 0.0 if qty is None else qty.count
+        if not self.per_kcal:
+            return amount
+        energy = facts.energy
+        return amount / energy if energy > 0 else None
+
+    @property
+    def unit(self) -> str:
+        unit = self.natural_unit
+        return f'{unit}/kcal' if self.per_kcal else f'{unit}/100 g'
+
+@dataclass(frozen=True)
+class Condition:
+    """Compares a column against a value in the column's unit."""
+    column: Column
+    op: str # one of <, <=, >, >=
+    value: float
+
+    def holds(self, x: float | None) -> bool:
+        if x is None:
+            return False
+        match self.op:
+            case '<': return x < self.value
+            case '<=': return x <= self.value
+            case '>': return x > self.value
+            case '>=': return x >= self.value
+        assert False, f'operator {self.op} is handled'
+
+def _key(entry):
+    return entry[0]
+
+class NutrientIndex:
+    def __init__(self, foodDB):
+        self.foodDB = foodDB
+        # name -> (food, nutrition facts of 100 g of it)
+        self.vectors = {}
+        # Column -> list of (value, food name), sorted
+        self.columns = {
+            Column.of(nutrient, per_kcal): []
+            for nutrient in columns(foodDB.schema)
+            for per_kcal in (False, True)
+        }
+        self.schema_version = foodDB.schema.version
+        values = {} # shared between foods, so that each is evaluated once
+        for _, food in foodDB.items():
+            self._add(food, values, sort=False)
+        for entries in self.columns.values():
+            entries.sort()
+        foodDB.watch(self.add)
+
+    def add(self, food: model.Food):
+        """Indexes a newly registered food, or one that gained a unit."""
+        self.catch_up()
+        self._add(food, {}, sort=True)
+
+    def catch_up(self):
+        """Adds the columns of the nutrients declared since the index was
+        laid out. They are filled in from the vectors of the foods."""
+        schema = self.foodDB.schema
+        if self.schema_version == schema.version:
+            return
+        for nutrient in columns(schema):
+            for per_kcal in (False, True):
+                column = Column.of(nutrient, per_kcal)
+                if column in self.columns:
+                    continue
+                limits.charge(len(self.vectors))
+                entries = []
+                for food_name, (_, facts) in self.vectors.items():
+                    x = column.value(facts)
+                    if x is not None:
+                        entries.append((x, food_name))
+                entries.sort()
+                self.columns[column] = entries
+        self.schema_version = schema.version
+
+    def _add(self, food, values, sort):
+        if not isinstance(food, model.CompoundFood):
+            return # a nutrient isn't something to eat
+        old = self.vectors.get(food.name)
+        if old is not None:
+            # A food gaining a unit, or copied into a layer to gain one,
+            # keeps its constituents and so its nutrition facts.
+            if old[0].constituents is food.constituents:
+                self.vectors[food.name] = (food, old[1])
+                return
+            self._remove(food.name, old[1])
+        facts = interpret.food_facts(food, known=self._known, values=values)
+        self.vectors[food.name] = (food, facts)
+        limits.charge(len(self.columns))
+        for column, entries in self.columns.items():
+            x = column.value(facts)
+            if x is None:
+                continue
+            if sort:
+                insort(entries, (x, food.name))
+            else:
+                entries.append((x, food.name))
+
+    def _remove(self, name, facts):
+        for column, entries in self.columns.items():
+            x = column.value(facts)
+            if x is not None:
+                del entries[bisect_left(entries, (x, name))]
+
+    def _known(self, food):
+        entry = self.vectors.get(food.name)
+        if entry is not None and entry[0] is food:
+            return entry[1]
+        if self.foodDB.known_facts is not None:
+            return self.foodDB.known_facts(food)
+        return None
+
+    def _live(self, name) -> bool:
+        """Whether the food is still defined; definitions can be taken back,
+        e.g. by the language server."""
+        entry = self.vectors.get(name)
+        return entry is not None and self.foodDB.has(name) and \
+            self.foodDB.get(name).constituents is entry[0].constituents
+
+    def value(self, name: model.FoodName, column: Column) -> float | None:
+        return column.value(self.vectors[name][1])
+
+    def _range(self, condition: Condition):
+        """The slice of the condition's column holding the foods meeting
+        it."""
+        entries = self.columns[condition.column]
+        x = condition.value
+        match condition.op:
+            case '<':
+                return entries, 0, bisect_left(entries, x, key=_key)
+            case '<=':
+                return entries, 0, bisect_right(entries, x, key=_key)
+            case '>':
+                return entries, bisect_right(entries, x, key=_key), len(entries)
+            case '>=':
+                return entries, bisect_left(entries, x, key=_key), len(entries)
+
+    def matching(self, conditions: list[Condition]):
+        """Generates the names of the foods meeting every condition. Only the
+        foods meeting the most selective condition are looked at."""
+        ranges = sorted(
+            (self._range(c) + (c,) for c in conditions),
+            key=lambda r: r[2] - r[1],
+        )
+        (entries, start, stop, _), rest = ranges[0], ranges[1:]
+        for i in range(start, stop):
+            name = entries[i][1]
+            facts = self.vectors[name][1]
+            if all(c.holds(c.column.value(facts)) for *_, c in rest) and \
+                    self._live(name):
+                yield name
+
+    def rank(self, column: Column, limit: int, conditions=()):
+        """The `limit` foods with the most of `column` among those meeting
+        the conditions, as (name, value) pairs, largest first."""
+        if not conditions:
+            # The column is sorted already: read it from the end.
+            result = []
+            entries = self.columns[column]
+            for x, name in reversed(entries):
+                if len(result) >= limit:
+                    break
+                if self._live(name):
+                    result.append((name, x))
+            return result
+        scored = (
+            (self.value(name, column), name)
+            for name in self.matching(conditions)
+        )
+        return [
+            (name, x) for x, name in heapq.nlargest(
+                limit,
+                ((x, name) for x, name in scored if x is not None),
+            )
+        ]
+
+    def find(self, conditions: list[Condition], limit: int | None = None):
+        """The names of the foods meeting every condition, in alphabetical
+        order; with `limit`, only the first `limit` of them."""
+        names = self.matching(conditions)
+        if limit is None:
+            return sorted(names)
+        return heapq.nsmallest(limit, names)
@@ -0,0 +1,131 @@
+"""A small bounded least-squares solver used by the `solve` statement.
+
+Given the nutrient vectors of some candidate foods (one column per food, one
+row per target), find portion multipliers within the portion bounds such that
+the resulting totals fall within the targets' intervals. Whenever the targets
+cannot all be met, the solution minimizes the sum of squared relative
+distances of the totals to their intervals instead.
+
+The objective is convex and piecewise quadratic, so we use cyclic coordinate
+descent: along a single coordinate, the objective's derivative is piecewise
+linear and can be minimized exactly by sweeping over its breakpoints."""
+
+from . import limits
+
+import math
+
+INF = math.inf
+
+def _distance(x, low, high):
+    if x < low:
+        return low - x
+    if x > high:
+        return x - high
+    return 0.0
+
+def violation(totals, lows, highs, weights):
+    """The weighted sum of squared distances of the totals to the targets."""
+    return sum(
+        w * _distance(x, lo, hi)**2
+        for x, lo, hi, w in zip(totals, lows, highs, weights)
+    )
+
+def _line_minimum(column, totals, lows, highs, weights):
+    """Finds the step t minimizing the objective when moving the totals by
+    t * column. Among all minimizers, returns the one closest to zero."""
+    # Each row with a nonzero coefficient contributes a term that is zero on
+    # [t_lo, t_hi] and grows quadratically outside. The derivative is then
+    # d(t) = S*t - C on each segment between breakpoints.
+    events = []
+    slope = 0.0
+    intercept = 0.0
+    for a, x, lo, hi, w in zip(column, totals, lows, highs, weights):
+        if a == 0:
+            continue
+        t_lo, t_hi = (lo - x) / a, (hi - x) / a
+        if a < 0:
+            t_lo, t_hi = t_hi, t_lo
+        c = 2 * w * a * a
+        if t_lo > -INF:
+            # active at t = -inf; deactivates at t_lo
+            slope += c
+            intercept += c * t_lo
+            events.append((t_lo, -c, -c * t_lo))
+        if t_hi < INF:
+            events.append((t_hi, c, c * t_hi))
+    if not events:
+        return 0.0
+    events.sort()
+
+    zero_low, zero_high = INF, -INF
+    left = -INF
+    for i in range(len(events) + 1):
+        right = events[i][0] if i < len(events) else INF
+        if right > left:
+            if slope <= 0:
+                # flat and zero: every point of the segment is a minimizer
+                zero_low = min(zero_low, left)
+                zero_high = max(zero_high, right)
+            else:
+                at_left = slope * left - intercept if left > -INF else -INF
+                at_right = slope * right - intercept if right < INF else INF
+                if at_left <= 0 <= at_right:
+                    root = min(max(intercept / slope, left), right)
+                    zero_low = min(zero_low, root)
+                    zero_high = max(zero_high, root)
+        if i < len(events):
+            _, ds, dc = events[i]
+            slope += ds
+            intercept += dc
+            left = right
+    if zero_low > zero_high:
+        return 0.0 # numerical trouble; don't move
+    return min(max(0.0, zero_low), zero_high)
+
+def solve(columns, lows, highs, lower_bounds, upper_bounds,
+          max_sweeps=500, tolerance=1e-12):
+    """Finds multipliers x such that, for each row i, the total
+    sum_j columns[j][i] * x[j] lies within [lows[i], highs[i]], subject to
+    lower_bounds[j] <= x[j] <= upper_bounds[j]. Missing bounds are given as
+    infinities. Returns the list of multipliers."""
+    weights = []
+    for lo, hi in zip(lows, highs):
+        scale = max(
+            (abs(b) for b in (lo, hi) if abs(b) < INF),
+            default=1.0,
+        )
+        weights.append(1 / max(scale, 1e-9)**2)
+
+    # Start at the center of each portion interval, or its finite end.
+    x = []
+    for lb, ub in zip(lower_bounds, upper_bounds):
+        if lb > -INF and ub < INF:
+            x.append((lb + ub) / 2)
+        elif lb > -INF:
+            x.append(lb)
+        elif ub < INF:
+            x.append(ub)
+        else:
+            x.append(0.0)
+    totals = [
+        sum(col[i] * xj for col, xj in zip(columns, x))
+        for i in range(len(lows))
+    ]
+
+    for _ in range(max_sweeps):
+        if violation(totals, lows, highs, weights) <= tolerance:
+            break
+        limits.charge(len(columns) * len(lows)) # coefficients looked at
+        moved = 0.0
+        for j, col in enumerate(columns):
+            t = _line_minimum(col, totals, lows, highs, weights)
+            t = min(max(t, lower_bounds[j] - x[j]), upper_bounds[j] - x[j])
+            if t == 0:
+                continue
+            x[j] += t
+            for i, a in enumerate(col):
+                totals[i] += a * t
+            moved = max(moved, abs(t) / max(abs(x[j]), 1.0))
+        if moved <= tolerance:
+            break
+    return x
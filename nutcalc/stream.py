@@ -0,0 +1,74 @@
+"""Streaming evaluation of statements as they arrive on a pipe."""
+
+from . import parser, syntax
+from .error import NutcalcError
+
+from io import StringIO
+import json
+import sys
+
+def run(interpreter, infile, outfile, load_module, source='<stdin>',
+        jsonl=False):
+    """Executes the statements read from `infile` one at a time, as soon as
+    each is complete, that is once the next one starts, flushing its output
+    to `outfile` before reading on.
+
+    With `jsonl`, each statement's outcome is written as one JSON object per
+    line instead: `{"line": N, "success": true, "data": OUTPUT}`, or
+    `{"line": N, "success": false, "error": MESSAGE}`. The outcome of a
+    statement with a structured result, such as a breakdown, also holds it
+    under `"result"`; see `Interpreter.execute`. Otherwise, errors are
+    reported on stderr. Either way, evaluation continues after an error.
+
+    `import` statements are handed to `load_module` with the imported
+    module's path. Returns the number of statements that failed."""
+    def parse(text, first_line):
+        if parser.IMPORT.match(text):
+            return parser.parse_import(text, source, first_line)
+        return parser.parse_stmt(text, source, first_line)
+
+    previous_stream = interpreter.output_stream
+    failures = 0
+    try:
+        for first_line, _, stmt in parser.merge_statements(
+            parser.split_statements(infile), parse,
+        ):
+            output = StringIO() if jsonl else outfile
+            interpreter.output_stream = output
+            try:
+                result = None
+                if isinstance(stmt, NutcalcError):
+                    raise stmt # it didn't parse
+                elif isinstance(stmt, syntax.ImportStmt):
+                    load_module(stmt.path + '.nut')
+                else:
+                    result = interpreter.execute(stmt)
+            except (NutcalcError, OSError) as e:
+                # e.g. an import of a missing file
+                failures += 1
+                if jsonl:
+                    _write_json(outfile, {
+                        'line': first_line + 1,
+                        'success': False,
+                        'error': str(e),
+                    })
+                else:
+                    outfile.flush()
+                    print('Error:', e, file=sys.stderr)
+            else:
+                if jsonl:
+                    outcome = {
+                        'line': first_line + 1,
+                        'success': True,
+                        'data': output.getvalue(),
+                    }
+                    if result is not None:
+                        outcome['result'] = result
+                    _write_json(outfile, outcome)
+            outfile.flush()
+    finally:
+        interpreter.output_stream = previous_stream
+    return failures
+
+def _write_json(f, obj):
+    f.write(json.dumps(obj) + '\n')
@@ -43,11 +43,33 @@ class Located:
                     if isinstance(elem, Located):
                         elem.filename = x
 
+    def shift(self, rows: int):
+        """Moves the locations of this node and its children down by a number
+        of rows, e.g. to account for the text it was parsed from having been
+        cut out of a larger file."""
+        if self.location is not None:
+            self.location = SourceSpan(
+                start=(self.location.start[0] + rows, self.location.start[1]),
+                end=(self.location.end[0] + rows, self.location.end[1]),
+                filename=self.location.filename,
+            )
+
+        for field in fields(self):
+            attr = getattr(self, field.name)
+            if isinstance(attr, Located):
+                attr.shift(rows)
+            elif isinstance(attr, list) and len(attr):
+                for elem in attr:
+                    if isinstance(elem, Located):
+                        elem.shift(rows)
+
 def located(cls):
     @dataclass
     class ClsWithLocation(cls, Located):
         location: SourceSpan | None = None
     ClsWithLocation.__name__ = cls.__name__ + 'WithLocation'
+    # The class replaces `cls` in its module; pickle finds it there.
+    ClsWithLocation.__qualname__ = cls.__qualname__
     return ClsWithLocation
 
 @located
@@ -64,22 +86,118 @@ class WeightStmt:
     lhs: QuantifiedFood
     rhs: QuantifiedFood
 
+@located
+@dataclass
+class TagPolicy:
+    """Restricts a traversal to the constituents tagged with one of `only`,
+    if given, prunes those tagged with one of `exclude`, and doesn't descend
+    into those tagged with one of `stop`."""
+    only: list[str] | None
+    exclude: list[str]
+    stop: list[str]
+
 @located
 @dataclass
 class PrintStmt:
     body: Expr
+    policy: TagPolicy | None = None
 
 @located
 @dataclass
 class ShopStmt:
     body: Expr
+    policy: TagPolicy | None = None
+    net: bool = False # whether to leave out what's in stock
+
+@located
+@dataclass
+class StockStmt:
+    """Adds the foods of `body` to the inventory or, with `consume`, takes
+    them from it; a food that isn't in stock as is is taken as what goes
+    into it, by its shopping list. Without a body, lists the inventory."""
+    body: Expr | None
+    consume: bool = False
+
+@located
+@dataclass
+class SolveStmt:
+    foods: list[BoundedFood]
+    targets: list[BoundedFood]
+
+@located
+@dataclass
+class SweepStmt:
+    """Evaluates nutrition facts over a grid of counts of `unit food`, either
+    alone or standing in for the constituent `replaces` (by default, `food`
+    itself) of `within`."""
+    start: float
+    stop: float
+    step: float
+    unit: str
+    food: str
+    replaces: str | None
+    within: QuantifiedFood | None
+
+@located
+@dataclass
+class BreakdownStmt:
+    """Attributes the nutrition facts of `body` to the direct constituents
+    of its foods or, with `ingredients`, to the ingredients at the bottom of
+    their trees, listing at most `top` contributors per nutrient."""
+    body: Expr
+    ingredients: bool
+    top: float | None
+
+@located
+@dataclass
+class Condition:
+    """A bound on the amount of a nutrient, or energy, in 100 g of a food
+    or, with `per_kcal`, per kcal of it."""
+    nutrient: str
+    op: str
+    count: float
+    unit: str
+    per_kcal: bool
+
+@located
+@dataclass
+class RankStmt:
+    """Lists the `limit` foods with the most of a nutrient per 100 g or per
+    kcal, among those meeting the conditions."""
+    nutrient: str
+    per_kcal: bool
+    conditions: list[Condition]
+    limit: float | None
+
+@located
+@dataclass
+class FindStmt:
+    """Lists the foods meeting every condition."""
+    conditions: list[Condition]
+    limit: float | None
+
+@located
+@dataclass
+class NutrientStmt:
+    """Declares a nutrient measured in `unit`, each unit of which provides
+    `energy` kcal."""
+    name: str
+    unit: str
+    energy: float
+
+@located
+@dataclass
+class StatsStmt:
+    """Reports what the interpreter holds on to."""
 
 @located
 @dataclass
 class ImportStmt:
     path: str
 
-Stmt = FoodStmt | WeightStmt | PrintStmt | ShopStmt
+Stmt = FoodStmt | WeightStmt | PrintStmt | ShopStmt | SolveStmt | SweepStmt \
+    | BreakdownStmt | RankStmt | FindStmt | NutrientStmt | StatsStmt \
+    | StockStmt
 
 @located
 @dataclass
@@ -94,6 +212,21 @@ class QuantifiedFood:
     tags: list[str]
     food: str
 
+@located
+@dataclass
+class Bound:
+    """An interval of counts; either end may be missing."""
+    low: float | None
+    high: float | None
+
+@located
+@dataclass
+class BoundedFood:
+    """Like a QuantifiedFood, but with an interval in place of a count."""
+    bound: Bound
+    unit: str
+    food: str
+
 @located
 @dataclass
 class Expr:
@@ -21,7 +21,7 @@ class USDA:
     foods: dict[id, Food]
 
     @staticmethod
-    def load(food_path, foot_nutrient_path, nutrient_path):
+    def load(food_path, food_nutrient_path, nutrient_path):
         with open(food_path) as food_file, \
             open(food_nutrient_path) as food_nutrient_file, \
             open(nutrient_path) as nutrient_file:
@@ -0,0 +1,80 @@
+"""An interpreter shared between threads: definitions and queries interleave,
+and every query must get the answer it would get alone, in its own output
+stream. A bounded version of `benchmarks.stress`."""
+
+from nutcalc import interpret, parser
+
+from io import StringIO
+import threading
+
+WRITERS = 3
+READERS = 4
+ITERATIONS = 200
+
+RECIPES = """\
+100 g flour = 70 g carbs + 10 g protein + 1 g fat
+100 g butter = 80 g fat + 1 g protein
+1 portion dough weighs 150 g:
+- buy 100 g flour
+- buy 50 g butter
+"""
+
+def query(interpreter, line):
+    out = StringIO()
+    interpreter.execute(parser.parse_stmt(line), output_stream=out)
+    return out.getvalue()
+
+def run_threads(*targets):
+    """Runs `n` threads calling `f(i)` for each pair (f, n) of `targets`,
+    and returns what went wrong in them."""
+    failures = []
+    def guarded(f, i):
+        def run():
+            try:
+                f(i)
+            except Exception as e:
+                failures.append(f'{f.__name__} {i}: {type(e).__name__}: {e}')
+        return run
+    threads = [
+        threading.Thread(target=guarded(f, i))
+        for f, n in targets
+        for i in range(n)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return failures
+
+def test_definitions_and_queries():
+    interpreter = interpret.Interpreter(output_stream=StringIO())
+    interpreter.load_module(
+        'recipes.nut', parser.parse_module(StringIO(RECIPES)),
+    )
+    portion = query(interpreter, 'print 1 portion dough')
+    shopping = query(interpreter, 'shop 1 portion dough')
+    defined = [] # (name, grams of fat) of the writers' foods so far
+
+    def writer(w):
+        for i in range(ITERATIONS):
+            name = f'writer {w} food {i}'
+            fat = w + i + 1
+            query(interpreter, f"1 x '{name}' = {fat} g fat")
+            unit = f'w{w}u{i}'
+            query(interpreter, f'1 {unit} dough = 1 portion')
+            # A unit equal to one portion gives the same facts.
+            assert query(interpreter, f'print 1 {unit} dough') == portion
+            defined.append((name, fat))
+
+    def reader(r):
+        for i in range(ITERATIONS):
+            assert query(interpreter, 'print 1 portion dough') == portion
+            assert query(interpreter, 'shop 1 portion dough') == shopping
+            if defined:
+                name, fat = defined[(r + i) % len(defined)]
+                assert query(interpreter, f"print 1 x '{name}'") == \
+                    f'energy: {9.0 * fat:.2f} kcal\nfat: {fat:.2f} g\n'
+
+    assert run_threads((writer, WRITERS), (reader, READERS)) == []
+    assert interpreter.output_stream.getvalue() == ''
+    assert len(defined) == WRITERS * ITERATIONS
@@ -0,0 +1,84 @@
+"""Statements cut out of a text one at a time, as by the stdin mode, the
+language server and checkpoints, must parse as the whole text does."""
+
+from nutcalc import parser
+from nutcalc.syntax import SourceSpan
+
+from dataclasses import fields, is_dataclass
+from io import StringIO
+import os.path as ospath
+import re
+
+import pytest
+
+README = ospath.join(ospath.dirname(__file__), '..', 'README.md')
+
+def readme_examples():
+    with open(README) as f:
+        return re.findall(r'```nutcalc\n(.*?)```', f.read(), re.DOTALL)
+
+def starts(node):
+    """A syntax tree as nested tuples, with locations reduced to where nodes
+    start: nodes end after the blanks and comments following them, which a
+    statement cut out of a text doesn't have."""
+    if isinstance(node, list):
+        return [starts(x) for x in node]
+    if not is_dataclass(node):
+        return node
+    return (type(node).__name__,) + tuple(
+        getattr(node, f.name).start
+        if isinstance(getattr(node, f.name), SourceSpan) else
+        starts(getattr(node, f.name))
+        for f in fields(node)
+    )
+
+def split(text):
+    def parse(chunk, line):
+        if parser.IMPORT.match(chunk):
+            return parser.parse_import(chunk, first_line=line)
+        return parser.parse_stmt(chunk, first_line=line)
+    stmts = []
+    for _, _, stmt in parser.merge_statements(
+        parser.split_statements(text.splitlines(keepends=True)), parse,
+    ):
+        if isinstance(stmt, Exception):
+            raise stmt
+        stmts.append(stmt)
+    return stmts
+
+@pytest.mark.parametrize('example', readme_examples())
+def test_readme_example(example):
+    module = parser.parse_module(StringIO(example))
+    assert starts(split(example)) == starts(module.imports + module.body)
+
+def test_continuation_lines():
+    text = (
+        '1 x bowl = 50 g oats\n'
+        '  + 6 g fat\n'
+        '\n'
+        'solve 0 to 2 cup oats\n'
+        'for at least 60 g protein\n'
+        'print 1 x bowl\n'
+    )
+    module = parser.parse_module(StringIO(text))
+    assert starts(split(text)) == starts(module.body)
+    assert [line for line, _ in parser.split_statements(
+        text.splitlines(keepends=True),
+    )] == [0, 3, 5]
+
+def test_merge_after_failure():
+    parse = lambda text, line: parser.parse_stmt(text, None, line)
+    # Cut in two, the statement only parses joined again.
+    merged = parser.merge_statements(
+        [(0, 'print only a, b\n'), (2, '  1 g oats\n')], parse,
+    )
+    [(line, text, stmt)] = merged
+    assert (line, text) == (0, 'print only a, b\n\n  1 g oats\n')
+    assert stmt.body.location.start == (2, 2)
+    # A statement failing anyway is reported, and the next parsed by itself.
+    merged = parser.merge_statements(
+        [(0, 'print 1 g\n'), (1, 'print 1 g oats\n')], parse,
+    )
+    [(_, _, error), (_, _, stmt)] = merged
+    assert isinstance(error, parser.LocatedParseError)
+    assert isinstance(stmt, parser.PrintStmt)
@@ -1,7 +1,5 @@
 from browser import bind, document, worker, window
 
-TIMEOUT_MS = 1000
-
 import nutcalc
 
 WORKER = None
@@ -1,29 +1,6 @@
 # from browser import bind, self
 
-# Message types
-# =============
-# 
-# Sometimes, the PY side that it cannot complete a request unless more information is provided.
-# (e.g. another module's code is needed from the JS side)
-# In that case, _while processing a request from the JS side,_ the PY side makes a request to the JS side.
-# 
-# Therefore, either side can send this message to the other side, to provide a response to a request:
-# 
-# - { type: 'response': of: string, data: any }
-#     - `of` holds the ID of the request
-# 
-# JS -> PY
-# - { type: 'load-module', id: string, name: string, contents: string }
-#     -> loads the module with the given contents and the given name. The name is crucial for the import mechanism.
-# - { type: 'eval', id: string, contents: string }
-#     -> executes a single statement of nutcalc code
-#     
-# Each core request comes with an `id` field to identify that particular request.
-# When the nutcalc worker has completed the request, it will send a message back with that ID containing the result.
-#     
-# PY -> JS
-# - { type: 'load-module', id: string, name: string }
-#     - request the code of the module with the given `name`
+# The message types of the worker protocol are documented in nutcalc/protocol.py.
 
 # class Worker():
 #     def __init__(self, context):
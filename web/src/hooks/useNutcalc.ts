@@ -7,7 +7,26 @@ export interface Nutcalc {
   reset: () => Promise<void>;
 }
 
-export default function useNutcalc(): Nutcalc {
+/** Fetches the contents of the named modules, for the worker's batched
+ * import requests. Modules that can't be found are left out of the result.
+ */
+export type ModuleResolver = (
+  names: string[],
+) => Promise<Record<string, string>>;
+
+const fetchModules: ModuleResolver = async (names) => {
+  const found = await Promise.all(
+    names.map(async (name) => {
+      const response = await fetch(`modules/${name}.nut`);
+      return response.ok ? [name, await response.text()] : null;
+    }),
+  );
+  return Object.fromEntries(found.filter((x) => x !== null));
+};
+
+export default function useNutcalc(
+  resolveModules: ModuleResolver = fetchModules,
+): Nutcalc {
   const continuations = useRef(new Map());
   const nutcalcReady = useRef(undefined);
 
@@ -44,6 +63,13 @@ export default function useNutcalc(): Nutcalc {
         return payload.success
           ? k.onSuccess(payload.data)
           : k.onFailure(payload.error);
+      case "load-modules":
+        // One request for all the modules the worker is missing so far
+        return resolveModules(msg.names).then(
+          (modules) => respondToNutcalc(msg, { success: true, data: modules }),
+          (e) =>
+            respondToNutcalc(msg, { success: false, error: e?.toString() }),
+        );
       default:
         console.warn("unknown Nutcalc message type: " + msg.type);
     }
@@ -54,6 +80,9 @@ export default function useNutcalc(): Nutcalc {
     document.dispatchEvent(new CustomEvent(key, { detail: data }));
   };
 
+  const respondToNutcalc = (msg: any, data: any) =>
+    sendToNutcalc({ type: "response", of: msg.id, data });
+
   const nutcalc: Nutcalc = {
     request: (data: any, key = "nutcalc_to"): Promise<any> =>
       new Promise((resolve, reject) => {